@@ -1,25 +1,101 @@
+import asyncio
+import time
 import discord
-from database.utils import ensure_server_exists_in_db
+from database.aio import register_servers
+from utils.components import handle_component
+from utils.instrumentation import install_response_timing, note_response
+from utils.metrics import command_timer
+from utils.startup import StartupTimer
 
 cogs_list = [
     'random',
     'shop',
     'utils',
     'list',
+    'stats',
+    'card',
     'help'
 ]
 
 
-class MyBot(discord.bot.Bot):
-    def __init__(self, *args, **kwargs):
+class MyBot(discord.AutoShardedBot):
+    """
+    The bot, on one or more gateway shards.
+
+    With no shard_ids it runs every shard (as many as Discord recommends unless shard_count is
+    given); the launcher in main.py gives each worker process its own range of shard ids.
+
+    load_state, if given, loads the catalog and the in-memory caches on a thread of its own
+    while the shards log in; interactions wait for it rather than find them half loaded.
+    """
+    def __init__(self, *args, identify_gate=None, load_state=None, **kwargs):
         super().__init__(*args, **kwargs)
+        self.identify_gate = identify_gate
+        self.load_state = load_state
+        self.state_loaded = None
+        self.login_started = None
+        self.registered_guilds = set()
+        install_response_timing()
         for cog in cogs_list:
             self.load_extension(f'cogs.{cog}')
 
+    async def start(self, *args, **kwargs):
+        if self.login_started is None:
+            self.login_started = time.perf_counter()
+        if self.state_loaded is None and self.load_state is not None:
+            self.state_loaded = asyncio.get_running_loop().run_in_executor(None, self.load_state)
+        await super().start(*args, **kwargs)
+
+    async def wait_for_state(self):
+        state = self.state_loaded
+        if state is not None:
+            if not state.done():
+                # Shielded: an interaction that gives up waiting must not cancel the load for everyone else.
+                await asyncio.shield(state)
+            state.result()  # raises if loading failed
+
+    async def invoke_application_command(self, ctx):
+        with command_timer(f"/{ctx.command.qualified_name}", ctx.guild_id) as timing:
+            try:
+                await super().invoke_application_command(ctx)
+            finally:
+                note_response(ctx.interaction, timing)
+
+    async def on_interaction(self, interaction):
+        await self.wait_for_state()
+        # Buttons and selects carry their state in their custom_id and are routed here rather than through stored views.
+        if await handle_component(interaction):
+            return
+        await super().on_interaction(interaction)
+
+    async def before_identify_hook(self, shard_id, *, initial=False):
+        if self.identify_gate is None:
+            await super().before_identify_hook(shard_id, initial=initial)
+        else:
+            await self.identify_gate.wait(shard_id)
+
+    async def on_shard_ready(self, shard_id):
+        print(f'Shard {shard_id} ready.')
+
     async def on_ready(self):
+        ready = time.perf_counter()
         print(f'Logged in as {self.user} (ID: {self.user.id})')
         print('------')
-        for guild in self.guilds:
-            ensure_server_exists_in_db(guild.id)
+        await self.wait_for_state()
+
+        # on_ready fires again after a reconnect; only the guilds joined since then are new.
+        registering = time.perf_counter()
+        guild_ids = [guild.id for guild in self.guilds if guild.id not in self.registered_guilds]
+        if guild_ids:
+            added = await register_servers(guild_ids)
+            self.registered_guilds.update(guild_ids)
+            if added:
+                print(f'Registered {added} new guilds.')
+
+        timer = StartupTimer.get_instance()
+        if not timer.reported:
+            timer.record('gateway', ready - (self.login_started or ready))
+            timer.record('guilds', time.perf_counter() - registering)
+            timer.report()
 
     
\ No newline at end of file
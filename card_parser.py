@@ -1,81 +1,318 @@
-
-import sqlite3
+import argparse
 import csv
+import sqlite3
+import unicodedata
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+from database.catalog import RARITY_RANK
+from database.ownership import rebuild_bits
+from utils.connection import connect, shard_path
 
-def add_card_to_db(name, collection_id, rarity, title, quote, image_url):
-    conn = sqlite3.connect("database.sqlite")
-    cur = conn.cursor()
-    try:
-        
-        cur.execute("SELECT * FROM Card WHERE name = ?", (name,))
-        if cur.fetchone():
-            print(f"Updating card with name '{name}'.")
-            cur.execute("UPDATE Card SET collectionID = ?, rarity = ?, title = ?, quote = ?, imageURL = ? WHERE name = ?", (collection_id, rarity, title, quote, image_url, name))
-        else:
-            cur.execute("INSERT INTO Card (name, collectionID, rarity, title, quote, imageURL) VALUES (?, ?, ?, ?, ?, ?)", (name, collection_id, rarity, title, quote, image_url))
-        conn.commit()
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e}")
-    finally:
-        conn.close()
+
+COLLECTIONS = {
+    1: 'Forsaken',
+    2: 'Scourge',
+    3: 'Alliance',
+    4: 'Night Elves',
+    5: 'Scarlet Crusade',
+    6: 'Horde',
+    7: 'Old Gods',
+    8: 'Blackrock',
+    9: 'Dragon Flights',
+    10: "Quel'Thalas",
+}
+
+# Byte sequences left behind when UTF-8 text was decoded as Windows-1252 (e.g. "lâ€™" for "l’").
+MOJIBAKE_MARKERS = ('â€', 'Ã', 'Â')
+
+
+class CardRow(NamedTuple):
+    name: str
+    collection_id: int
+    rarity: str
+    title: str
+    quote: str
+    image_url: str
 
 
 def adjusted_custom_parser(line):
-    
+
     reader = csv.reader([line], skipinitialspace=True)
     for row in reader:
-        
+
         if len(row) == 6:
             return [field.strip() for field in row]
 
-    
-    
+
+
     parts = line.split(',')
     if len(parts) < 6:
         return None
 
-    
+
     name = parts[0].strip()
     collection_id = parts[1].strip()
     rarity = parts[2].strip()
     title = parts[3].strip()
 
-    
+
     image_url = parts[-1].strip()
 
-    
+
     quote = ','.join(parts[4:-1]).strip()
 
     return name, collection_id, rarity, title, quote, image_url
 
 
+def fix_mojibake(text: str) -> str:
+    """
+    Repairs UTF-8 text that was mis-decoded as Windows-1252, and normalises it to NFC.
+
+    Text that does not look mis-decoded, or that does not round-trip cleanly, is returned as is.
+    """
+    if any(marker in text for marker in MOJIBAKE_MARKERS):
+        try:
+            text = text.encode('cp1252').decode('utf-8')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return unicodedata.normalize('NFC', text)
+
+
+def normalize_row(fields) -> Tuple[Optional[CardRow], Optional[str]]:
+    """
+    Validates and normalises one parsed CSV line.
+
+    Returns:
+        Tuple[Optional[CardRow], Optional[str]]: The normalised row, or None and the reason it was rejected.
+    """
+    name, collection_id, rarity, title, quote, image_url = (fix_mojibake(field.strip()) for field in fields)
+
+    if not name:
+        return None, "missing name"
+    try:
+        collection_id = int(collection_id)
+    except ValueError:
+        return None, f"invalid collection id '{collection_id}'"
+    if collection_id not in COLLECTIONS:
+        return None, f"unknown collection id {collection_id}"
+    rarity = rarity.lower()
+    if rarity not in RARITY_RANK:
+        return None, f"unknown rarity '{rarity}'"
+    if not image_url.startswith(('http://', 'https://')):
+        return None, f"invalid image URL '{image_url}'"
+
+    return CardRow(name, collection_id, rarity, title, quote, image_url), None
+
+
+def parse_file(file_path: str) -> Iterator[Tuple[int, Optional[CardRow], Optional[str]]]:
+    """Streams the CSV, yielding (line number, row, error) for every non-blank line."""
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            fields = adjusted_custom_parser(line)
+            if fields is None:
+                yield line_number, None, "not enough fields"
+                continue
+            row, error = normalize_row(fields)
+            yield line_number, row, error
+
 
+def load_rows(file_path: str) -> Tuple[List[CardRow], List[str]]:
+    """
+    Parses the whole CSV into valid rows, keyed on card name (the last occurrence wins).
 
-def delete_encoding_errors():
-    conn = sqlite3.connect("database.sqlite")
+    Returns:
+        Tuple[List[CardRow], List[str]]: The valid rows and a message for every rejected or duplicate line.
+    """
+    rows: Dict[str, CardRow] = {}
+    problems = []
+    for line_number, row, error in parse_file(file_path):
+        if error:
+            problems.append(f"line {line_number}: skipped, {error}")
+        elif row.name in rows:
+            problems.append(f"line {line_number}: duplicate of '{row.name}', later line wins")
+            rows[row.name] = row
+        else:
+            rows[row.name] = row
+    return list(rows.values()), problems
+
+
+def move_ownership(cur, from_card: int, to_card: int):
+    """Gives everyone who owns from_card to_card instead, and rebuilds their ownership bitmaps."""
+    cur.execute("SELECT DISTINCT userID, serverID FROM UserCard WHERE cardID = ?", (from_card,))
+    owners = cur.fetchall()
+    cur.execute("INSERT OR IGNORE INTO UserCard (userID, serverID, cardID) "
+                "SELECT userID, serverID, ? FROM UserCard WHERE cardID = ?", (to_card, from_card))
+    cur.execute("DELETE FROM UserCard WHERE cardID = ?", (from_card,))
+    rebuild_bits(cur, owners)
+
+
+def repair_encoding(cur) -> List[Tuple[int, int]]:
+    """
+    Renames cards whose stored name is mojibake, so the upsert updates them in place.
+
+    If the repaired name already exists, ownership is moved to that card and the broken one
+    is dropped, instead of deleting owned cards outright.
+
+    Returns:
+        List[Tuple[int, int]]: (broken card, card it was merged into) for every card dropped; the rest were renamed.
+    """
+    cur.execute("SELECT id, name FROM Card")
+    broken = [(card_id, name, fix_mojibake(name)) for card_id, name in cur.fetchall()]
+    broken = [(card_id, name, fixed) for card_id, name, fixed in broken if fixed != name]
+
+    merged = []
+    for card_id, name, fixed in broken:
+        cur.execute("SELECT id FROM Card WHERE name = ?", (fixed,))
+        existing = cur.fetchone()
+        if existing is None:
+            cur.execute("UPDATE Card SET name = ? WHERE id = ?", (fixed, card_id))
+        else:
+            move_ownership(cur, card_id, existing[0])
+            cur.execute("DELETE FROM Card WHERE id = ?", (card_id,))
+            merged.append((card_id, existing[0]))
+    if broken:
+        print(f"Repaired {len(broken)} card name(s) with encoding errors.")
+    return merged
+
+
+def move_sharded_ownership(cur, database: str, merged: List[Tuple[int, int]]):
+    """
+    Applies the ownership moves of repair_encoding() to every shard file, in sharded storage.
+
+    Runs before the catalog commits: if it is interrupted, the broken cards are still there and
+    the next import moves whatever is left.
+    """
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'StorageLayout'")
+    if not merged or not cur.fetchone():
+        return
+    cur.execute("SELECT shardCount FROM StorageLayout")
+    shard_count = cur.fetchone()[0]
+    for shard in range(shard_count):
+        # With the catalog attached, so the bitmaps are rebuilt from the card ordinals.
+        shard_conn = connect(shard_path(database, shard, shard_count), catalog=database)
+        try:
+            with shard_conn:
+                shard_cur = shard_conn.cursor()
+                for from_card, to_card in merged:
+                    move_ownership(shard_cur, from_card, to_card)
+        finally:
+            shard_conn.close()
+
+
+def diff_catalog(cur, rows: List[CardRow]) -> Dict[str, List[str]]:
+    """Compares the parsed rows with the Card table."""
+    cur.execute("SELECT name, collectionID, rarity, title, quote, imageURL FROM Card")
+    current = {row[0]: CardRow(*row) for row in cur.fetchall()}
+
+    diff = {'added': [], 'updated': [], 'unchanged': [], 'not in file': []}
+    for row in rows:
+        existing = current.pop(row.name, None)
+        if existing is None:
+            diff['added'].append(row.name)
+        elif existing != row:
+            diff['updated'].append(row.name)
+        else:
+            diff['unchanged'].append(row.name)
+    diff['not in file'] = sorted(current)
+    return diff
+
+
+def import_cards(rows: List[CardRow], database: str = "database.sqlite", dry_run: bool = False) -> Dict[str, List[str]]:
+    """
+    Upserts the collections and cards in a single transaction.
+
+    Args:
+        rows (List[CardRow]): The normalised rows to import.
+        database (str): Path to the SQLite database.
+        dry_run (bool): Compute the diff and roll back instead of committing.
+
+    Returns:
+        Dict[str, List[str]]: Card names grouped into added, updated, unchanged and not in file.
+    """
+    conn = connect(database)
+    conn.isolation_level = None
     cur = conn.cursor()
     try:
-        
-        cur.execute("DELETE FROM Card WHERE name LIKE '%lâ€™%' OR title LIKE '%lâ€™%' OR quote LIKE '%lâ€™%'")
-        conn.commit()
-        print(f"Deleted entries with encoding errors.")
+        cur.execute("BEGIN IMMEDIATE")
+        merged = repair_encoding(cur)
+
+        cur.executemany("INSERT INTO Collection (name) VALUES (?) ON CONFLICT(name) DO NOTHING",
+                        [(name,) for _, name in sorted(COLLECTIONS.items())])
+        cur.execute("SELECT name, id FROM Collection")
+        collection_ids = dict(cur.fetchall())
+        # The CSV numbers collections itself; map those numbers onto the database's ids.
+        rows = [row._replace(collection_id=collection_ids[COLLECTIONS[row.collection_id]]) for row in rows]
+
+        diff = diff_catalog(cur, rows)
+
+        cur.executemany("""
+        INSERT INTO Card (name, collectionID, rarity, title, quote, imageURL) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET
+            collectionID = excluded.collectionID,
+            rarity = excluded.rarity,
+            title = excluded.title,
+            quote = excluded.quote,
+            imageURL = excluded.imageURL
+        WHERE (collectionID, rarity, title, quote, imageURL)
+              IS NOT (excluded.collectionID, excluded.rarity, excluded.title, excluded.quote, excluded.imageURL)
+        """, rows)
+
+        cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'CardFTS'")
+        if cur.fetchone():
+            # The triggers keep the index in step; rebuilding also covers rows edited by hand.
+            cur.execute("INSERT INTO CardFTS (CardFTS) VALUES ('rebuild')")
+        # A running bot polls the revision and reloads its catalog, prefix index included, when it changes.
+        cur.execute("PRAGMA user_version")
+        cur.execute(f"PRAGMA user_version = {cur.fetchone()[0] + 1}")
+
+        if not dry_run:
+            move_sharded_ownership(cur, database, merged)
+        cur.execute("ROLLBACK" if dry_run else "COMMIT")
+        return diff
     except sqlite3.Error as e:
+        cur.execute("ROLLBACK")
         print(f"An error occurred: {e}")
+        return {}
     finally:
         conn.close()
 
 
+def render_card_list(rows: List[CardRow]) -> str:
+    """Renders the markdown card list, ordered by collection, then from common to legendary, then name."""
+    ordered = sorted(rows, key=lambda row: (COLLECTIONS[row.collection_id], -RARITY_RANK[row.rarity], row.name))
+    lines = ["| Name | Collection | Rarity | Title | Quote | Image |", "| --- | --- | --- | --- | --- | --- |"]
+    for row in ordered:
+        cells = (row.name, COLLECTIONS[row.collection_id], row.rarity, row.title, row.quote, f"![{row.name}]({row.image_url})")
+        lines.append("| " + " | ".join(cell.replace('|', '\\|') for cell in cells) + " |")
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import the card catalog from a CSV file.")
+    parser.add_argument('file_path', nargs='?', default='cards.csv')
+    parser.add_argument('--database', default='database.sqlite')
+    parser.add_argument('--dry-run', action='store_true', help="report what would change without writing")
+    parser.add_argument('--card-list', metavar='PATH', nargs='?', const='cardList.md',
+                        help="also rebuild the markdown card list (default: cardList.md)")
+    args = parser.parse_args(argv)
+
+    rows, problems = load_rows(args.file_path)
+    for problem in problems:
+        print(problem)
+
+    diff = import_cards(rows, args.database, dry_run=args.dry_run)
+    for change in ('added', 'updated', 'not in file'):
+        for name in diff.get(change, []):
+            print(f"{change}: {name}")
+    summary = ", ".join(f"{len(names)} {change}" for change, names in diff.items())
+    print(f"{'Dry run' if args.dry_run else 'Imported'}: {len(rows)} cards ({summary}).")
+
+    if args.card_list and not args.dry_run:
+        with open(args.card_list, 'w', encoding='utf-8') as file:
+            file.write(render_card_list(rows))
+        print(f"Wrote {args.card_list}.")
 
-def process_file(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        for line in file:
-            parsed_line = adjusted_custom_parser(line)
-            if parsed_line:
-                add_card_to_db(*parsed_line)
-            else:
-                print(f"Skipping invalid line: {line.strip()}")
 
 if __name__ == "__main__":
-    file_path = 'cards.csv'  
-    delete_encoding_errors()
-    process_file(file_path)
+    main()
@@ -0,0 +1,45 @@
+import discord
+from discord.ext import commands
+from database.aio import complete_card_names, search_cards, check_card_ownership
+from database.catalog import CardCatalog
+from utils.render import card_embed
+
+
+async def card_name_choices(ctx: discord.AutocompleteContext):
+    cards = await complete_card_names(ctx.value or "")
+    if not cards and len((ctx.value or "").strip()) >= 3:
+        # Nothing starts with what was typed; fall back to the full-text index, which also searches titles and quotes.
+        cards = await search_cards(ctx.value)
+    return [card.name for card in cards]
+
+
+class Card(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @discord.slash_command(description="Look up a card by name, title or quote")
+    async def card(self, ctx, query: discord.Option(str, "The card's name, or words from its title or quote", autocomplete=card_name_choices)):
+        try:
+            card = CardCatalog.get_instance().get_by_name(query)
+            matches = [card] if card else await search_cards(query)
+            if not matches:
+                await ctx.respond(f"No card matches '{query}'.", ephemeral=True)
+                return
+
+            if len(matches) > 1:
+                lines = [f"**{match.name}** — {match.title} ({match.rarity}, {match.collection})" for match in matches]
+                embed = discord.Embed(title=f"Cards matching '{query}'", description="\n".join(lines), color=discord.Color.blue())
+                embed.set_footer(text="Pick one from the suggestions to see it in full.")
+                await ctx.respond(embed=embed, ephemeral=True)
+                return
+
+            card = matches[0]
+            owned = await check_card_ownership(ctx.author.id, card.id, ctx.guild.id)
+            embed = card_embed(card, f"{card.quote} | {'In your collection' if owned else 'Not in your collection'}")
+            await ctx.respond(embed=embed, ephemeral=True)
+        except Exception as e:
+            await ctx.respond(f"An error occurred: {e}", ephemeral=True)
+
+
+def setup(bot):
+    bot.add_cog(Card(bot))
@@ -9,10 +9,13 @@ class Help(commands.Cog):
     async def help(self, ctx):
         embed = discord.Embed(title="HoardCraft commands", color=discord.Color.blue())
         embed.add_field(name="`/help`", value="Shows this message.", inline=False)
-        embed.add_field(name="`/random`", value="Randomly drops a card amongst all cards.", inline=False)
+        embed.add_field(name="`/random`", value="Randomly drops a card amongst all cards. Add `count` to pull several at once.", inline=False)
         embed.add_field(name="`/shop`", value="Displays the shop : 3 random cards you can buy with dust.", inline=False)
         embed.add_field(name="`/list`", value="Displays your card collection.", inline=False)
         embed.add_field(name="`/checkdust`", value="Check your dust balance.", inline=False)
+        embed.add_field(name="`/card`", value="Looks up a card by name, title or quote.", inline=False)
+        embed.add_field(name="`/leaderboard`", value="Shows the server's top collectors, or its richest users by dust.", inline=False)
+        embed.add_field(name="`/stats`", value="Shows how much of each collection the server and you have found.", inline=False)
         embed.set_footer(text="Like the bot ? Consider supporting its creator at ko-fi.com/elraptou !")
 
         await ctx.respond(embed=embed, ephemeral=True)
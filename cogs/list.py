@@ -1,9 +1,7 @@
 import discord
 import datetime
 from discord.ext import commands
-from database.cards import get_user_collection
-from database.claim import claim_card, de_claim_card
-from utils.views import PaginatedView, ConfirmView
+from utils.views import PaginatedView
 
 class List(commands.Cog):
     def __init__(self, bot):
@@ -12,9 +10,8 @@ class List(commands.Cog):
     @discord.slash_command(description="List the user's cards")
     async def list(self, ctx):
         try:
-            cards = get_user_collection(ctx.author.id, ctx.guild.id)
-            if cards:
-                view = PaginatedView(cards, ctx.author.name, ctx.author.id)
+            view = PaginatedView(ctx.author.name, ctx.author.id, ctx.guild.id)
+            if await view.load():
                 await ctx.respond("Displaying your collection.", ephemeral=True)
                 await ctx.respond(embed=view.create_embed(), view=view)
             else:
@@ -1,45 +1,59 @@
 import discord
 import datetime
-from discord.ext import commands
-from database.utils import check_user_cooldown, check_card_ownership
-from database.cards import get_random_card
-from database.dust import get_dust_balance, update_dust_balance, calculate_dust_earned
-from utils.views import ClaimView
-
-
-rarity_colors = {
-    'legendary': discord.Colour.orange(),
-    'epic': discord.Colour.purple(),
-    'rare': discord.Colour.dark_blue(),
-    'uncommon': discord.Colour.green(),
-    'common': discord.Colour.greyple(),  
-}
-
-collection_icons= {
-    'forsaken': "https://static.wikia.nocookie.net/wowpedia/images/7/72/Forsaken_Crest.png/revision/latest?cb=20151113054325",
-    'scourge': "https://static.wikia.nocookie.net/wowpedia/images/3/37/Warcraft_III_Reforged_-_Undead_Icon.png/revision/latest?cb=20210227012440",
-    'alliance': "https://static.wikia.nocookie.net/wowpedia/images/d/da/Alliance_Crest.png/revision/latest?cb=20180710141058",
-    'night elves': "https://static.wikia.nocookie.net/wowpedia/images/b/bc/Warcraft_III_Reforged_-_Night_Elves_Icon.png/revision/latest?cb=20210227012747",
-    'scarlet crusade': "https://static.wikia.nocookie.net/wowpedia/images/7/72/Scarlet_Crusade_logo.png/revision/latest?cb=20080730021543",
-    'horde': "https://static.wikia.nocookie.net/wowpedia/images/0/08/Horde_Crest.png/revision/latest?cb=20151113053903",
-    "quel'thalas": "https://static.wikia.nocookie.net/wowpedia/images/d/d9/Icon_of_Blood.png/revision/latest?cb=20151113053547",
-    'dragon flights': "https://static.wikia.nocookie.net/wowpedia/images/a/a4/Dracthyr_Crest.png/revision/latest?cb=20221115173914",
-    'blackrock' : "https://static.wikia.nocookie.net/wowpedia/images/1/1d/Blackrock_Crest.png/revision/latest?cb=20141010174912",
-    'old gods': "https://static.wikia.nocookie.net/wowpedia/images/7/7a/Void_Elf_Crest_%28early%29.png/revision/latest?cb=20171104172306"
-    }
+from discord.ext import commands, tasks
+from database.aio import (
+    check_user_cooldown, check_card_ownership, get_random_card, get_random_cards, settle_pull, update_dust_balance,
+    persist_cooldowns, get_collections, get_drop_rates, set_guild_drop_rates
+)
+from database.catalog import RARITY_ORDER
+from database.dust import calculate_dust_earned
+from utils.cache import REQUEST_LIMIT
+from utils.locks import user_lock
+from utils.render import card_embed
+from utils.views import ClaimView, PullView
+
+
+async def collection_choices(ctx: discord.AutocompleteContext):
+    typed = (ctx.value or "").lower()
+    return [collection for collection in await get_collections() if collection.lower().startswith(typed)]
+
+
+def rate_option(rarity: str):
+    return discord.Option(float, f"Share of drops that are {rarity}, e.g. 0.05; the shares are scaled to add up to 1",
+                          min_value=0, required=False, default=None)
+
 
 class Random(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.persist_cooldown_windows.start()
+
+    def cog_unload(self):
+        self.persist_cooldown_windows.cancel()
 
+    @tasks.loop(minutes=1)
+    async def persist_cooldown_windows(self):
+        await persist_cooldowns()
+
+    @persist_cooldown_windows.before_loop
+    async def before_persist_cooldown_windows(self):
+        await self.bot.wait_until_ready()
     
     @discord.slash_command(description="Get a random card")
-    async def random(self, ctx):
+    async def random(self, ctx, count: discord.Option(int, "How many cards to pull at once", min_value=1, max_value=REQUEST_LIMIT, default=1),
+                     collection: discord.Option(str, "Only draw from this collection", autocomplete=collection_choices, required=False, default=None)):
         try:
-            user_id = str(ctx.author.id)
-            server_id = str(ctx.guild.id)
+            user_id = ctx.author.id
+            server_id = ctx.guild.id
+
+            if collection is not None:
+                # Resolved before the cooldown, so a mistyped collection does not cost a request.
+                collection = next((name for name in await get_collections() if name.lower() == collection.lower()), None)
+                if collection is None:
+                    await ctx.respond("There is no such collection.", ephemeral=True)
+                    return
 
-            can_request, cooldown_end = check_user_cooldown(user_id, server_id)
+            can_request, cooldown_end = await check_user_cooldown(user_id, server_id, count)
             if not can_request:
                 current_time = datetime.datetime.now()
                 if cooldown_end is not None:
@@ -48,41 +62,86 @@ class Random(commands.Cog):
                     minutes, seconds = divmod(remainder, 60)
 
                     time_str = f"{hours}h {minutes}m {seconds}s"
-                    await ctx.respond(f"You have reached your limit of 5 requests per hour. Please wait for {time_str} before trying again.", ephemeral=True)
+                    if count > 1:
+                        await ctx.respond(f"You do not have {count} of your {REQUEST_LIMIT} requests per hour left. Please wait for {time_str} before trying again.", ephemeral=True)
+                    else:
+                        await ctx.respond(f"You have reached your limit of {REQUEST_LIMIT} requests per hour. Please wait for {time_str} before trying again.", ephemeral=True)
                 else:
                     await ctx.respond("You are currently on cooldown, but the remaining time could not be calculated.", ephemeral=True)
                 return
 
-            card = get_random_card()
-            if card:
-                card_id, name, collection_name, title, quote, image_url, rarity = card
+            if count > 1:
+                await self.multi_pull(ctx, count, collection)
+                return
 
-                if check_card_ownership(user_id, card_id, server_id):
-                    dust_earned = calculate_dust_earned(rarity)
-                    update_dust_balance(user_id, server_id, dust_earned)
-                    await ctx.respond(f"You already own {name}. You earned {dust_earned} dust!", ephemeral=True)
+            card = await get_random_card(ctx.guild.id, collection)
+            if card:
+                async with user_lock(user_id, server_id):
+                    duplicate = await check_card_ownership(user_id, card.id, server_id)
+                    if duplicate:
+                        dust_earned = calculate_dust_earned(card.rarity)
+                        await update_dust_balance(user_id, server_id, dust_earned)
+                if duplicate:
+                    await ctx.respond(f"You already own {card.name}. You earned {dust_earned} dust!", ephemeral=True)
                 else:
-                    rarity = rarity.lstrip()
-                    color = rarity_colors.get(rarity, discord.Colour.default())  
-                    icon_url = collection_icons.get(collection_name.lower(), "")  
-
-                    embed = discord.Embed(
-                        title=name,
-                        description=title,
-                        color=color
-                    )
-                    embed.set_thumbnail(url=icon_url)
-                    embed.set_author(name=collection_name)
-                    embed.set_image(url=image_url)
-                    embed.set_footer(text=quote)
-
-                    await ctx.respond(embed=embed, view=ClaimView(card_id, user_id))  
+                    await ctx.respond(embed=card_embed(card), view=ClaimView(card.id, user_id))  
             else:
                 await ctx.respond("No cards available.")
 
         except Exception as e:
             await ctx.respond(f"An error occurred: {e}", ephemeral=True)
 
+    async def multi_pull(self, ctx, count, collection=None):
+        """Draws count distinct cards, credits every duplicate in one go and shows the pull as one paginated message."""
+        user_id = ctx.author.id
+        pulled = await get_random_cards(count, ctx.guild.id, collection)
+        if not pulled:
+            await ctx.respond("No cards available.")
+            return
+
+        async with user_lock(user_id, ctx.guild.id):
+            new_cards, duplicates, dust_earned = await settle_pull(user_id, ctx.guild.id, pulled)
+        summary = f"You pulled {len(pulled)} cards: {len(new_cards)} new"
+        if duplicates:
+            summary += f", {len(duplicates)} you already own for {dust_earned} dust"
+        view = PullView.from_pull(pulled, [card.id for card in new_cards], user_id)
+        await ctx.respond(f"{summary}.", embed=view.create_embed(), view=view)
+
+
+    @discord.slash_command(description="See or change how often each rarity drops on this server")
+    @discord.default_permissions(manage_guild=True)
+    async def droprates(self, ctx, legendary: rate_option('legendary'), epic: rate_option('epic'), rare: rate_option('rare'),
+                        uncommon: rate_option('uncommon'), common: rate_option('common'),
+                        reset: discord.Option(bool, "Go back to the default drop rates", default=False)):
+        try:
+            server_id = ctx.guild.id
+            given = {rarity: weight for rarity, weight in zip(RARITY_ORDER, (legendary, epic, rare, uncommon, common))
+                     if weight is not None}
+            if (given or reset) and not ctx.author.guild_permissions.manage_guild:
+                await ctx.respond("You need the Manage Server permission to change the drop rates.", ephemeral=True)
+                return
+
+            if reset:
+                await set_guild_drop_rates(server_id, None)
+            elif given:
+                # Tiers left out keep their current weight.
+                rates, _ = await get_drop_rates(server_id)
+                try:
+                    await set_guild_drop_rates(server_id, {**rates, **given})
+                except ValueError as e:
+                    await ctx.respond(str(e), ephemeral=True)
+                    return
+
+            rates, overridden = await get_drop_rates(server_id)
+            total = sum(rates.values())
+            embed = discord.Embed(title="Drop rates", color=discord.Color.gold(),
+                                  description="\n".join(f"**{rarity.capitalize()}**: {rates.get(rarity, 0) / total:.2%}"
+                                                         for rarity in RARITY_ORDER))
+            embed.set_footer(text="Set for this server" if overridden else "Default rates")
+            await ctx.respond(embed=embed, ephemeral=True)
+        except Exception as e:
+            await ctx.respond(f"An error occurred: {e}", ephemeral=True)
+
 
 def setup(bot):
     bot.add_cog(Random(bot))
\ No newline at end of file
@@ -1,7 +1,7 @@
 import discord
 import datetime
 from discord.ext import commands
-from database.shop import get_shop_inventory
+from database.aio import get_shop_inventory
 from utils.views import ShopView
 
 class Shop(commands.Cog):
@@ -14,9 +14,10 @@ class Shop(commands.Cog):
         try:
             user_id = ctx.author.id
             server_id = ctx.guild.id
-            shop_inventory = get_shop_inventory(server_id) 
+            shop_inventory = await get_shop_inventory(server_id)
             if shop_inventory:
                 view = ShopView(shop_inventory, user_id, server_id)
+                await view.update_buttons()
                 await ctx.respond(embed=view.create_embed(), view=view)
             else:
                 await ctx.respond("The shop is currently empty.")
@@ -0,0 +1,59 @@
+import discord
+from discord.ext import commands
+from database.aio import get_leaderboard, get_guild_stats, get_collection_completion
+
+leaderboard_titles = {
+    'cards': ("Top collectors", "cards"),
+    'dust': ("Richest users", "dust"),
+}
+
+
+def percent(owned: int, total: int) -> str:
+    return f"{100 * owned / total:.0f}%" if total else "0%"
+
+
+class Stats(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @discord.slash_command(description="Show the server's top collectors or richest users")
+    async def leaderboard(self, ctx, board: discord.Option(str, "What to rank users by", choices=['cards', 'dust'], default='cards')):
+        try:
+            ranking = await get_leaderboard(ctx.guild.id, board)
+            title, unit = leaderboard_titles[board]
+            if not ranking:
+                await ctx.respond("Nobody is on the leaderboard yet.", ephemeral=True)
+                return
+
+            lines = [f"**{rank}.** <@{user_id}> — {score} {unit}" for rank, (user_id, score) in enumerate(ranking, start=1)]
+            embed = discord.Embed(title=title, description="\n".join(lines), color=discord.Color.gold())
+            embed.set_footer(text=ctx.guild.name)
+            await ctx.respond(embed=embed)
+        except Exception as e:
+            await ctx.respond(f"An error occurred: {e}", ephemeral=True)
+
+    @discord.slash_command(description="Show collection statistics for the server and for you")
+    async def stats(self, ctx):
+        try:
+            guild_stats = await get_guild_stats(ctx.guild.id)
+            completion = await get_collection_completion(ctx.author.id, ctx.guild.id)
+
+            embed = discord.Embed(title=f"{ctx.guild.name} statistics", color=discord.Color.blue())
+            embed.add_field(name="Collectors", value=str(guild_stats['collectors']))
+            embed.add_field(name="Cards owned", value=str(guild_stats['cards']))
+            embed.add_field(name="Dust held", value=str(guild_stats['dust']))
+            for collection, (discovered, total) in guild_stats['collections'].items():
+                owned, _ = completion.get(collection, (0, total))
+                embed.add_field(
+                    name=collection,
+                    value=f"Server: {discovered}/{total} ({percent(discovered, total)})\n"
+                          f"You: {owned}/{total} ({percent(owned, total)})",
+                )
+            embed.set_footer(text="Server completion counts the cards owned by at least one member.")
+            await ctx.respond(embed=embed)
+        except Exception as e:
+            await ctx.respond(f"An error occurred: {e}", ephemeral=True)
+
+
+def setup(bot):
+    bot.add_cog(Stats(bot))
@@ -1,21 +1,52 @@
 import discord
 import datetime
-from discord.ext import commands
-from database.utils import reset_cooldown, reset_shop
-from database.dust import get_dust_balance
+from discord.ext import commands, tasks
+from database import dust
+from database.aio import reset_cooldown, reset_shop, get_dust_balance, summarize_ledger, refresh_catalog
+from utils.cache import CACHES
+from utils.metrics import Metrics
+from utils.render import CardEmbeds
+from utils.sharding import ShardAssignment
 
 
 class Utils(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.summarize_dust_ledger.start()
+        self.refresh_card_catalog.start()
+
+    def cog_unload(self):
+        self.summarize_dust_ledger.cancel()
+        self.refresh_card_catalog.cancel()
+
+    @tasks.loop(hours=24)
+    async def summarize_dust_ledger(self):
+        # The ledger covers every guild, so only one worker process summarises it.
+        if dust.ledger_enabled and ShardAssignment.get_instance().primary:
+            await summarize_ledger()
+
+    @summarize_dust_ledger.before_loop
+    async def before_summarize_dust_ledger(self):
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(minutes=1)
+    async def refresh_card_catalog(self):
+        # Picks up a catalog imported by card_parser.py without restarting the bot.
+        if await refresh_catalog():
+            CardEmbeds.get_instance().refresh()
+            print("Card catalog reloaded.")
+
+    @refresh_card_catalog.before_loop
+    async def before_refresh_card_catalog(self):
+        await self.bot.wait_until_ready()
     
     @discord.slash_command(description="Check your dust balance")
     async def checkdust(self, ctx):
         try:
-            user_id = str(ctx.author.id)
-            server_id = str(ctx.guild.id)
+            user_id = ctx.author.id
+            server_id = ctx.guild.id
 
-            dust_balance = get_dust_balance(user_id, server_id)
+            dust_balance = await get_dust_balance(user_id, server_id)
             if dust_balance is not None:
                 thumbnail_url = "https://static.wikia.nocookie.net/hearthstone/images/6/6f/ArcaneDustIcon-62x90.png/revision/latest?cb=20160124205848"
 
@@ -36,10 +67,49 @@ class Utils(commands.Cog):
             await ctx.respond(f"An error occurred: {e}", ephemeral=True)
 
 
+    @discord.slash_command(description="Latency statistics (bot owner only)")
+    async def debugstats(self, ctx):
+        if not await self.bot.is_owner(ctx.author):
+            await ctx.respond("Only the bot owner can use this command.", ephemeral=True)
+            return
+
+        metrics = Metrics.get_instance()
+        embed = discord.Embed(title="Debug statistics", color=discord.Color.dark_grey())
+
+        def ms(seconds):
+            return f"{seconds * 1000:.0f}ms"
+
+        lines = []
+        for name, total, db, respond in metrics.top_commands(8):
+            db_share = db.sum / total.sum if db and total.sum else 0
+            lines.append(f"`{name}` {total.count}x p50 {ms(total.quantile(0.5))} p95 {ms(total.quantile(0.95))}, "
+                         f"{db_share:.0%} in DB" + (f", reply p95 {ms(respond.quantile(0.95))}" if respond else ""))
+        embed.add_field(name="Commands by total time", value=("\n".join(lines) or "Nothing yet.")[:1024], inline=False)
+
+        lines = []
+        for guild_id, count, seconds in metrics.top_guilds(5):
+            guild = self.bot.get_guild(guild_id)
+            lines.append(f"{guild.name if guild else guild_id}: {count} commands, {seconds:.1f}s")
+        embed.add_field(name="Guilds by total time", value=("\n".join(lines) or "Nothing yet.")[:1024], inline=False)
+
+        lines = [f"`{label[:60]}` {stats.count}x {stats.seconds:.2f}s, max {ms(stats.max_seconds)}"
+                 for label, stats in metrics.top_queries(5)]
+        embed.add_field(name="Statements by total time", value=("\n".join(lines) or "Nothing yet.")[:1024], inline=False)
+
+        lines = [f"`{name}` {cache.hits / (cache.hits + cache.misses):.0%} hits, {len(cache):,}/{cache.max_size:,} entries"
+                 for name, cache in sorted(CACHES.items()) if cache.hits + cache.misses]
+        embed.add_field(name="Caches", value=("\n".join(lines) or "Nothing yet.")[:1024], inline=False)
+
+        lines = [f"{ms(seconds)} `{label[:60]}`" + (f"\n↳ {plan[:100]}" if plan else "")
+                 for _, label, seconds, plan in list(metrics.slow_queries)[-3:]]
+        embed.add_field(name="Recent slow queries", value=("\n".join(lines) or "None.")[:1024], inline=False)
+
+        await ctx.respond(embed=embed, ephemeral=True)
+
     # @commands.has_permissions(administrator=True)
     # @discord.slash_command(description="Reset cooldown for admins")
     # async def resetcooldown(self, ctx):
-    #     reset_cooldown(str(ctx.author.id), str(ctx.guild.id))   
+    #     await reset_cooldown(ctx.author.id, ctx.guild.id)   
     #     await ctx.respond("Your cooldown has been reset.", ephemeral=True)
         
     
@@ -47,7 +117,7 @@ class Utils(commands.Cog):
     # @commands.has_permissions(administrator=True)
     # @discord.slash_command(description="Reset shop for admins")
     # async def resetshop(self, ctx):
-    #     reset_shop(str(ctx.guild.id))   
+    #     await reset_shop(ctx.guild.id)   
     #     await ctx.respond("The shop has been reset.", ephemeral=True)
     
 def setup(bot):
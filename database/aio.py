@@ -0,0 +1,196 @@
+"""
+Awaitable versions of the data-layer functions.
+
+Writes are forwarded to the dedicated database thread and reads to the reader threads, so
+SQLite queries and commits never block the gateway event loop. The per-action writes behind
+claims, crafts and dust rewards are group-committed through database.batch. Cogs and views
+should import from here rather than from the synchronous modules.
+"""
+import asyncio
+import datetime
+from typing import Dict, Optional, Tuple, List
+from database import cards, claim, dust, ownership, shop
+from database.catalog import CardCatalog, CardRecord
+from database.ownership import OwnershipStore
+from database.stats import GuildStats
+from database import utils as db_utils
+from database.batch import WriteBatcher
+from utils.cache import RateLimiter
+from utils.connection import DatabaseConnection
+from utils.drops import DropEngine
+from utils.executor import DatabaseExecutor
+from utils.metrics import db_timer
+
+
+async def _run(func, *args):
+    with db_timer():
+        return await DatabaseExecutor.get_instance().run(func, *args)
+
+
+async def _read(func, *args):
+    with db_timer():
+        return await DatabaseExecutor.get_instance().run_read(func, *args)
+
+
+async def _run_for(server_id: int, func, *args):
+    with db_timer():
+        return await DatabaseExecutor.get_instance().run_for_guild(server_id, func, *args)
+
+
+async def _write(server_id: int, func, *args):
+    with db_timer():
+        return await WriteBatcher.for_guild(server_id).submit(func, *args)
+
+
+async def get_random_card(server_id: Optional[int] = None, collection: Optional[str] = None) -> Optional[CardRecord]:
+    # Served from the in-memory catalog, no need for a round-trip to the database thread.
+    return cards.get_random_card(server_id, collection)
+
+
+async def get_random_cards(count: int, server_id: Optional[int] = None, collection: Optional[str] = None) -> List[CardRecord]:
+    return cards.get_random_cards(count, server_id, collection)
+
+
+async def get_drop_rates(server_id: int) -> Tuple[Dict[str, float], bool]:
+    # The server's drop-rate profile and whether it overrides the global one; in memory.
+    engine = DropEngine.get_instance()
+    return dict(engine.profile_rates(server_id)), int(server_id) in engine.guild_rates
+
+
+async def set_guild_drop_rates(server_id: int, rates: Optional[Dict[str, float]]):
+    return await _run_for(server_id, DropEngine.get_instance().set_guild_rates, server_id, rates)
+
+
+async def complete_card_names(prefix: str) -> List[CardRecord]:
+    # Answered by the catalog's in-memory prefix index, well within the autocomplete deadline.
+    return CardCatalog.get_instance().complete(prefix)
+
+
+async def search_cards(query: str, limit: int = cards.SEARCH_LIMIT) -> List[CardRecord]:
+    return await _read(cards.search_cards, query, limit)
+
+
+async def refresh_catalog() -> bool:
+    return await _read(CardCatalog.get_instance().refresh)
+
+
+async def get_collections() -> List[str]:
+    return cards.get_collections()
+
+
+async def claim_card(user_id: int, card_id: int, server_id: int) -> bool:
+    return await _write(server_id, claim.claim_card, user_id, card_id, server_id)
+
+
+async def claim_cards(user_id: int, card_ids: List[int], server_id: int) -> List[int]:
+    return await _write(server_id, claim.claim_cards, user_id, card_ids, server_id)
+
+
+async def settle_pull(user_id: int, server_id: int, pulled: List[CardRecord]) -> Tuple[List[CardRecord], List[CardRecord], int]:
+    return await _write(server_id, claim.settle_pull, user_id, server_id, pulled)
+
+
+async def de_claim_card(user_id: int, card_id: int, server_id: int) -> bool:
+    return await _write(server_id, claim.de_claim_card, user_id, card_id, server_id)
+
+
+async def get_dust_balance(user_id: int, server_id: int) -> int:
+    # Answered from the balance cache when the balance is in it; only a miss goes to a reader thread.
+    balance = dust.cached_dust_balance(user_id, server_id)
+    if balance is not None:
+        return balance
+    return await _read(dust.get_dust_balance, user_id, server_id)
+
+
+async def update_dust_balance(user_id: int, server_id: int, dust_earned: int, reason: str = 'duplicate'):
+    return await _write(server_id, dust.update_dust_balance, user_id, server_id, dust_earned, reason)
+
+
+async def summarize_ledger() -> int:
+    return await _run(dust.summarize_ledger)
+
+
+async def craft_card(user_id: int, card_id: int, server_id: int, cost: int) -> bool:
+    return await _write(server_id, shop.craft_card, user_id, card_id, server_id, cost)
+
+
+async def get_shop_inventory(server_id: int) -> List[CardRecord]:
+    # Computed from the catalog, no database access.
+    return shop.get_shop_inventory(server_id)
+
+
+async def check_user_dust_balance(user_id: int, server_id: int, cost: int) -> bool:
+    return await get_dust_balance(user_id, server_id) >= cost
+
+
+async def register_servers(server_ids: List[int]) -> int:
+    # One executemany per database file, each on that file's writer thread.
+    by_shard = {}
+    for server_id in server_ids:
+        by_shard.setdefault(DatabaseConnection.shard_of(server_id), []).append(server_id)
+    executor = DatabaseExecutor.get_instance()
+    with db_timer():
+        added = await asyncio.gather(*(executor.run_on_shard(shard, db_utils.register_servers, ids, shard)
+                                       for shard, ids in by_shard.items()))
+    return sum(added)
+
+
+async def check_user_cooldown(user_id: int, server_id: int, count: int = 1) -> Tuple[bool, Optional[datetime.datetime]]:
+    # Answered by the in-memory rate limiter, no database I/O on the common path.
+    return db_utils.check_user_cooldown(user_id, server_id, count)
+
+
+async def persist_cooldowns():
+    return await _run(RateLimiter.get_instance().persist)
+
+
+async def check_card_ownership(user_id: int, card_id: int, server_id: int) -> bool:
+    # Answered from the cached ownership bitmap when there is one; only a miss goes to a reader thread.
+    bits = OwnershipStore.get_instance().cached_bits(user_id, server_id)
+    if bits is not None:
+        return bool(bits & CardCatalog.get_instance().bit(card_id))
+    return await _read(db_utils.check_card_ownership, user_id, card_id, server_id)
+
+
+async def get_leaderboard(server_id: int, board: str = 'cards') -> List[Tuple[int, int]]:
+    # Pre-computed by database.stats as writes commit, so it is read straight from memory.
+    return GuildStats.get_instance().leaderboard(server_id, board)
+
+
+async def get_guild_stats(server_id: int) -> dict:
+    return GuildStats.get_instance().guild_stats(server_id)
+
+
+async def _owned(func, user_id: int, server_id: int, *args):
+    # Pure bitmap arithmetic once the user's bitmap is cached; only a miss goes to a reader thread.
+    if OwnershipStore.get_instance().cached_bits(user_id, server_id) is not None:
+        return func(user_id, server_id, *args)
+    return await _read(func, user_id, server_id, *args)
+
+
+async def count_owned(user_id: int, server_id: int, collection: Optional[str] = None) -> int:
+    return await _owned(ownership.count_owned, user_id, server_id, collection)
+
+
+async def step_owned(user_id: int, server_id: int, card_id: Optional[int], step: int, collection: Optional[str] = None) -> Optional[int]:
+    return await _owned(ownership.step_owned, user_id, server_id, card_id, step, collection)
+
+
+async def get_collection_completion(user_id: int, server_id: int) -> Dict[str, Tuple[int, int]]:
+    return await _read(ownership.get_collection_completion, user_id, server_id)
+
+
+async def compare_collections(user_id: int, other_user_id: int, server_id: int) -> Tuple[List[CardRecord], List[CardRecord], List[CardRecord]]:
+    return await _read(ownership.compare_collections, user_id, other_user_id, server_id)
+
+
+async def get_next_reset_time(server_id: int) -> datetime.datetime:
+    return db_utils.get_next_reset_time(server_id)
+
+
+async def reset_cooldown(user_id: int, server_id: int):
+    return await _run_for(server_id, db_utils.reset_cooldown, user_id, server_id)
+
+
+async def reset_shop(server_id: int):
+    return await _run_for(server_id, db_utils.reset_shop, server_id)
@@ -0,0 +1,130 @@
+"""
+Group commit for high-frequency writes.
+
+Writes submitted from many interactions within a few milliseconds of each other are applied
+in one transaction, so a burst of /random, claims and crafts costs one fsync instead of one
+per action. A submitter is only answered once the transaction holding its write has committed.
+
+In sharded storage each shard file batches and commits on its own, on its own writer thread,
+so the shards' fsyncs overlap instead of queueing behind each other.
+"""
+import asyncio
+from typing import Callable, Dict, List, Optional, Tuple
+from utils.connection import DatabaseConnection
+from utils.executor import DatabaseExecutor
+
+MAX_BATCH_SIZE = 128
+MAX_BATCH_DELAY = 0.002  # seconds a batch stays open for more writes to join
+
+
+def apply_batch(operations: List[Tuple[Callable, tuple]], shard: Optional[int] = None) -> List[Tuple[bool, object]]:
+    """
+    Runs each operation inside a single transaction on the writer connection.
+
+    The data-layer functions open their own transaction(), which nests as a savepoint here,
+    so one failing operation does not undo the others.
+
+    Args:
+        operations (List[Tuple[Callable, tuple]]): The writes, as functions and their arguments.
+        shard (Optional[int]): The shard file every write of the batch goes to, or None for the main database.
+
+    Returns:
+        List[Tuple[bool, object]]: For each operation, whether it succeeded and its result or exception.
+    """
+    db_connection = DatabaseConnection.for_shard(shard)
+    results = []
+    with db_connection.transaction():
+        for func, args in operations:
+            try:
+                results.append((True, func(*args)))
+            except Exception as e:
+                results.append((False, e))
+    return results
+
+
+class WriteBatcher:
+    """The batch queue of one database file: the main database, or a shard with for_guild()."""
+    _instances: Dict[Optional[int], 'WriteBatcher'] = {}
+
+    def __init__(self, shard: Optional[int] = None):
+        self.shard = shard
+        self.pending = []
+        self.wakeup = None
+        self.task = None
+        self.closed = False
+
+    @classmethod
+    def get_instance(cls, shard: Optional[int] = None):
+        if shard not in cls._instances:
+            cls._instances[shard] = cls(shard)
+        return cls._instances[shard]
+
+    @classmethod
+    def for_guild(cls, server_id: int) -> 'WriteBatcher':
+        """The batcher of the database file holding the guild's rows."""
+        return cls.get_instance(DatabaseConnection.shard_of(server_id))
+
+    @classmethod
+    async def close_all(cls):
+        """Closes every batcher, waiting for their queued writes to be committed."""
+        instances, cls._instances = list(cls._instances.values()), {}
+        await asyncio.gather(*(instance.close() for instance in instances))
+
+    async def submit(self, func: Callable, *args):
+        """
+        Queues a synchronous data-layer write and waits until the batch holding it has committed.
+
+        Every write submitted to one batcher must only touch the rows of its database file.
+
+        Returns:
+            Whatever func returned.
+        """
+        if self.closed:
+            raise RuntimeError("The write batcher has been closed.")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((func, args, future))
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = loop.create_task(self._run())
+        self.wakeup.set()
+        return await future
+
+    async def _run(self):
+        while self.pending or not self.closed:
+            await self.wakeup.wait()
+            if len(self.pending) < MAX_BATCH_SIZE and not self.closed:
+                await asyncio.sleep(MAX_BATCH_DELAY)
+            self.wakeup.clear()
+
+            batch, self.pending = self.pending[:MAX_BATCH_SIZE], self.pending[MAX_BATCH_SIZE:]
+            if self.pending:
+                self.wakeup.set()
+            if batch:
+                await self._flush(batch)
+
+    async def _flush(self, batch):
+        try:
+            results = await DatabaseExecutor.get_instance().run_on_shard(
+                self.shard, apply_batch, [(func, args) for func, args, _ in batch], self.shard)
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, _, future), (succeeded, value) in zip(batch, results):
+            if future.done():
+                continue
+            if succeeded:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    async def close(self):
+        """Stops accepting writes and waits for everything already queued to be committed."""
+        self.closed = True
+        if self.task is not None and not self.task.done():
+            self.wakeup.set()
+            await self.task
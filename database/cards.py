@@ -1,99 +1,84 @@
+import re
 import sqlite3
 import datetime
 from sqlite3 import Error
-from typing import Optional, Tuple, List
+from typing import Optional, List, Tuple
+from database.catalog import CardCatalog, CardRecord
 from utils.connection import DatabaseConnection
+from utils.drops import DropEngine
 
 
-def get_random_card() -> Optional[Tuple[int, str, str, str, str, str, str]]:
+def get_random_card(server_id: Optional[int] = None, collection: Optional[str] = None) -> Optional[CardRecord]:
     """
-    Fetches a random card from the database, including its collection name for the icon.
+    Draws a random card from the in-memory catalog, weighted by rarity.
+
+    Args:
+        server_id (Optional[int]): The server's ID, so its drop-rate override applies if it has one.
+        collection (Optional[str]): Only draw from this collection.
 
     Returns:
-        A tuple containing the card's ID, name, collection name, title, quote, imageURL, and rarity if found.
+        The drawn CardRecord, with its collection name resolved.
         None if no card is available.
     """
-    db_connection = DatabaseConnection.get_instance()
-    cursor = db_connection.get_cursor()
-    
-    try:
-        cursor.execute("""
-        SELECT c.id, c.name, co.name, c.title, c.quote, c.imageURL, c.rarity FROM Card c
-        JOIN Collection co ON c.collectionID = co.id
-        ORDER BY RANDOM()
-        LIMIT 1;
-        """)
-        card = cursor.fetchone()
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e}")
-        return None
-    
-    return card if card else None
+    return DropEngine.get_instance().draw(server_id, collection)
 
-def get_user_collection(user_id: str, server_id: int) -> Optional[list]:
-    db_connection = DatabaseConnection.get_instance()
-    cursor = db_connection.get_cursor()
-    
-    try:
-        cursor.execute("""
-        SELECT ca.name, co.name, ca.title, ca.quote, ca.imageURL, ca.rarity FROM UserCard uc
-        JOIN Card ca ON uc.cardID = ca.id
-        JOIN Collection co ON ca.collectionID = co.id
-        WHERE uc.userID = ? AND uc.serverID = ?
-        ORDER BY CASE ca.rarity
-            WHEN 'legendary' THEN 1
-            WHEN 'epic' THEN 2
-            WHEN 'rare' THEN 3
-            WHEN 'uncommon' THEN 4
-            WHEN 'common' THEN 5
-        END, ca.name;
-        """, (user_id, server_id))
-        cards = cursor.fetchall()
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e}")
-        return None
 
-    
-    return cards if cards else None
+def get_random_cards(count: int, server_id: Optional[int] = None, collection: Optional[str] = None) -> List[CardRecord]:
+    """
+    Draws up to count distinct random cards from the in-memory catalog, weighted by rarity.
+
+    Args:
+        count (int): The number of cards to draw.
+        server_id (Optional[int]): The server's ID, so its drop-rate override applies if it has one.
+        collection (Optional[str]): Only draw from this collection.
+
+    Returns:
+        List[CardRecord]: The drawn cards; fewer than count only if the catalog (or collection) is that small.
+    """
+    return DropEngine.get_instance().draw_many(count, server_id, collection)
 
 
 def get_collections() -> List[str]:
-    """ Fetch all distinct collections from the database. """
-    db_connection = DatabaseConnection.get_instance()
-    cursor = db_connection.get_cursor()
+    """ Fetch all distinct collections from the catalog. """
+    return list(CardCatalog.get_instance().collections)
 
-    try:
-        cursor.execute("SELECT DISTINCT name FROM Collection")
-        rows = cursor.fetchall()
-        return [row[0] for row in rows]
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e}")
-        return []
 
+SEARCH_LIMIT = 10
+
+# A match in the name outranks one in the title, which outranks one in the quote.
+SQL_SEARCH_CARDS = """
+        SELECT rowid FROM CardFTS WHERE CardFTS MATCH ?
+        ORDER BY bm25(CardFTS, 10.0, 4.0, 1.0)
+        LIMIT ?;
+        """
+
+
+def search_cards(query: str, limit: int = SEARCH_LIMIT) -> List[CardRecord]:
+    """
+    Full-text search over card names, titles and quotes.
+
+    Every word of the query must appear, as a whole word or the start of one, and accents are ignored.
+
+    Args:
+        query (str): Free text typed by the user.
+        limit (int): The most cards to return.
+
+    Returns:
+        List[CardRecord]: The matching cards, best match first.
+    """
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        return []
+    # Quoting every term keeps user input from being read as FTS5 query syntax.
+    match = " ".join(f'"{term}"*' for term in terms)
 
-        
-def fetch_cards_by_collection(user_id: str, collection_name: str) -> List[Tuple]:
     db_connection = DatabaseConnection.get_instance()
-    cur = db_connection.get_cursor()
     try:
-            cur.execute("""
-            SELECT c.name, co.name, c.title, c.quote, c.imageURL, c.rarity 
-            FROM Card c
-            JOIN Collection co ON c.collectionID = co.id
-            JOIN UserCard uc ON c.id = uc.cardID
-            WHERE uc.userID = ? AND LOWER(co.name) = LOWER(?)
-            ORDER BY CASE c.rarity
-                WHEN 'legendary' THEN 1
-                WHEN 'epic' THEN 2
-                WHEN 'rare' THEN 3
-                WHEN 'uncommon' THEN 4
-                WHEN 'common' THEN 5
-            END, c.name;
-            """, (user_id, collection_name))
-            cards = cur.fetchall()
-            return cards
+        with db_connection.reader() as cursor:
+            cursor.execute(SQL_SEARCH_CARDS, (match, limit))
+            card_ids = [row[0] for row in cursor.fetchall()]
     except sqlite3.Error as e:
         print(f"An error occurred: {e}")
         return []
 
-
+    return CardCatalog.get_instance().resolve(card_ids)
@@ -0,0 +1,254 @@
+import bisect
+import hashlib
+import random
+import sqlite3
+import unicodedata
+from typing import Iterable, Optional, List, Tuple
+from utils.bitset import iter_ordinals
+from utils.connection import DatabaseConnection
+
+
+RARITY_ORDER = ('legendary', 'epic', 'rare', 'uncommon', 'common')
+RARITY_RANK = {rarity: rank for rank, rarity in enumerate(RARITY_ORDER, start=1)}
+
+AUTOCOMPLETE_LIMIT = 25  # the most choices Discord shows
+
+
+def fold(text: str) -> str:
+    """Lower-cases text and strips its accents, so "quel'thalas" finds "Quel'Thalas" and "lor" finds "Lór"."""
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def name_keys(name: str) -> set:
+    """The prefixes a card can be found by: its whole name, and its name from each later word on."""
+    words = fold(name).split()
+    return {' '.join(words[start:]) for start in range(len(words))}
+
+
+def read_revision(cursor) -> int:
+    """The catalog revision, which card_parser.py bumps on every import. It lives in the database header (user_version), so reading it is free."""
+    cursor.execute("PRAGMA user_version")
+    return cursor.fetchone()[0]
+
+
+class CardRecord:
+    """A card as loaded from the Card table, with its collection name already resolved."""
+
+    __slots__ = ('id', 'name', 'collection', 'rarity', 'title', 'quote', 'image_url', 'rarity_rank', 'collection_id',
+                 'ordinal')
+
+    def __init__(self, card_id: int, name: str, collection: str, rarity: str, title: str, quote: str, image_url: str,
+                 collection_id: Optional[int] = None, ordinal: Optional[int] = None):
+        self.id = card_id
+        self.ordinal = ordinal
+        self.name = name
+        self.collection = collection
+        self.collection_id = collection_id
+        self.rarity = rarity.strip().lower()
+        self.title = title
+        self.quote = quote
+        self.image_url = image_url
+        self.rarity_rank = RARITY_RANK.get(self.rarity, len(RARITY_ORDER) + 1)
+
+    @property
+    def sort_key(self) -> Tuple[int, str]:
+        """The (rarity rank, name) order used when listing collections."""
+        return self.rarity_rank, self.name
+
+    def __repr__(self):
+        return f"CardRecord(id={self.id}, name={self.name!r}, rarity={self.rarity!r})"
+
+
+class CatalogState:
+    """
+    One load of the catalog with everything derived from it, never modified once built.
+
+    A reload builds a new state and swaps it in with a single assignment, so a reader that takes
+    CardCatalog.state once sees cards, ordinals, masks and indexes from the same load, even
+    while refresh() runs on another thread.
+    """
+
+    __slots__ = ('cards', 'by_id', 'by_name', 'ordinals', 'by_ordinal', 'collections', 'collection_ids',
+                 'collection_masks', 'name_index', 'display_order', 'display_rank', 'revision', 'version',
+                 'fingerprint')
+
+    def __init__(self, rows: Iterable[tuple] = (), revision: Optional[int] = None, version: int = 0):
+        rows = list(rows)
+        cards = tuple(CardRecord(*row) for row in rows)
+        digest = hashlib.blake2b(digest_size=8)
+        for row in rows:
+            digest.update(repr(row).encode('utf-8'))
+        self.cards = cards
+        self.by_id = {card.id: card for card in cards}
+        self.by_name = {card.name.lower(): card for card in cards}
+        self.ordinals = {card.id: card.ordinal for card in cards}
+        self.by_ordinal = {card.ordinal: card for card in cards}
+        self.collections = tuple(sorted({card.collection for card in cards}))
+        self.collection_ids = {card.collection.lower(): card.collection_id for card in cards}
+        # Ownership bitmaps use card ordinals as bit positions; a collection's mask has a bit for each of its cards.
+        collection_masks = dict.fromkeys(self.collections, 0)
+        for card in cards:
+            collection_masks[card.collection] |= 1 << card.ordinal
+        self.collection_masks = collection_masks
+        # Sorted (folded name key, card id) pairs: autocomplete is a bisect plus a short scan.
+        self.name_index = sorted((key, card.id) for card in cards for key in name_keys(card.name))
+        # Card ids in the (rarity rank, name) order collections are listed in, and each id's place in it.
+        self.display_order = tuple(card.id for card in sorted(cards, key=lambda card: card.sort_key))
+        self.display_rank = {card_id: rank for rank, card_id in enumerate(self.display_order)}
+        self.revision = revision
+        # version counts reloads in this process; fingerprint identifies the content across processes.
+        self.version = version
+        self.fingerprint = digest.hexdigest()
+
+    def bit(self, card_id: int) -> int:
+        """The card's bit in ownership bitmaps, or 0 for a card not in the catalog."""
+        ordinal = self.ordinals.get(card_id)
+        return 0 if ordinal is None else 1 << ordinal
+
+
+def _state_attribute(name: str) -> property:
+    return property(lambda catalog: getattr(catalog.state, name), doc=f"CatalogState.{name} of the current load.")
+
+
+class CardCatalog:
+    """
+    Process-wide, read-only view of the card catalog.
+
+    The catalog only changes when card_parser.py imports a new CSV, so it is loaded once
+    at startup and every card lookup is answered from memory instead of SQL. Everything loaded
+    lives in one CatalogState; code reading more than one of its attributes takes state once
+    rather than going through the properties below, which each read the current state.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.state = CatalogState()
+            cls._instance.load()
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    cards = _state_attribute('cards')
+    by_id = _state_attribute('by_id')
+    by_name = _state_attribute('by_name')
+    ordinals = _state_attribute('ordinals')
+    by_ordinal = _state_attribute('by_ordinal')
+    collections = _state_attribute('collections')
+    collection_ids = _state_attribute('collection_ids')
+    collection_masks = _state_attribute('collection_masks')
+    name_index = _state_attribute('name_index')
+    display_order = _state_attribute('display_order')
+    display_rank = _state_attribute('display_rank')
+    revision = _state_attribute('revision')
+    version = _state_attribute('version')
+    fingerprint = _state_attribute('fingerprint')
+
+    def load(self):
+        """(Re)load every card from the database and swap in the new catalog."""
+        db_connection = DatabaseConnection.get_instance()
+
+        try:
+            with db_connection.reader() as cursor:
+                revision = read_revision(cursor)
+                cursor.execute("""
+                SELECT c.id, c.name, co.name, c.rarity, c.title, c.quote, c.imageURL, co.id, c.ordinal FROM Card c
+                JOIN Collection co ON c.collectionID = co.id
+                ORDER BY c.id;
+                """)
+                rows = cursor.fetchall()
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            return
+
+        self.state = CatalogState(rows, revision, self.state.version + 1)
+
+    def refresh(self) -> bool:
+        """
+        Reloads the catalog if card_parser.py has imported a new one since it was loaded.
+
+        Returns:
+            bool: True if the catalog was reloaded.
+        """
+        db_connection = DatabaseConnection.get_instance()
+
+        try:
+            with db_connection.reader() as cursor:
+                revision = read_revision(cursor)
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            return False
+
+        if revision == self.revision:
+            return False
+        self.load()
+        return True
+
+    def complete(self, prefix: str, limit: int = AUTOCOMPLETE_LIMIT) -> List[CardRecord]:
+        """
+        Cards whose name, or a word of it onwards, starts with prefix, ignoring case and accents.
+
+        Args:
+            prefix (str): What the user has typed so far.
+            limit (int): The most cards to return.
+
+        Returns:
+            List[CardRecord]: Matching cards in alphabetical order of the matched key.
+        """
+        prefix = fold(prefix).strip()
+        state = self.state
+        index = state.name_index
+        matches = {}
+        position = bisect.bisect_left(index, (prefix,))
+        while position < len(index) and len(matches) < limit:
+            key, card_id = index[position]
+            if not key.startswith(prefix):
+                break
+            matches.setdefault(card_id, None)
+            position += 1
+        by_id = state.by_id
+        return [by_id[card_id] for card_id in matches if card_id in by_id]
+
+    def get(self, card_id: int) -> Optional[CardRecord]:
+        return self.state.by_id.get(card_id)
+
+    def get_by_name(self, name: str) -> Optional[CardRecord]:
+        return self.state.by_name.get(name.lower())
+
+    def random_card(self) -> Optional[CardRecord]:
+        """Draw one card uniformly at random."""
+        cards = self.state.cards
+        return random.choice(cards) if cards else None
+
+    def sample(self, k: int) -> List[CardRecord]:
+        """Draw up to k distinct cards uniformly at random."""
+        cards = self.state.cards
+        return random.sample(cards, min(k, len(cards)))
+
+    def resolve(self, card_ids) -> List[CardRecord]:
+        """Map card ids to records, silently dropping ids no longer in the catalog."""
+        by_id = self.state.by_id
+        return [by_id[card_id] for card_id in card_ids if card_id in by_id]
+
+    def bit(self, card_id: int) -> int:
+        """The card's bit in ownership bitmaps, or 0 for a card not in the catalog."""
+        return self.state.bit(card_id)
+
+    def bits_of(self, card_ids: Iterable[int]) -> int:
+        """The bitmap with the bits of every given card set."""
+        bit = self.state.bit
+        bits = 0
+        for card_id in card_ids:
+            bits |= bit(card_id)
+        return bits
+
+    def cards_in(self, bits: int) -> List[CardRecord]:
+        """The cards whose bits are set in an ownership bitmap, in ordinal order."""
+        by_ordinal = self.state.by_ordinal
+        return [by_ordinal[ordinal] for ordinal in iter_ordinals(bits) if ordinal in by_ordinal]
@@ -1,48 +1,118 @@
 import sqlite3
 from sqlite3 import Error
+from typing import List, Sequence, Tuple
+from database.catalog import CardCatalog, CardRecord
+from database.dust import calculate_dust_earned, credit_dust
+from database.ownership import OwnershipStore, set_owned
+from database.stats import GuildStats
 from utils.connection import DatabaseConnection
 
-def claim_card(user_id: str, card_id: int, server_id: str) -> bool:
+def claim_card(user_id: int, card_id: int, server_id: int) -> bool:
     """
     Claims a card for a user in a specific server. Adds the card to the user's collection in the UserCard table.
     """
-    db_connection = DatabaseConnection.get_instance()
-    cursor = db_connection.get_cursor()
+    ownership = OwnershipStore.get_instance()
+    if ownership.owns(user_id, server_id, card_id):
+        return False
+
+    db_connection = DatabaseConnection.for_guild(server_id)
     try:
-        
-        cursor.execute("""
-        SELECT 1 FROM UserCard WHERE userID = ? AND serverID = ? AND cardID = ?;
-        """, (user_id, server_id, card_id))
-        if cursor.fetchone() is not None:
-            return False  
-
-        
-        cursor.execute("""
-        INSERT INTO UserCard (userID, serverID, cardID) VALUES (?, ?, ?);
-        """, (user_id, server_id, card_id))
-        db_connection.commit()
-
-        return cursor.rowcount > 0
+        with db_connection.transaction() as cursor:
+            cursor.execute("""
+            INSERT OR IGNORE INTO UserCard (userID, serverID, cardID) VALUES (?, ?, ?);
+            """, (user_id, server_id, card_id))
+            claimed = cursor.rowcount > 0
+            if claimed:
+                set_owned(cursor, user_id, server_id, [card_id], True)
+                GuildStats.get_instance().record_card(user_id, server_id, card_id, True)
+
+        return claimed
     except sqlite3.Error as e:
         print(f"An error occurred: {e}")
         return False
 
 
-def de_claim_card(user_id: str, card_name: str, server_id: str) -> bool:
+def de_claim_card(user_id: int, card_id: int, server_id: int) -> bool:
     """
     De-claims a card for a user in a specific server.
     """
-    db_connection = DatabaseConnection.get_instance()
-    cursor = db_connection.get_cursor()
+    db_connection = DatabaseConnection.for_guild(server_id)
 
     try:
-        cursor.execute("""
-        DELETE FROM UserCard WHERE userID = ? AND serverID = ? AND cardID = (SELECT id FROM Card WHERE name = ?);
-        """, (user_id, server_id, card_name))
-        db_connection.commit()
+        with db_connection.transaction() as cursor:
+            cursor.execute("""
+            DELETE FROM UserCard WHERE userID = ? AND serverID = ? AND cardID = ?;
+            """, (user_id, server_id, card_id))
+            removed = cursor.rowcount > 0
+            if removed:
+                set_owned(cursor, user_id, server_id, [card_id], False)
+                GuildStats.get_instance().record_card(user_id, server_id, card_id, False)
 
-        return cursor.rowcount > 0
+        return removed
     except sqlite3.Error as e:
         print(f"An error occurred: {e}")
         return False
 
+
+def claim_cards(user_id: int, card_ids: Sequence[int], server_id: int) -> List[int]:
+    """
+    Claims several cards for a user in a specific server, in one transaction.
+
+    Returns:
+        List[int]: The ids of the cards that were claimed; cards the user already owned are left out.
+    """
+    owned = OwnershipStore.get_instance().bits(user_id, server_id)
+    bit = CardCatalog.get_instance().bit
+    card_ids = [card_id for card_id in dict.fromkeys(card_ids) if not owned & bit(card_id)]
+    if not card_ids:
+        return []
+
+    db_connection = DatabaseConnection.for_guild(server_id)
+    claimed = []
+    try:
+        with db_connection.transaction() as cursor:
+            for card_id in card_ids:
+                cursor.execute("INSERT OR IGNORE INTO UserCard (userID, serverID, cardID) VALUES (?, ?, ?)", (user_id, server_id, card_id))
+                if cursor.rowcount > 0:
+                    claimed.append(card_id)
+                    GuildStats.get_instance().record_card(user_id, server_id, card_id, True)
+            set_owned(cursor, user_id, server_id, claimed, True)
+
+        return claimed
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+        return []
+
+
+def settle_pull(user_id: int, server_id: int, cards: Sequence[CardRecord]) -> Tuple[List[CardRecord], List[CardRecord], int]:
+    """
+    Sorts the cards of a pull into new ones and duplicates, and credits the dust for every duplicate at once.
+
+    Ownership of the whole pull comes from the user's bitmap, a single lookup, and the dust is
+    added in one statement whatever the number of duplicates.
+
+    Args:
+        user_id (int): The user's ID.
+        server_id (int): The server's ID.
+        cards (Sequence[CardRecord]): The cards drawn.
+
+    Returns:
+        Tuple[List[CardRecord], List[CardRecord], int]: The cards the user can claim, the
+        duplicates, and the dust earned for the duplicates.
+    """
+    owned = OwnershipStore.get_instance().bits(user_id, server_id)
+    bit = CardCatalog.get_instance().bit
+    new_cards = [card for card in cards if not owned & bit(card.id)]
+    duplicates = [card for card in cards if owned & bit(card.id)]
+    dust_earned = sum(calculate_dust_earned(card.rarity) for card in duplicates)
+    if not dust_earned:
+        return new_cards, duplicates, 0
+
+    db_connection = DatabaseConnection.for_guild(server_id)
+    try:
+        with db_connection.transaction() as cursor:
+            credit_dust(cursor, user_id, server_id, dust_earned, 'duplicate')
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+        return new_cards, duplicates, 0
+    return new_cards, duplicates, dust_earned
@@ -1,30 +1,77 @@
 import sqlite3
 import datetime
 from sqlite3 import Error
-from typing import Optional, Tuple
+from typing import Optional, Tuple, List
+from database.stats import GuildStats
+from utils.cache import LRUCache
 from utils.connection import DatabaseConnection
 
-def get_dust_balance(user_id: str, server_id: str) -> int:
+
+# Both return the new balance, which is written through to the balance cache once the transaction commits.
+SQL_CREDIT_DUST = """
+INSERT INTO DustBalance (userID, serverID, balance) VALUES (?, ?, ?)
+ON CONFLICT(userID, serverID) DO UPDATE SET balance = balance + excluded.balance
+RETURNING balance
+"""
+
+SQL_SPEND_DUST = "UPDATE DustBalance SET balance = balance - ? WHERE userID = ? AND serverID = ? AND balance >= ? RETURNING balance"
+
+SQL_LEDGER_ENTRY = """
+INSERT INTO DustLedger (userID, serverID, delta, reason, createdAt) VALUES (?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+"""
+
+SQL_AUDIT_DUST = """
+SELECT b.userID, b.serverID, b.balance,
+       COALESCE(s.total, 0) + COALESCE((SELECT SUM(l.delta) FROM DustLedger l
+                                        WHERE l.userID = b.userID AND l.serverID = b.serverID), 0) AS ledger
+FROM DustBalance b
+LEFT JOIN DustLedgerSummary s ON s.userID = b.userID AND s.serverID = b.serverID
+WHERE b.balance != ledger
+"""
+
+DUST_CACHE_SIZE = 50000  # balances kept in memory, least recently used evicted first
+DUST_CACHE_TTL = 600  # seconds; commits keep the balances current, this only catches edits made outside the bot
+
+# The ledger costs one extra insert per balance change, so it is opt-in: "dust_ledger": true in credentials.json.
+ledger_enabled = False
+
+balances = LRUCache('dust_balance', DUST_CACHE_SIZE, DUST_CACHE_TTL)
+
+
+def cached_dust_balance(user_id: int, server_id: int) -> Optional[int]:
+    """The user's balance if it is in memory, without touching the database."""
+    return balances.get((int(user_id), int(server_id)))
+
+
+def get_dust_balance(user_id: int, server_id: int) -> int:
     """
-    Retrieves the dust balance for a user in a specific server.
+    Retrieves the dust balance for a user in a specific server, from memory when possible.
 
     Args:
-        user_id (str): The user's ID.
-        server_id (str): The server's ID.
+        user_id (int): The user's ID.
+        server_id (int): The server's ID.
 
     Returns:
         int: The user's dust balance.
     """
-    db_connection = DatabaseConnection.get_instance()
-    cursor = db_connection.get_cursor()
+    key = int(user_id), int(server_id)
+    generation = balances.generation
+    balance = balances.get(key)
+    if balance is not None:
+        return balance
+
+    db_connection = DatabaseConnection.for_guild(server_id)
 
     try:
-        cursor.execute("SELECT balance FROM DustBalance WHERE userID = ? AND serverID = ?", (user_id, server_id))
-        result = cursor.fetchone()
-        return result[0] if result else 0
+        with db_connection.reader() as cursor:
+            cursor.execute("SELECT balance FROM DustBalance WHERE userID = ? AND serverID = ?", (user_id, server_id))
+            result = cursor.fetchone()
     except sqlite3.Error as e:
         print(f"An error occurred: {e}")
         return 0
+    balance = result[0] if result else 0
+    balances.fill(key, balance, generation)
+    return balance
 
 def calculate_dust_earned(rarity: str) -> int:
     """
@@ -45,30 +92,138 @@ def calculate_dust_earned(rarity: str) -> int:
     }
     return dust_values.get(rarity.lower(), 0)  
 
-def update_dust_balance(user_id: str, server_id: str, dust_earned: int):
+def update_dust_balance(user_id: int, server_id: int, dust_earned: int, reason: str = 'duplicate'):
     """
     Update the user's dust balance.
 
     Args:
-        user_id (str): The user's ID.
-        server_id (str): The server's ID.
+        user_id (int): The user's ID.
+        server_id (int): The server's ID.
         dust_earned (int): The amount of dust to add to the balance.
+        reason (str): Why the balance changed, recorded in the ledger when it is enabled.
+    """
+    db_connection = DatabaseConnection.for_guild(server_id)
+
+    try:
+        with db_connection.transaction() as cursor:
+            credit_dust(cursor, user_id, server_id, dust_earned, reason)
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+
+
+def credit_dust(cursor, user_id: int, server_id: int, amount: int, reason: str):
+    """
+    Adds dust inside the caller's transaction.
+
+    Args:
+        cursor: A cursor inside an open transaction().
+        user_id (int): The user's ID.
+        server_id (int): The server's ID.
+        amount (int): The amount of dust to add.
+        reason (str): Why the balance changed, recorded in the ledger when it is enabled.
+    """
+    cursor.execute(SQL_CREDIT_DUST, (user_id, server_id, amount))
+    record_balance(user_id, server_id, cursor.fetchone()[0])
+    record_ledger_entry(cursor, user_id, server_id, amount, reason)
+    GuildStats.get_instance().record_dust(user_id, server_id, amount)
+
+
+def spend_dust(cursor, user_id: int, server_id: int, cost: int, reason: str) -> bool:
+    """
+    Deducts dust inside the caller's transaction, only if the balance covers it.
+
+    Args:
+        cursor: A cursor inside an open transaction().
+        user_id (int): The user's ID.
+        server_id (int): The server's ID.
+        cost (int): The amount of dust to deduct.
+        reason (str): Why the balance changed, recorded in the ledger when it is enabled.
+
+    Returns:
+        bool: True if the dust was deducted, False if the balance was too low.
+    """
+    cursor.execute(SQL_SPEND_DUST, (cost, user_id, server_id, cost))
+    row = cursor.fetchone()
+    if row is None:
+        return False
+    record_balance(user_id, server_id, row[0])
+    record_ledger_entry(cursor, user_id, server_id, -cost, reason)
+    GuildStats.get_instance().record_dust(user_id, server_id, -cost)
+    return True
+
+
+def record_balance(user_id: int, server_id: int, balance: int):
+    """Writes a balance through to the cache once the current transaction commits."""
+    key = int(user_id), int(server_id)
+    DatabaseConnection.for_guild(server_id).on_commit(lambda: balances.put(key, balance))
+
+
+def set_ledger_enabled(enabled: bool):
+    """Turn the append-only dust ledger on or off."""
+    global ledger_enabled
+    ledger_enabled = enabled
+
+
+def record_ledger_entry(cursor, user_id: int, server_id: int, delta: int, reason: str):
+    if ledger_enabled:
+        cursor.execute(SQL_LEDGER_ENTRY, (user_id, server_id, delta, reason))
+
+
+def summarize_ledger(older_than: datetime.timedelta = datetime.timedelta(days=7)) -> int:
+    """
+    Folds old ledger entries into DustLedgerSummary and removes them from DustLedger.
+
+    Args:
+        older_than (datetime.timedelta): Only entries at least this old are summarized.
+
+    Returns:
+        int: The number of ledger entries summarized.
+    """
+    cutoff = int((datetime.datetime.now() - older_than).timestamp())
+    summarized = 0
+
+    # Ledger ids are per database file, so each shard is summarized on its own.
+    for db_connection in DatabaseConnection.guild_connections():
+        try:
+            with db_connection.transaction() as cursor:
+                cursor.execute("SELECT MAX(id) FROM DustLedger WHERE createdAt < ?", (cutoff,))
+                last_id = cursor.fetchone()[0]
+                if last_id is None:
+                    continue
+                cursor.execute("""
+                INSERT INTO DustLedgerSummary (userID, serverID, total, entries, lastEntryID)
+                SELECT userID, serverID, SUM(delta), COUNT(*), MAX(id) FROM DustLedger WHERE id <= ?
+                GROUP BY userID, serverID
+                ON CONFLICT(userID, serverID) DO UPDATE SET
+                    total = total + excluded.total,
+                    entries = entries + excluded.entries,
+                    lastEntryID = excluded.lastEntryID
+                """, (last_id,))
+                cursor.execute("DELETE FROM DustLedger WHERE id <= ?", (last_id,))
+                summarized += cursor.rowcount
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+
+    return summarized
+
+
+def audit_dust_balances() -> List[Tuple[int, int, int, int]]:
+    """
+    Compares every balance with the sum of its summarized and pending ledger entries.
+
+    Only meaningful for balances that were zero when the ledger was enabled.
+
+    Returns:
+        List[Tuple[int, int, int, int]]: (userID, serverID, balance, ledger total) for every mismatch.
     """
-    db_connection = DatabaseConnection.get_instance()
-    cursor = db_connection.get_cursor()
+    mismatches = []
 
     try:
-        
-        cursor.execute("SELECT balance FROM DustBalance WHERE userID = ? AND serverID = ?", (user_id, server_id))
-        result = cursor.fetchone()
-        if result:
-            
-            new_balance = result[0] + dust_earned
-            cursor.execute("UPDATE DustBalance SET balance = ? WHERE userID = ? AND serverID = ?", (new_balance, user_id, server_id))
-        else:
-            
-            cursor.execute("INSERT INTO DustBalance (userID, serverID, balance) VALUES (?, ?, ?)", (user_id, server_id, dust_earned))
-
-        db_connection.commit()
+        for db_connection in DatabaseConnection.guild_connections():
+            with db_connection.reader() as cursor:
+                cursor.execute(SQL_AUDIT_DUST)
+                mismatches += cursor.fetchall()
+        return mismatches
     except sqlite3.Error as e:
         print(f"An error occurred: {e}")
+        return []
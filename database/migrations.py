@@ -0,0 +1,545 @@
+"""
+Versioned schema migrations.
+
+The schema_version table records every migration that has been applied. run_migrations()
+applies the missing ones in order at startup, so a fresh database and an old one both end up
+on the latest schema. Migrations that rebuild a table do it online: the new table is kept in
+sync with triggers while it is backfilled in small transactions, and only the final swap holds
+the write lock for more than a moment.
+"""
+import sqlite3
+from typing import Callable, Dict, List, Sequence, Tuple
+from database.ownership import rebuild_bits
+from utils.connection import GUILD_TABLES, DatabaseConnection
+
+BACKFILL_CHUNK_SIZE = 5000
+
+SCHEMA_V1 = (
+    """CREATE TABLE IF NOT EXISTS Server (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        serverID TEXT UNIQUE
+    );""",
+    """CREATE TABLE IF NOT EXISTS User (
+        userID TEXT,
+        serverID INTEGER,
+        PRIMARY KEY (userID, serverID),
+        FOREIGN KEY (serverID) REFERENCES Server(id)
+    );""",
+    """CREATE TABLE IF NOT EXISTS Collection (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE
+    );""",
+    """CREATE TABLE IF NOT EXISTS Card (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE,
+        collectionID INTEGER,
+        rarity TEXT,
+        title TEXT,
+        quote TEXT,
+        imageURL TEXT,
+        FOREIGN KEY (collectionID) REFERENCES Collection(id)
+    );""",
+    """CREATE TABLE IF NOT EXISTS UserRequests (
+        userID TEXT,
+        serverID TEXT,
+        firstRequestTime TIMESTAMP,
+        requestCount INTEGER,
+        PRIMARY KEY (userID, serverID),
+        FOREIGN KEY (userID, serverID) REFERENCES User(userID, serverID)
+    );""",
+    """CREATE TABLE IF NOT EXISTS UserCard (
+        userID TEXT NOT NULL,
+        serverID INTEGER NOT NULL,
+        cardID INTEGER NOT NULL,
+        PRIMARY KEY (userID, serverID, cardID),
+        FOREIGN KEY (userID, serverID) REFERENCES User(userID, serverID),
+        FOREIGN KEY (cardID) REFERENCES Card(id)
+    );""",
+    """CREATE TABLE IF NOT EXISTS DustBalance (
+        userID TEXT NOT NULL,
+        serverID INTEGER NOT NULL,
+        balance INTEGER,
+        PRIMARY KEY (userID, serverID),
+        FOREIGN KEY (userID, serverID) REFERENCES User(userID, serverID),
+        FOREIGN KEY (serverID) REFERENCES Server(id)
+    );""",
+    """CREATE TABLE IF NOT EXISTS Shop (
+        serverID INTEGER PRIMARY KEY,
+        lastUpdated TIMESTAMP,
+        item1 INTEGER,
+        item2 INTEGER,
+        item3 INTEGER,
+        FOREIGN KEY(item1) REFERENCES Card(id),
+        FOREIGN KEY(item2) REFERENCES Card(id),
+        FOREIGN KEY(item3) REFERENCES Card(id)
+    );""",
+    """CREATE TABLE IF NOT EXISTS GuildDropRate (
+        serverID INTEGER NOT NULL,
+        rarity TEXT NOT NULL,
+        weight REAL NOT NULL,
+        PRIMARY KEY (serverID, rarity)
+    );""",
+    """CREATE TABLE IF NOT EXISTS DustLedger (
+        id INTEGER PRIMARY KEY,
+        userID TEXT NOT NULL,
+        serverID INTEGER NOT NULL,
+        delta INTEGER NOT NULL,
+        reason TEXT,
+        createdAt INTEGER NOT NULL
+    );""",
+    """CREATE TABLE IF NOT EXISTS DustLedgerSummary (
+        userID TEXT NOT NULL,
+        serverID INTEGER NOT NULL,
+        total INTEGER NOT NULL,
+        entries INTEGER NOT NULL,
+        lastEntryID INTEGER NOT NULL,
+        PRIMARY KEY (userID, serverID)
+    );""",
+    "CREATE INDEX IF NOT EXISTS idx_user_on_user_card ON UserCard (userID);",
+    "CREATE INDEX IF NOT EXISTS idx_server_on_user_card ON UserCard (serverID);",
+    "CREATE INDEX IF NOT EXISTS idx_card_on_user_card ON UserCard (cardID);",
+    "CREATE INDEX IF NOT EXISTS idx_user_server_on_user_requests ON UserRequests (userID, serverID);",
+    "CREATE INDEX IF NOT EXISTS idx_user_server_on_dust_balance ON DustBalance (userID, serverID);",
+)
+
+
+class TableRebuild:
+    """
+    How one table is rebuilt by migration 2.
+
+    Args:
+        table (str): The table to rebuild.
+        create_sql (str): CREATE TABLE for the new shape, with {name} in place of the table name.
+        columns (Sequence[str]): The columns to copy, present in both shapes.
+        key (Sequence[str]): The new primary key columns, used to mirror updates and deletes.
+        expressions (Dict[str, str]): Conversions for columns whose type changes, with {row} in
+            place of the row being copied ("" in the backfill, "NEW." or "OLD." in triggers).
+    """
+
+    def __init__(self, table: str, create_sql: str, columns: Sequence[str], key: Sequence[str],
+                 expressions: Dict[str, str]):
+        self.table = table
+        self.create_sql = create_sql
+        self.columns = tuple(columns)
+        self.key = tuple(key)
+        self.expressions = expressions
+
+    @property
+    def new_table(self) -> str:
+        return f"{self.table}_v2"
+
+    def expression(self, column: str, row: str = "") -> str:
+        return self.expressions.get(column, "{row}" + column).format(row=row)
+
+    def values(self, row: str = "") -> str:
+        return ", ".join(self.expression(column, row) for column in self.columns)
+
+    def key_present(self, row: str = "") -> str:
+        return " AND ".join(f"{self.expression(column, row)} IS NOT NULL" for column in self.key)
+
+    def key_matches(self, row: str) -> str:
+        return " AND ".join(f"{column} = {self.expression(column, row)}" for column in self.key)
+
+    def trigger_sql(self) -> List[str]:
+        columns = ", ".join(self.columns)
+        upsert = (f"INSERT OR REPLACE INTO {self.new_table} ({columns}) "
+                  f"SELECT {self.values('NEW.')} WHERE {self.key_present('NEW.')}")
+        delete = f"DELETE FROM {self.new_table} WHERE {self.key_matches('OLD.')}"
+        return [
+            f"""CREATE TRIGGER {self.new_table}_insert AFTER INSERT ON {self.table}
+                BEGIN {upsert}; END""",
+            f"""CREATE TRIGGER {self.new_table}_update AFTER UPDATE ON {self.table}
+                BEGIN {delete}; {upsert}; END""",
+            f"""CREATE TRIGGER {self.new_table}_delete AFTER DELETE ON {self.table}
+                BEGIN {delete}; END""",
+        ]
+
+    def drop_triggers_sql(self) -> List[str]:
+        return [f"DROP TRIGGER IF EXISTS {self.new_table}_{event}" for event in ('insert', 'update', 'delete')]
+
+
+def _integer(column: str) -> str:
+    return f"CAST({{row}}{column} AS INTEGER)"
+
+
+def _table_shape(cursor, table: str) -> Tuple[tuple, bool]:
+    """The columns (name, type, not null, primary key position) of a table, and whether it is WITHOUT ROWID."""
+    cursor.execute(f"PRAGMA table_info({table})")
+    columns = tuple((name, declared_type, not_null, pk) for _, name, declared_type, not_null, _, pk in cursor.fetchall())
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    row = cursor.fetchone()
+    return columns, bool(row) and 'WITHOUT ROWID' in row[0].upper()
+
+
+def rebuild_table(db_connection: DatabaseConnection, rebuild: TableRebuild, indexes: Sequence[str] = ()):
+    """
+    Rebuilds a table into a new shape while the bot keeps writing to it.
+
+    1. The new table is created and triggers mirror every write on the old table into it.
+    2. Existing rows are copied in rowid order, BACKFILL_CHUNK_SIZE per transaction, so other
+       writers get the lock between chunks. Rows the triggers already copied are left alone.
+    3. One short transaction drops the old table, renames the new one and builds its indexes.
+
+    Every step can be rerun, so an interrupted migration simply starts the rebuild over.
+    """
+    table, new_table = rebuild.table, rebuild.new_table
+    columns = ", ".join(rebuild.columns)
+
+    with db_connection.transaction() as cursor:
+        for sql in rebuild.drop_triggers_sql():
+            cursor.execute(sql)
+        cursor.execute(f"DROP TABLE IF EXISTS {new_table}")
+        cursor.execute(rebuild.create_sql.format(name=new_table))
+        if _table_shape(cursor, table) == _table_shape(cursor, new_table):
+            # Already rebuilt by an earlier, interrupted run of this migration.
+            cursor.execute(f"DROP TABLE {new_table}")
+            for sql in indexes:
+                cursor.execute(sql)
+            return
+        for sql in rebuild.trigger_sql():
+            cursor.execute(sql)
+
+    last_rowid = -1
+    while True:
+        with db_connection.transaction() as cursor:
+            cursor.execute(f"SELECT MAX(rowid) FROM (SELECT rowid FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+                           (last_rowid, BACKFILL_CHUNK_SIZE))
+            chunk_end = cursor.fetchone()[0]
+            if chunk_end is None:
+                break
+            cursor.execute(f"""
+            INSERT OR IGNORE INTO {new_table} ({columns})
+            SELECT {rebuild.values()} FROM {table}
+            WHERE rowid > ? AND rowid <= ? AND {rebuild.key_present()}
+            """, (last_rowid, chunk_end))
+        last_rowid = chunk_end
+
+    with db_connection.transaction() as cursor:
+        for sql in rebuild.drop_triggers_sql():
+            cursor.execute(sql)
+        cursor.execute(f"DROP TABLE {table}")
+        cursor.execute(f"ALTER TABLE {new_table} RENAME TO {table}")
+        for sql in indexes:
+            cursor.execute(sql)
+
+
+def migration_1(db_connection: DatabaseConnection):
+    """The original schema. Every statement is IF NOT EXISTS, so databases created before versioning pass through."""
+    with db_connection.transaction() as cursor:
+        for sql in SCHEMA_V1:
+            cursor.execute(sql)
+
+
+V2_REBUILDS = (
+    TableRebuild(
+        'Server',
+        """CREATE TABLE {name} (
+            serverID INTEGER PRIMARY KEY
+        )""",
+        columns=('serverID',), key=('serverID',),
+        expressions={'serverID': _integer('serverID')},
+    ),
+    TableRebuild(
+        'User',
+        """CREATE TABLE {name} (
+            userID INTEGER NOT NULL,
+            serverID INTEGER NOT NULL,
+            PRIMARY KEY (userID, serverID)
+        ) WITHOUT ROWID""",
+        columns=('userID', 'serverID'), key=('userID', 'serverID'),
+        expressions={'userID': _integer('userID'), 'serverID': _integer('serverID')},
+    ),
+    TableRebuild(
+        'UserRequests',
+        """CREATE TABLE {name} (
+            userID INTEGER NOT NULL,
+            serverID INTEGER NOT NULL,
+            firstRequestTime TIMESTAMP,
+            requestCount INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (userID, serverID)
+        ) WITHOUT ROWID""",
+        columns=('userID', 'serverID', 'firstRequestTime', 'requestCount'), key=('userID', 'serverID'),
+        expressions={'userID': _integer('userID'), 'serverID': _integer('serverID'),
+                     'requestCount': "COALESCE({row}requestCount, 0)"},
+    ),
+    TableRebuild(
+        'UserCard',
+        """CREATE TABLE {name} (
+            userID INTEGER NOT NULL,
+            serverID INTEGER NOT NULL,
+            cardID INTEGER NOT NULL REFERENCES Card(id),
+            PRIMARY KEY (userID, serverID, cardID)
+        ) WITHOUT ROWID""",
+        columns=('userID', 'serverID', 'cardID'), key=('userID', 'serverID', 'cardID'),
+        expressions={'userID': _integer('userID'), 'serverID': _integer('serverID')},
+    ),
+    TableRebuild(
+        'DustBalance',
+        """CREATE TABLE {name} (
+            userID INTEGER NOT NULL,
+            serverID INTEGER NOT NULL,
+            balance INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (userID, serverID)
+        ) WITHOUT ROWID""",
+        columns=('userID', 'serverID', 'balance'), key=('userID', 'serverID'),
+        expressions={'userID': _integer('userID'), 'serverID': _integer('serverID'),
+                     'balance': "COALESCE({row}balance, 0)"},
+    ),
+    TableRebuild(
+        'Shop',
+        """CREATE TABLE {name} (
+            serverID INTEGER PRIMARY KEY,
+            lastUpdated TIMESTAMP,
+            item1 INTEGER REFERENCES Card(id),
+            item2 INTEGER REFERENCES Card(id),
+            item3 INTEGER REFERENCES Card(id)
+        )""",
+        columns=('serverID', 'lastUpdated', 'item1', 'item2', 'item3'), key=('serverID',),
+        expressions={'serverID': _integer('serverID')},
+    ),
+    TableRebuild(
+        'GuildDropRate',
+        """CREATE TABLE {name} (
+            serverID INTEGER NOT NULL,
+            rarity TEXT NOT NULL,
+            weight REAL NOT NULL,
+            PRIMARY KEY (serverID, rarity)
+        ) WITHOUT ROWID""",
+        columns=('serverID', 'rarity', 'weight'), key=('serverID', 'rarity'),
+        expressions={'serverID': _integer('serverID')},
+    ),
+    TableRebuild(
+        'DustLedger',
+        """CREATE TABLE {name} (
+            id INTEGER PRIMARY KEY,
+            userID INTEGER NOT NULL,
+            serverID INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            reason TEXT,
+            createdAt INTEGER NOT NULL
+        )""",
+        columns=('id', 'userID', 'serverID', 'delta', 'reason', 'createdAt'), key=('id',),
+        expressions={'userID': _integer('userID'), 'serverID': _integer('serverID')},
+    ),
+    TableRebuild(
+        'DustLedgerSummary',
+        """CREATE TABLE {name} (
+            userID INTEGER NOT NULL,
+            serverID INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            entries INTEGER NOT NULL,
+            lastEntryID INTEGER NOT NULL,
+            PRIMARY KEY (userID, serverID)
+        ) WITHOUT ROWID""",
+        columns=('userID', 'serverID', 'total', 'entries', 'lastEntryID'), key=('userID', 'serverID'),
+        expressions={'userID': _integer('userID'), 'serverID': _integer('serverID')},
+    ),
+)
+
+V2_INDEXES = {
+    # Who owns a card, for catalog repairs. The primary key is appended to the index, so it covers the lookup.
+    'UserCard': ("CREATE INDEX IF NOT EXISTS idx_card_on_user_card ON UserCard (cardID)",),
+    # summarize_ledger() looks for the newest entry older than the cutoff.
+    'DustLedger': ("CREATE INDEX IF NOT EXISTS idx_created_on_dust_ledger ON DustLedger (createdAt)",),
+}
+
+
+def migration_2(db_connection: DatabaseConnection):
+    """
+    Integer snowflake ids everywhere, WITHOUT ROWID for the tables keyed on them, and indexes for the real queries.
+
+    v1 stored ids as TEXT in some tables and INTEGER in others, so the same user could exist
+    twice and lookups with the other type missed the primary key. The indexes that only
+    repeated a primary key prefix are dropped along with their tables.
+    """
+    for rebuild in V2_REBUILDS:
+        rebuild_table(db_connection, rebuild, V2_INDEXES.get(rebuild.table, ()))
+
+
+
+# Numbers each new card after the last one, so ordinals stay dense however Card.id grows.
+CARD_ORDINAL_TRIGGER = """CREATE TRIGGER IF NOT EXISTS card_ordinal_insert AFTER INSERT ON Card WHEN NEW.ordinal IS NULL BEGIN
+        UPDATE Card SET ordinal = (SELECT COALESCE(MAX(ordinal), -1) + 1 FROM Card) WHERE id = NEW.id;
+    END"""
+
+
+def migration_3(db_connection: DatabaseConnection):
+    """
+    UserCardBits: each user's cards as one bitmap (see database.ownership), with a bit per Card.ordinal.
+
+    Ordinals are dense, unlike card ids, which only grow as cards are re-imported and merged. The
+    data layer writes the bitmaps in the same transaction as UserCard (see set_owned()), so any
+    connection can still write to UserCard; the existing rows are folded in here.
+    """
+    with db_connection.transaction() as cursor:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS UserCardBits (
+            userID INTEGER NOT NULL,
+            serverID INTEGER NOT NULL,
+            bits BLOB NOT NULL,
+            PRIMARY KEY (userID, serverID)
+        ) WITHOUT ROWID""")
+        cursor.execute("PRAGMA table_info(Card)")
+        if 'ordinal' not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE Card ADD COLUMN ordinal INTEGER")
+        cursor.execute("UPDATE Card SET ordinal = (SELECT COUNT(*) FROM Card earlier WHERE earlier.id < Card.id) WHERE ordinal IS NULL")
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_ordinal_on_card ON Card (ordinal)")
+        cursor.execute(CARD_ORDINAL_TRIGGER)
+        # Databases from before this migration are never sharded, so every UserCard row is in this file.
+        rebuild_bits(cursor)
+
+
+CARD_FTS_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS card_fts_insert AFTER INSERT ON Card BEGIN
+        INSERT INTO CardFTS (rowid, name, title, quote) VALUES (NEW.id, NEW.name, NEW.title, NEW.quote);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS card_fts_delete AFTER DELETE ON Card BEGIN
+        INSERT INTO CardFTS (CardFTS, rowid, name, title, quote) VALUES ('delete', OLD.id, OLD.name, OLD.title, OLD.quote);
+    END""",
+    # Only for the indexed columns: card_ordinal_insert numbers a new card, which must not reindex it before it is even indexed.
+    """CREATE TRIGGER IF NOT EXISTS card_fts_update AFTER UPDATE OF name, title, quote ON Card BEGIN
+        INSERT INTO CardFTS (CardFTS, rowid, name, title, quote) VALUES ('delete', OLD.id, OLD.name, OLD.title, OLD.quote);
+        INSERT INTO CardFTS (rowid, name, title, quote) VALUES (NEW.id, NEW.name, NEW.title, NEW.quote);
+    END""",
+)
+
+
+def migration_4(db_connection: DatabaseConnection):
+    """CardFTS: a full-text index over card names, titles and quotes, kept in step with Card by triggers."""
+    with db_connection.transaction() as cursor:
+        cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS CardFTS USING fts5(
+            name, title, quote,
+            content='Card', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )""")
+        for sql in CARD_FTS_TRIGGERS:
+            cursor.execute(sql)
+        cursor.execute("INSERT INTO CardFTS (CardFTS) VALUES ('rebuild')")
+
+
+def migration_5(db_connection: DatabaseConnection):
+    """StorageLayout: how many shard files hold the per-guild tables (see utils.connection), 0 while the main database does."""
+    with db_connection.transaction() as cursor:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS StorageLayout (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            shardCount INTEGER NOT NULL
+        )""")
+        cursor.execute("INSERT OR IGNORE INTO StorageLayout (id, shardCount) VALUES (1, 0)")
+
+
+MIGRATIONS: List[Tuple[int, Callable[[DatabaseConnection], None]]] = [
+    (1, migration_1),
+    (2, migration_2),
+    (3, migration_3),
+    (4, migration_4),
+    (5, migration_5),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_schema_version(db_connection: DatabaseConnection) -> int:
+    """The schema version, read without creating or locking anything; 0 for a database that was never migrated."""
+    try:
+        cursor = db_connection.get_cursor()
+        cursor.execute("SELECT MAX(version) FROM schema_version")
+        return cursor.fetchone()[0] or 0
+    except sqlite3.OperationalError:
+        return 0
+
+
+def get_schema_version(db_connection: DatabaseConnection) -> int:
+    with db_connection.transaction() as cursor:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            appliedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )""")
+        cursor.execute("SELECT MAX(version) FROM schema_version")
+        return cursor.fetchone()[0] or 0
+
+
+def guild_schema(db_connection: DatabaseConnection) -> List[Tuple[str, str, str]]:
+    """
+    The per-guild tables as the main database defines them, with their indexes and triggers.
+
+    Returns:
+        List[Tuple[str, str, str]]: (type, name, CREATE statement), tables first and triggers last.
+    """
+    with db_connection.reader() as cursor:
+        cursor.execute(f"""
+        SELECT type, name, sql FROM sqlite_master
+        WHERE tbl_name IN ({', '.join('?' * len(GUILD_TABLES))}) AND sql IS NOT NULL
+        ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END, name
+        """, GUILD_TABLES)
+        return cursor.fetchall()
+
+
+def sync_guild_schema(db_connection: DatabaseConnection, schema: List[Tuple[str, str, str]]) -> int:
+    """
+    Creates the tables, indexes and triggers of schema that a shard file is missing.
+
+    Shard files are not migrated themselves: their schema is copied from the main database,
+    which the migrations keep current. This adds whatever a newer migration created; a
+    migration that reshapes an existing per-guild table has to run on every connection of
+    DatabaseConnection.guild_connections() as well.
+
+    Returns:
+        int: The number of objects created.
+    """
+    with db_connection.transaction() as cursor:
+        cursor.execute("SELECT name FROM main.sqlite_master")
+        present = {row[0] for row in cursor.fetchall()}
+        missing = [sql for _, name, sql in schema if name not in present]
+        for sql in missing:
+            cursor.execute(sql)
+    return len(missing)
+
+
+def run_migrations() -> int:
+    """
+    Applies every migration newer than the database's schema version, in order.
+
+    Each migration is recorded as soon as it finishes, so a failure leaves the database on the
+    last good version and the next start resumes from there. ANALYZE runs after any migration
+    so the planner has fresh statistics for the new tables and indexes. In sharded storage the
+    shard files then receive whatever the migrations added to the per-guild tables.
+
+    A database already on LATEST_VERSION, as on every restart, is only read and optimized: no
+    DDL runs and the shard files are not compared with the main database.
+
+    Returns:
+        int: The schema version the database is on afterwards.
+    """
+    db_connection = DatabaseConnection.get_instance()
+    version = current_schema_version(db_connection)
+    applied = False
+
+    try:
+        if version < LATEST_VERSION:
+            version = get_schema_version(db_connection)
+            for target, migration in MIGRATIONS:
+                if target <= version:
+                    continue
+                print(f"Migrating database schema to version {target}...")
+                migration(db_connection)
+                with db_connection.transaction() as cursor:
+                    cursor.execute("INSERT INTO schema_version (version) VALUES (?)", (target,))
+                version, applied = target, True
+
+        with db_connection.transaction() as cursor:
+            cursor.execute("ANALYZE" if applied else "PRAGMA optimize")
+
+        if DatabaseConnection.shard_count():
+            schema = guild_schema(db_connection) if applied else []
+            for shard in DatabaseConnection.guild_connections():
+                created = sync_guild_schema(shard, schema) if applied else 0
+                with shard.transaction() as cursor:
+                    # Only the shard's own tables: the catalog attached to it is read-only.
+                    cursor.execute("ANALYZE main" if created else "PRAGMA main.optimize")
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+
+    return version
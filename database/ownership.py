@@ -0,0 +1,253 @@
+"""
+Card ownership as one bitmap per (user, server).
+
+UserCardBits holds the bitmap for every user, with a bit per card ordinal (see utils.bitset).
+Every writer of UserCard updates it in the same transaction through set_owned(), so UserCard
+stays the source of truth for the queries that need rows and the two always commit together.
+Rows written to UserCard any other way (a manual fix, an old backup) are folded back in by
+rebuild_bits(), which tools.rebuild_bits runs over every database file. The OwnershipStore
+keeps recently used bitmaps in memory, which turns an ownership check into a shift and a mask,
+and collection completion into a popcount.
+"""
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+from database.catalog import CardCatalog, CardRecord
+from utils.bitset import from_blob, from_ordinals, to_blob
+from utils.cache import LRUCache
+from utils.connection import DatabaseConnection
+
+OWNERSHIP_CACHE_SIZE = 50000  # bitmaps kept in memory, least recently used evicted first
+OWNERSHIP_CACHE_TTL = 600  # seconds; commits keep the bitmaps current, this only catches edits made outside the bot
+
+SQL_STORE_BITS = """
+        INSERT INTO UserCardBits (userID, serverID, bits) VALUES (?, ?, ?)
+        ON CONFLICT(userID, serverID) DO UPDATE SET bits = excluded.bits;
+        """
+
+SQL_OWNED_ORDINALS = """
+        SELECT uc.userID, uc.serverID, c.ordinal FROM UserCard uc
+        JOIN Card c ON c.id = uc.cardID;
+        """
+
+SQL_USER_ORDINALS = """
+        SELECT c.ordinal FROM UserCard uc
+        JOIN Card c ON c.id = uc.cardID
+        WHERE uc.userID = ? AND uc.serverID = ?;
+        """
+
+
+def load_bits(user_id: int, server_id: int) -> Optional[int]:
+    """
+    Reads a user's ownership bitmap from UserCardBits.
+
+    Returns:
+        Optional[int]: The bitmap, 0 if the user owns nothing, or None if the read failed.
+    """
+    db_connection = DatabaseConnection.for_guild(server_id)
+
+    try:
+        with db_connection.reader() as cursor:
+            cursor.execute("SELECT bits FROM UserCardBits WHERE userID = ? AND serverID = ?", (user_id, server_id))
+            row = cursor.fetchone()
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}")
+        return None
+    return from_blob(row[0]) if row else 0
+
+
+class OwnershipStore:
+    """
+    LRU cache of ownership bitmaps.
+
+    Writers call set_owned() inside their transaction; the cached bitmap is only replaced once
+    that transaction commits. A bitmap read from the database while a write to it was
+    committing is returned but not cached, so the cache never holds a bitmap older than the
+    last commit.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.cache = LRUCache('ownership', OWNERSHIP_CACHE_SIZE, OWNERSHIP_CACHE_TTL)
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    @staticmethod
+    def _key(user_id, server_id) -> Tuple[int, int]:
+        return int(user_id), int(server_id)
+
+    def bits(self, user_id: int, server_id: int) -> int:
+        """The user's ownership bitmap, from memory when possible."""
+        key = self._key(user_id, server_id)
+        generation = self.cache.generation
+        bits = self.cache.get(key)
+        if bits is not None:
+            return bits
+
+        bits = load_bits(*key)
+        if bits is None:
+            return 0
+        self.cache.fill(key, bits, generation)
+        return bits
+
+    def cached_bits(self, user_id: int, server_id: int) -> Optional[int]:
+        """The user's bitmap if it is in memory, without touching the database."""
+        return self.cache.get(self._key(user_id, server_id))
+
+    def owns(self, user_id: int, server_id: int, card_id: int) -> bool:
+        return bool(self.bits(user_id, server_id) & CardCatalog.get_instance().bit(card_id))
+
+    def record(self, user_id: int, server_id: int, bits: int):
+        """Writes a bitmap through to the cache once the current transaction commits."""
+        key = self._key(user_id, server_id)
+        DatabaseConnection.for_guild(server_id).on_commit(lambda: self.cache.put(key, bits))
+
+    def invalidate(self, user_id: Optional[int] = None, server_id: Optional[int] = None):
+        """Drops one user's bitmap, or every bitmap when called without arguments."""
+        self.cache.invalidate(None if user_id is None else self._key(user_id, server_id))
+
+
+def set_owned(cursor, user_id: int, server_id: int, card_ids: Iterable[int], owned: bool = True):
+    """
+    Sets (owned=True) or clears the bits of cards in a user's UserCardBits row.
+
+    Called by every writer of UserCard, with its cursor, right after the rows were inserted or
+    deleted, so both tables change in the same transaction. The cached bitmap follows on commit.
+
+    Args:
+        cursor: The cursor of the current write transaction.
+        user_id (int): The user's ID.
+        server_id (int): The server's ID.
+        card_ids (Iterable[int]): The cards claimed or removed.
+        owned (bool): True for cards claimed, False for cards removed.
+    """
+    mask = CardCatalog.get_instance().bits_of(card_ids)
+    if not mask:
+        return
+    cursor.execute("SELECT bits FROM UserCardBits WHERE userID = ? AND serverID = ?", (user_id, server_id))
+    row = cursor.fetchone()
+    bits = from_blob(row[0]) if row else 0
+    bits = bits | mask if owned else bits & ~mask
+    cursor.execute(SQL_STORE_BITS, (user_id, server_id, to_blob(bits)))
+    OwnershipStore.get_instance().record(user_id, server_id, bits)
+
+
+def rebuild_bits(cursor, users: Optional[Iterable[Tuple[int, int]]] = None) -> int:
+    """
+    Recomputes bitmaps from UserCard: every one, or those of the given (user, server) pairs.
+
+    For UserCard rows written around set_owned(). Cards missing from the catalog are left out.
+
+    Args:
+        cursor: The cursor of a write transaction on the database file holding the users' rows.
+        users (Optional[Iterable[Tuple[int, int]]]): The (user id, server id) pairs to rebuild, or None for all.
+
+    Returns:
+        int: The number of bitmaps written.
+    """
+    bitmaps = {}
+    if users is None:
+        cursor.execute(SQL_OWNED_ORDINALS)
+        for user_id, server_id, ordinal in cursor.fetchall():
+            bitmaps[user_id, server_id] = bitmaps.get((user_id, server_id), 0) | (1 << ordinal)
+        cursor.execute("DELETE FROM UserCardBits")
+    else:
+        for user_id, server_id in users:
+            cursor.execute(SQL_USER_ORDINALS, (user_id, server_id))
+            bitmaps[user_id, server_id] = from_ordinals(row[0] for row in cursor.fetchall())
+    cursor.executemany(SQL_STORE_BITS, [(user_id, server_id, to_blob(bits)) for (user_id, server_id), bits in bitmaps.items()])
+    return len(bitmaps)
+
+
+def get_collection_completion(user_id: int, server_id: int) -> Dict[str, Tuple[int, int]]:
+    """
+    How much of each collection a user owns.
+
+    Args:
+        user_id (int): The user's ID.
+        server_id (int): The server's ID.
+
+    Returns:
+        Dict[str, Tuple[int, int]]: For each collection, the number of its cards owned and its total number of cards.
+    """
+    bits = OwnershipStore.get_instance().bits(user_id, server_id)
+    return {collection: ((bits & mask).bit_count(), mask.bit_count())
+            for collection, mask in CardCatalog.get_instance().collection_masks.items()}
+
+
+def collection_mask(collection: Optional[str]) -> Optional[int]:
+    """The mask of a collection's cards, None for every collection, or 0 for an unknown one."""
+    if collection is None:
+        return None
+    masks = CardCatalog.get_instance().collection_masks
+    return next((mask for name, mask in masks.items() if name.lower() == collection.lower()), 0)
+
+
+def count_owned(user_id: int, server_id: int, collection: Optional[str] = None) -> int:
+    """Counts the cards a user owns on a server, optionally within one collection."""
+    bits = OwnershipStore.get_instance().bits(user_id, server_id)
+    mask = collection_mask(collection)
+    return (bits if mask is None else bits & mask).bit_count()
+
+
+def step_owned(user_id: int, server_id: int, card_id: Optional[int], step: int, collection: Optional[str] = None) -> Optional[int]:
+    """
+    Finds the user's next (step=1) or previous (step=-1) card in collection listing order.
+
+    Args:
+        user_id (int): The user's ID.
+        server_id (int): The server's ID.
+        card_id (Optional[int]): The card to start from, which need not be owned. None starts before the first card.
+        step (int): 1 to move forward, -1 to move back.
+        collection (Optional[str]): Only consider cards from this collection.
+
+    Returns:
+        Optional[int]: The card id, or None if there is no owned card in that direction.
+    """
+    bits = OwnershipStore.get_instance().bits(user_id, server_id)
+    mask = collection_mask(collection)
+    if mask is not None:
+        bits &= mask
+    if not bits:
+        return None
+
+    state = CardCatalog.get_instance().state
+    order = state.display_order
+    rank = state.display_rank.get(card_id, -1) if card_id is not None else -1
+    if step < 0 and rank < 0:
+        return None
+    indexes = range(rank + 1, len(order)) if step > 0 else range(rank - 1, -1, -1)
+    bit = state.bit
+    for index in indexes:
+        if bits & bit(order[index]):
+            return order[index]
+    return None
+
+
+def compare_collections(user_id: int, other_user_id: int, server_id: int) -> Tuple[List[CardRecord], List[CardRecord], List[CardRecord]]:
+    """
+    Compares two users' collections on a server.
+
+    Args:
+        user_id (int): The user's ID.
+        other_user_id (int): The ID of the user to compare with.
+        server_id (int): The server's ID.
+
+    Returns:
+        Tuple[List[CardRecord], List[CardRecord], List[CardRecord]]: The cards both own, the cards only
+        the user owns and the cards only the other user owns, each sorted by rarity, then name.
+    """
+    store = OwnershipStore.get_instance()
+    mine, theirs = store.bits(user_id, server_id), store.bits(other_user_id, server_id)
+    catalog = CardCatalog.get_instance()
+
+    def cards(bits: int) -> List[CardRecord]:
+        return sorted(catalog.cards_in(bits), key=lambda card: card.sort_key)
+
+    return cards(mine & theirs), cards(mine & ~theirs), cards(theirs & ~mine)
@@ -1,16 +1,23 @@
 import sqlite3
 import datetime
+import hashlib
+import random
 from sqlite3 import Error
-from typing import Optional, Tuple
-from utils.connection import DatabaseConnection
+from typing import Optional, Tuple, List
+from database.catalog import CardCatalog, CardRecord
+from database.dust import spend_dust
+from database.ownership import OwnershipStore, set_owned
+from database.stats import GuildStats
+from utils.connection import DatabaseConnection, Rollback
+from utils.sharding import ShardAssignment
 
 
-def craft_card(user_id: str, card_id: int, server_id: int, cost: int) -> bool:
+def craft_card(user_id: int, card_id: int, server_id: int, cost: int) -> bool:
     """
     Handles the crafting of a card for a user.
 
     Args:
-        user_id (str): The user's ID.
+        user_id (int): The user's ID.
         card_id (int): The ID of the card being crafted.
         server_id (int): The ID of the server where the card is being crafted.
         cost (int): The dust cost of the card.
@@ -18,98 +25,149 @@ def craft_card(user_id: str, card_id: int, server_id: int, cost: int) -> bool:
     Returns:
         bool: True if crafting was successful, False otherwise.
     """
-    db_connection = DatabaseConnection.get_instance()
-    cursor = db_connection.get_cursor()
-
-    try:
-        
-        cursor.execute("SELECT balance FROM DustBalance WHERE userID = ? AND serverID = ?", (user_id, server_id))
-        result = cursor.fetchone()
-        if result and result[0] >= cost:
-            new_balance = result[0] - cost
-            cursor.execute("UPDATE DustBalance SET balance = ? WHERE userID = ? AND serverID = ?", (new_balance, user_id, server_id))
-        else:
-            return False  
+    ownership = OwnershipStore.get_instance()
+    if ownership.owns(user_id, server_id, card_id):
+        return False
 
-        
-        cursor.execute("SELECT 1 FROM UserCard WHERE userID = ? AND serverID = ? AND cardID = ?", (user_id, server_id, card_id))
-        if cursor.fetchone() is not None:
-            return False  
+    db_connection = DatabaseConnection.for_guild(server_id)
+    crafted = False
 
-        
-        cursor.execute("INSERT INTO UserCard (userID, serverID, cardID) VALUES (?, ?, ?)", (user_id, server_id, card_id))
-        db_connection.commit()
-        return True
+    try:
+        with db_connection.transaction() as cursor:
+            if not spend_dust(cursor, user_id, server_id, cost, 'craft'):
+                return False
+
+            cursor.execute("INSERT OR IGNORE INTO UserCard (userID, serverID, cardID) VALUES (?, ?, ?)", (user_id, server_id, card_id))
+            if cursor.rowcount == 0:
+                # Claimed since the check above: give the dust back by rolling the whole craft back.
+                raise Rollback()
+            set_owned(cursor, user_id, server_id, [card_id], True)
+            GuildStats.get_instance().record_card(user_id, server_id, card_id, True)
+            crafted = True
+        return crafted
     except sqlite3.Error as e:
         print(f"An error occurred: {e}")
         return False
 
 
 
-import datetime
+SHOP_SIZE = 3
+SHOP_ROTATION = 3600  # seconds
 
-last_updated_cache = {}  
+# serverID -> (rotation bucket, card ids) for shops set by an admin; they win over the computed rotation.
+shop_overrides = {}
 
-def get_shop_inventory(server_id: str) -> list:
-    db_connection = DatabaseConnection.get_instance()
-    cursor = db_connection.get_cursor()
-    current_time = datetime.datetime.now()
+craft_costs = {
+    'legendary': 1000,
+    'epic': 400,
+    'rare': 200,
+    'uncommon': 100,
+}
 
-    try:
-        
-        last_updated = last_updated_cache.get(server_id)
-        if last_updated is None or current_time - last_updated >= datetime.timedelta(hours=1):
-            update_shop_inventory(server_id)
-            last_updated = datetime.datetime.now()
-            last_updated_cache[server_id] = last_updated
 
-        
-        cursor.execute("""
-        SELECT c.id, c.name, co.name, c.title, c.quote, c.imageURL, c.rarity,
-               (CASE c.rarity WHEN 'legendary' THEN 1000 WHEN 'epic' THEN 400 WHEN 'rare' THEN 200 WHEN 'uncommon' THEN 100 ELSE 50 END) as cost
-        FROM Shop s
-        JOIN Card c ON c.id IN (s.item1, s.item2, s.item3)
-        JOIN Collection co ON c.collectionID = co.id
-        WHERE s.serverID = ?
-        """, (server_id,))
-        cards = cursor.fetchall()
-        return cards
+def craft_cost(rarity: str) -> int:
+    """
+    Returns the dust cost of crafting a card of the given rarity in the shop.
+
+    Args:
+        rarity (str): The rarity of the card.
+
+    Returns:
+        int: The dust cost.
+    """
+    return craft_costs.get(rarity.lower(), 50)
+
+
+def shop_bucket(moment: Optional[datetime.datetime] = None) -> int:
+    """The index of the hourly rotation a moment falls in."""
+    moment = moment or datetime.datetime.now()
+    return int(moment.timestamp() // SHOP_ROTATION)
+
 
+def next_reset_time(moment: Optional[datetime.datetime] = None) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp((shop_bucket(moment) + 1) * SHOP_ROTATION)
+
+
+def rotation_items(server_id: int, bucket: int) -> List[CardRecord]:
+    """
+    Computes a server's shop for one rotation.
+
+    The draw is seeded from a hash of (server, rotation, catalog fingerprint), so every process
+    agrees on the shop without storing it, and a new catalog reshuffles every shop.
+    """
+    catalog = CardCatalog.get_instance().state
+    seed = hashlib.blake2b(f"{int(server_id)}:{bucket}:{catalog.fingerprint}".encode('utf-8'), digest_size=8).digest()
+    rng = random.Random(int.from_bytes(seed, 'big'))
+    return rng.sample(catalog.cards, min(SHOP_SIZE, len(catalog.cards)))
+
+
+def get_shop_inventory(server_id: int) -> List[CardRecord]:
+    """
+    Returns the cards currently on sale in a server. Pure computation, no database access.
+
+    Args:
+        server_id (int): The ID of the server.
+
+    Returns:
+        List[CardRecord]: The cards on sale.
+    """
+    bucket = shop_bucket()
+    override = shop_overrides.get(int(server_id))
+    if override is not None and override[0] == bucket:
+        return CardCatalog.get_instance().resolve(override[1])
+    return rotation_items(server_id, bucket)
+
+
+def load_shop_overrides():
+    """Loads the admin-set shops that are still within their rotation, for the guilds this process serves."""
+    bucket = shop_bucket()
+    rows = []
+
+    try:
+        for db_connection in DatabaseConnection.guild_connections():
+            with db_connection.reader() as cursor:
+                cursor.execute("SELECT serverID, lastUpdated, item1, item2, item3 FROM Shop")
+                rows += cursor.fetchall()
     except sqlite3.Error as e:
         print(f"An error occurred: {e}")
-        return []
-
+        return
 
+    shards = ShardAssignment.get_instance()
+    shop_overrides.clear()
+    for server_id, last_updated, *items in rows:
+        if not shards.owns(server_id):
+            continue
+        try:
+            override_bucket = shop_bucket(datetime.datetime.fromisoformat(str(last_updated)))
+        except ValueError:
+            continue
+        if override_bucket == bucket:
+            shop_overrides[int(server_id)] = (override_bucket, tuple(item for item in items if item is not None))
 
 
 def update_shop_inventory(server_id: int):
     """
-    Updates the shop inventory for a specific server.
+    Replaces the shop of a specific server with a fresh random draw until the next rotation.
 
     Args:
         server_id (int): The ID of the server.
     """
-    db_connection = DatabaseConnection.get_instance()
-    cursor = db_connection.get_cursor()
+    db_connection = DatabaseConnection.for_guild(server_id)
+    now = datetime.datetime.now()
 
     try:
         
-        cursor.execute("""
-        SELECT id FROM Card
-        ORDER BY RANDOM()
-        LIMIT 3
-        """)
-        items = [item[0] for item in cursor.fetchall()]
+        items = [card.id for card in CardCatalog.get_instance().sample(SHOP_SIZE)]
+        items += [None] * (SHOP_SIZE - len(items))
 
         
-        cursor.execute("""
-        INSERT INTO Shop (serverID, lastUpdated, item1, item2, item3)
-        VALUES (?, ?, ?, ?, ?)
-        ON CONFLICT(serverID)
-        DO UPDATE SET lastUpdated = CURRENT_TIMESTAMP, item1 = ?, item2 = ?, item3 = ?
-        """, (server_id, datetime.datetime.now(), *items, *items))
-
-        db_connection.commit()
+        with db_connection.transaction() as cursor:
+            cursor.execute("""
+            INSERT INTO Shop (serverID, lastUpdated, item1, item2, item3)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(serverID)
+            DO UPDATE SET lastUpdated = excluded.lastUpdated, item1 = excluded.item1, item2 = excluded.item2, item3 = excluded.item3
+            """, (int(server_id), now.isoformat(), *items))
+        shop_overrides[int(server_id)] = (shop_bucket(now), tuple(item for item in items if item is not None))
     except sqlite3.Error as e:
         print(f"An error occurred: {e}")
-
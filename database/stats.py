@@ -0,0 +1,210 @@
+"""
+Per-guild statistics and leaderboards, kept up to date as cards and dust change hands.
+
+The aggregates are built once from the database at startup and then adjusted by the data-layer
+writes themselves (claims, removals, crafts and dust changes), each applied once its transaction
+commits. /leaderboard and /stats read them without touching the database.
+"""
+import heapq
+import sqlite3
+import threading
+from operator import itemgetter
+from typing import Dict, List, Tuple
+from database.catalog import CardCatalog
+from utils.bitset import from_blob, iter_ordinals
+from utils.connection import DatabaseConnection
+from utils.sharding import ShardAssignment
+
+LEADERBOARD_SIZE = 10
+
+LEADERBOARDS = ('cards', 'dust')
+
+
+class Leaderboard:
+    """
+    Every user's score in one guild, plus the top LEADERBOARD_SIZE of them.
+
+    Gains are merged into the top list directly. A loss inside the top list can promote someone
+    outside it, so it marks the list stale and the next read rebuilds it with a bounded heap.
+    """
+
+    __slots__ = ('scores', 'total', 'top', 'stale')
+
+    def __init__(self):
+        self.scores: Dict[int, int] = {}
+        self.total = 0
+        self.top: List[Tuple[int, int]] = []
+        self.stale = True
+
+    def update(self, user_id: int, delta: int):
+        previous = self.scores.get(user_id, 0)
+        score = previous + delta
+        if score > 0:
+            self.scores[user_id] = score
+        else:
+            self.scores.pop(user_id, None)
+        self.total += max(score, 0) - previous
+
+        if self.stale:
+            return
+        ranked = [entry for entry in self.top if entry[0] != user_id]
+        if len(ranked) < len(self.top) and delta < 0 and len(self.scores) > LEADERBOARD_SIZE:
+            self.stale = True
+            return
+        if score > 0 and (len(ranked) < LEADERBOARD_SIZE or score > ranked[-1][1]):
+            ranked.append((user_id, score))
+            ranked.sort(key=itemgetter(1), reverse=True)
+            del ranked[LEADERBOARD_SIZE:]
+        self.top = ranked
+
+    def ranking(self) -> List[Tuple[int, int]]:
+        if self.stale:
+            self.top = heapq.nlargest(LEADERBOARD_SIZE, self.scores.items(), key=itemgetter(1))
+            self.stale = False
+        return list(self.top)
+
+
+class GuildAggregates:
+    __slots__ = ('boards', 'card_owners', 'discovered')
+
+    def __init__(self):
+        self.boards = {board: Leaderboard() for board in LEADERBOARDS}
+        self.card_owners: Dict[int, int] = {}  # card ordinal -> number of users owning it
+        self.discovered = 0  # bitmap of the cards owned by at least one user
+
+
+class GuildStats:
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.guilds = {}
+            cls._instance.lock = threading.Lock()
+            cls._instance.load()
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def load(self):
+        """
+        Rebuilds the aggregates of every guild this process serves from UserCardBits and DustBalance.
+
+        Each database file is read under its own writer lock, and its guilds are installed before
+        the lock is released: this process's writes and their commit callbacks run under that
+        lock, so none can land between a file's snapshot and the moment its guilds start tracking
+        changes. Every guild lives in one file, so the files are loaded one at a time and no two
+        writer locks are ever held together. Other worker processes only write to guilds this one
+        does not serve, so there is no need to lock them out of the files as well.
+        """
+        shards = ShardAssignment.get_instance()
+
+        try:
+            for db_connection in DatabaseConnection.guild_connections():
+                guilds = {}
+
+                def guild(server_id) -> GuildAggregates:
+                    aggregates = guilds.get(server_id)
+                    if aggregates is None:
+                        aggregates = guilds[server_id] = GuildAggregates()
+                    return aggregates
+
+                with db_connection.write_lock:
+                    cursor = db_connection.get_cursor()
+                    cursor.execute("SELECT userID, serverID, bits FROM UserCardBits")
+                    for user_id, server_id, blob in cursor:
+                        if not shards.owns(server_id):
+                            continue
+                        bits = from_blob(blob)
+                        if not bits:
+                            continue
+                        aggregates = guild(server_id)
+                        aggregates.boards['cards'].update(user_id, bits.bit_count())
+                        for ordinal in iter_ordinals(bits):
+                            aggregates.card_owners[ordinal] = aggregates.card_owners.get(ordinal, 0) + 1
+                        aggregates.discovered |= bits
+
+                    cursor.execute("SELECT userID, serverID, balance FROM DustBalance WHERE balance > 0")
+                    for user_id, server_id, balance in cursor:
+                        if shards.owns(server_id):
+                            guild(server_id).boards['dust'].update(user_id, balance)
+
+                    with self.lock:
+                        self.guilds.update(guilds)
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+
+    def _guild(self, server_id: int) -> GuildAggregates:
+        aggregates = self.guilds.get(server_id)
+        if aggregates is None:
+            aggregates = self.guilds[server_id] = GuildAggregates()
+        return aggregates
+
+    def record_card(self, user_id: int, server_id: int, card_id: int, owned: bool):
+        """Counts a claim (owned=True) or removal once the current transaction commits."""
+        key = int(user_id), int(server_id)
+        DatabaseConnection.for_guild(server_id).on_commit(lambda: self._apply_card(*key, card_id, owned))
+
+    def record_dust(self, user_id: int, server_id: int, delta: int):
+        """Counts a dust balance change once the current transaction commits."""
+        key = int(user_id), int(server_id)
+        DatabaseConnection.for_guild(server_id).on_commit(lambda: self._apply_dust(*key, delta))
+
+    def _apply_card(self, user_id: int, server_id: int, card_id: int, owned: bool):
+        ordinal = CardCatalog.get_instance().ordinals.get(card_id)
+        with self.lock:
+            aggregates = self._guild(server_id)
+            aggregates.boards['cards'].update(user_id, 1 if owned else -1)
+            if ordinal is None:
+                return
+            owners = aggregates.card_owners.get(ordinal, 0) + (1 if owned else -1)
+            if owners > 0:
+                aggregates.card_owners[ordinal] = owners
+                aggregates.discovered |= 1 << ordinal
+            else:
+                aggregates.card_owners.pop(ordinal, None)
+                aggregates.discovered &= ~(1 << ordinal)
+
+    def _apply_dust(self, user_id: int, server_id: int, delta: int):
+        with self.lock:
+            self._guild(server_id).boards['dust'].update(user_id, delta)
+
+    def leaderboard(self, server_id: int, board: str = 'cards') -> List[Tuple[int, int]]:
+        """
+        The top users of a guild.
+
+        Args:
+            server_id (int): The server's ID.
+            board (str): 'cards' for the biggest collections or 'dust' for the richest users.
+
+        Returns:
+            List[Tuple[int, int]]: Up to LEADERBOARD_SIZE (user id, score) pairs, best first.
+        """
+        with self.lock:
+            aggregates = self.guilds.get(int(server_id))
+            return aggregates.boards[board].ranking() if aggregates else []
+
+    def guild_stats(self, server_id: int) -> dict:
+        """
+        A guild's totals.
+
+        Returns:
+            dict: collectors (users owning at least one card), cards (cards owned in total), dust
+            (dust held in total), and collections, mapping each collection to the number of its
+            cards owned by at least one user and its total number of cards.
+        """
+        masks = CardCatalog.get_instance().collection_masks
+        with self.lock:
+            aggregates = self.guilds.get(int(server_id)) or GuildAggregates()
+            cards = aggregates.boards['cards']
+            return {
+                'collectors': len(cards.scores),
+                'cards': cards.total,
+                'dust': aggregates.boards['dust'].total,
+                'collections': {collection: ((aggregates.discovered & mask).bit_count(), mask.bit_count())
+                                for collection, mask in masks.items()},
+            }
@@ -1,188 +1,112 @@
 import sqlite3
 import datetime
 from sqlite3 import Error
-from typing import Optional, Tuple
-from database.shop import update_shop_inventory
-from utils.cache import CooldownCache
+from typing import List, Optional, Tuple
+from database.dust import get_dust_balance
+from database.ownership import OwnershipStore
+from database.shop import update_shop_inventory, next_reset_time
+from utils.cache import RateLimiter
 from utils.connection import DatabaseConnection
 
 
-cache = CooldownCache.get_instance()
-
-def check_user_dust_balance(user_id: str, server_id: str, cost: int) -> bool:
+def check_user_dust_balance(user_id: int, server_id: int, cost: int) -> bool:
     """
     Checks if the user has enough dust to craft a card on a specific server.
 
     Args:
-        user_id (str): The user's ID.
-        server_id (str): The server's ID where the user is crafting a card.
+        user_id (int): The user's ID.
+        server_id (int): The server's ID where the user is crafting a card.
         cost (int): The dust cost of the card.
 
     Returns:
         bool: True if the user has enough dust, False otherwise.
     """
-    db_connection = DatabaseConnection.get_instance()
-    cursor = db_connection.get_cursor()
+    return get_dust_balance(user_id, server_id) >= cost
 
-    try:
-        cursor.execute("SELECT balance FROM DustBalance WHERE userID = ? AND serverID = ?", (user_id, server_id))
-        result = cursor.fetchone()
-        if result:
-            return result[0] >= cost
-        return False
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e}")
-        return False
 
+def register_servers(server_ids: List[int], shard: Optional[int] = None) -> int:
+    """
+    Registers guilds in one transaction, as the bot does with every guild it sees on startup.
 
+    Args:
+        server_ids (List[int]): The Discord server IDs, all held by the same database file.
+        shard (Optional[int]): That file's shard, None for the main database.
 
-def ensure_server_exists_in_db(server_id: str):
-    db_connection = DatabaseConnection.get_instance()
-    cursor = db_connection.get_cursor()
+    Returns:
+        int: The number of guilds that were not registered yet.
+    """
+    db_connection = DatabaseConnection.for_shard(shard)
 
     try:
-        
-        cursor.execute("SELECT id FROM Server WHERE serverID = ?", (server_id,))
-        if cursor.fetchone() is None:
-            
-            cursor.execute("INSERT INTO Server (serverID) VALUES (?)", (server_id,))
-            db_connection.commit()
+        with db_connection.transaction() as cursor:
+            cursor.executemany("INSERT OR IGNORE INTO Server (serverID) VALUES (?)", [(server_id,) for server_id in server_ids])
+            return cursor.rowcount
     except sqlite3.Error as e:
         print(f"An error occurred: {e}")
+        return 0
 
 
-def check_user_cooldown(user_id: str, server_id: str) -> Tuple[bool, Optional[datetime.datetime]]:
+def check_user_cooldown(user_id: int, server_id: int, count: int = 1) -> Tuple[bool, Optional[datetime.datetime]]:
     """
-    Checks if a user is currently under cooldown for random on a specific server.
+    Checks if a user can use random on a specific server, and if so records the request.
+
+    This is answered entirely by the in-memory rate limiter; UserRequests is only written when
+    the limiter persists.
 
     Args:
-        user_id (str): The user's Discord ID.
-        server_id (str): The Discord server's ID.
+        user_id (int): The user's Discord ID.
+        server_id (int): The Discord server's ID.
+        count (int): The number of requests to record at once.
 
     Returns:
-        Tuple[bool, Optional[datetime.datetime]]: A tuple where the first element is a boolean indicating if the user is under cooldown,
-        and the second element is the cooldown end time if they are under cooldown.
+        Tuple[bool, Optional[datetime.datetime]]: A tuple where the first element is a boolean indicating if the user can make the request,
+        and the second element is the cooldown end time if they cannot.
     """
-    # Check the cache first
-    is_on_cooldown, cooldown_end = cache.check_cooldown(user_id, server_id)
-    if is_on_cooldown:
-        return False, cooldown_end
-
-    db_connection = DatabaseConnection.get_instance()
-    cursor = db_connection.get_cursor()
-    current_time = datetime.datetime.now()
-
-    try:
-        cursor.execute("""
-        SELECT firstRequestTime, requestCount FROM UserRequests WHERE userID = ? AND serverID = ?
-        """, (user_id, server_id))
-        row = cursor.fetchone()
-
-        if row:
-            first_request_time, request_count = row
-            first_request_time = datetime.datetime.fromisoformat(first_request_time)
-
-            if current_time - first_request_time < datetime.timedelta(hours=1):
-                if request_count >= 5:
-                    cooldown_end = first_request_time + datetime.timedelta(hours=1)
-                    cache.set_cooldown(user_id, server_id, cooldown_end)  # Update cache
-                    return False, cooldown_end  
-                else:
-                    cursor.execute("""
-                    UPDATE UserRequests SET requestCount = requestCount + 1 WHERE userID = ? AND serverID = ?
-                    """, (user_id, server_id))
-            else:
-                cursor.execute("""
-                UPDATE UserRequests SET firstRequestTime = ?, requestCount = 1 WHERE userID = ? AND serverID = ?
-                """, (current_time.isoformat(), user_id, server_id))
-            db_connection.commit()
-            return True, None  
-        else:
-            cursor.execute("""
-            INSERT INTO UserRequests (userID, serverID, firstRequestTime, requestCount) VALUES (?, ?, ?, ?)
-            """, (user_id, server_id, current_time.isoformat(), 1))
-            db_connection.commit()
-            return True, None  
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e}")
-        return False, None  
+    return RateLimiter.get_instance().acquire(user_id, server_id, count)
 
 
 
-def check_card_ownership(user_id: str, card_id: int, server_id: str) -> bool:
+def check_card_ownership(user_id: int, card_id: int, server_id: int) -> bool:
     """
     Checks if a user already owns a specific card on a specific server.
 
     Args:
-        user_id (str): The user's ID.
+        user_id (int): The user's ID.
         card_id (int): The card's ID.
-        server_id (str): The server's ID where the ownership is checked.
+        server_id (int): The server's ID where the ownership is checked.
 
     Returns:
         bool: True if the user owns the card, False otherwise.
     """
-    db_connection = DatabaseConnection.get_instance()
-    cursor = db_connection.get_cursor()
-
-    try:
-
-        cursor.execute("""
-        SELECT 1 FROM UserCard 
-        WHERE userID = ? AND serverID = ? AND cardID = ?;
-        """, (user_id, server_id, card_id))
-        return cursor.fetchone() is not None
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e}")
-        return False
-
+    return OwnershipStore.get_instance().owns(user_id, server_id, card_id)
 
 
-def get_next_reset_time(server_id: str) -> datetime.datetime:
-    db_connection = DatabaseConnection.get_instance()
-    cursor = db_connection.get_cursor()
-    try:
-        cursor.execute("SELECT lastUpdated FROM Shop WHERE serverID = ?", (server_id,))
-        result = cursor.fetchone()
-        if result:
-            last_updated = datetime.datetime.fromisoformat(result[0])
-            return last_updated + datetime.timedelta(hours=1)
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e}")
 
-    
-    return datetime.datetime.now()
+def get_next_reset_time(server_id: int) -> datetime.datetime:
+    """
+    Returns when the server's shop next rotates. Every server rotates on the hour, and an
+    admin reset lasts until that same rotation.
+    """
+    return next_reset_time()
 
 
-def reset_cooldown(user_id: str, server_id: str):
-    db_connection = DatabaseConnection.get_instance()
-    cursor = db_connection.get_cursor()
+def reset_cooldown(user_id: int, server_id: int):
+    RateLimiter.get_instance().reset(user_id, server_id)
+    db_connection = DatabaseConnection.for_guild(server_id)
 
     try:
-        cursor.execute("DELETE FROM UserRequests WHERE userID = ? AND serverID = ?", (user_id, server_id))
-        db_connection.commit()
+        with db_connection.transaction() as cursor:
+            cursor.execute("DELETE FROM UserRequests WHERE userID = ? AND serverID = ?", (user_id, server_id))
     except sqlite3.Error as e:
         print(f"An error occurred: {e}")
 
 
-def reset_shop(server_id: str):
+def reset_shop(server_id: int):
     """
-    Resets the shop for a specific server and triggers an update.
+    Resets the shop for a specific server with a fresh random draw, stored as an override
+    until the next rotation.
 
     Args:
-        server_id (str): The Discord server's ID.
+        server_id (int): The Discord server's ID.
     """
-    db_connection = DatabaseConnection.get_instance()
-    cursor = db_connection.get_cursor()
-
-    try:
-        
-        cursor.execute("DELETE FROM Shop WHERE serverID = ?", (server_id,))
-        db_connection.commit()
-
-        
-        update_shop_inventory(server_id)
-        
-    except sqlite3.Error as e:
-        print(f"An error occurred: {e}")
-
-
+    update_shop_inventory(server_id)
@@ -1,37 +1,213 @@
+"""
+Starts the bot.
+
+    python main.py                          # one process running every shard Discord recommends
+    python main.py --workers 4              # the shards split across 4 worker processes
+    python main.py --workers 4 --shards 16  # a fixed shard count
+
+Workers share the database; each serves a contiguous range of shards and with it a disjoint set
+of guilds (see utils.sharding). A worker that dies is started again after a short delay.
+"""
+import argparse
+import asyncio
+import functools
+import multiprocessing
+import signal
+import time
+from typing import Optional
 import discord
 from bot import MyBot
 from utils.credentials import load_credentials
-from database.init_db import init_db
-from utils.cache import CooldownCache
-import asyncio
+from utils.connection import DatabaseConnection
+from utils.sharding import IdentifyGate, ShardAssignment, fetch_gateway, split_shards, use_api_base
+from utils.startup import StartupTimer
+
+RESTART_DELAY = 5.0  # seconds before a dead worker is started again
+
+
+def prepare(database=None):
+    """Brings the database up to date. Runs once, in the launcher, before any worker starts."""
+    from database.init_db import init_db
+
+    if database:
+        DatabaseConnection.configure(database)
+    with StartupTimer.get_instance().step('migrations'):
+        init_db()
+    DatabaseConnection.close()
+
 
-init_db()
-credentials = load_credentials('credentials.json')
-intents = discord.Intents.default()
-bot = MyBot(intents=intents)
+def load_state(settings: Optional[dict] = None):
+    """
+    Loads the catalog and the in-memory state of the guilds this process serves.
 
-async def reconnect_loop():
+    MyBot runs this on a thread while the shards log in, so none of it delays the gateway.
+    """
+    from database.catalog import CardCatalog
+    from database.shop import load_shop_overrides
+    from database.stats import GuildStats
+    from utils.cache import RateLimiter
+    from utils.drops import DropEngine
+    from utils.render import CardEmbeds
+
+    timer = StartupTimer.get_instance()
+    with timer.step('catalog', background=True):
+        CardCatalog.get_instance()
+    with timer.step('embeds', background=True):
+        CardEmbeds.get_instance().refresh()
+    with timer.step('drops', background=True):
+        drops = DropEngine.get_instance()
+        if settings and settings.get('drop_rates'):
+            drops.configure(settings['drop_rates'])
+    with timer.step('shop', background=True):
+        load_shop_overrides()
+    with timer.step('cooldowns', background=True):
+        RateLimiter.get_instance()
+    with timer.step('stats', background=True):
+        GuildStats.get_instance()
+
+
+async def reconnect_loop(bot, token):
     while True:
         await asyncio.sleep(1)
         if bot.is_closed():
             print('Bot is disconnected, attempting to reconnect...')
             try:
-                await bot.start(credentials['token'])
+                await bot.start(token)
                 print('Reconnect successful.')
                 break
             except Exception as e:
                 print(f'Reconnect failed, {e}, retrying in 5 seconds...')
                 await asyncio.sleep(5)
 
-async def main():
+
+async def serve(bot, token, metrics_port=None):
+    from database.batch import WriteBatcher
+    from utils.cache import RateLimiter
+    from utils.executor import DatabaseExecutor
+    from utils.metrics import serve_metrics
+
+    # The launcher stops its workers with SIGTERM; close the bot so the state below is saved.
     try:
-        await bot.start(credentials['token'])
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(bot.close()))
+    except NotImplementedError:
+        pass
+
+    if metrics_port:
+        # Prometheus-format metrics on localhost only; see utils.metrics.
+        await serve_metrics(int(metrics_port))
+    try:
+        await bot.start(token)
     except KeyboardInterrupt:
         pass
     except Exception as e:
         print(f"Fatal exception {e}, running reconnect loop.")
-        await reconnect_loop()
+        await reconnect_loop(bot, token)
+    finally:
+        await WriteBatcher.close_all()
+        RateLimiter.get_instance().persist()
+        DatabaseExecutor.shutdown()
 
-if __name__ == '__main__':
+
+def run_worker(settings: dict, worker: int = 0, shard_ids=None, shard_count=None, identify_gate=None):
+    """Runs the bot on the given shards, or on every shard when shard_ids is None."""
+    if settings.get('api_base'):
+        use_api_base(settings['api_base'])
+    if settings.get('database'):
+        DatabaseConnection.configure(settings['database'])
+    if settings.get('dust_ledger'):
+        from database.dust import set_ledger_enabled
+        set_ledger_enabled(True)
+    if identify_gate is not None:
+        # Started by launch(), which handles Ctrl+C for every worker and stops them with SIGTERM.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    StartupTimer.get_instance()
+    ShardAssignment.get_instance().configure(shard_ids, shard_count, worker)
+
+    bot = MyBot(intents=discord.Intents.default(), shard_ids=shard_ids, shard_count=shard_count,
+                identify_gate=identify_gate, load_state=functools.partial(load_state, settings))
+    # Each worker exposes its own metrics, on consecutive ports.
+    metrics_port = settings.get('metrics_port') and int(settings['metrics_port']) + worker
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
+    loop.run_until_complete(serve(bot, settings['token'], metrics_port))
+
+
+def launch(settings: dict, workers: int, shard_count=None):
+    """Splits the shards across worker processes and keeps them running until interrupted."""
+    if settings.get('api_base'):
+        use_api_base(settings['api_base'])
+    recommended, max_concurrency = asyncio.run(fetch_gateway(settings['token']))
+    shard_count = shard_count or recommended
+    ranges = split_shards(shard_count, workers)
+    print(f"Running {shard_count} shards on {len(ranges)} workers.")
+
+    context = multiprocessing.get_context('spawn')
+    gate = IdentifyGate(context, max_concurrency)
+
+    def start(worker):
+        process = context.Process(target=run_worker, args=(settings, worker, ranges[worker], shard_count, gate),
+                                  name=f"hoardcraft-worker-{worker}")
+        process.start()
+        return process
+
+    processes = [start(worker) for worker in range(len(ranges))]
+    stopping = False
+
+    def stop(*args):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        while not stopping:
+            time.sleep(1)
+            for worker, process in enumerate(processes):
+                if not process.is_alive() and not stopping:
+                    print(f"Worker {worker} (shards {ranges[worker][0]}-{ranges[worker][-1]}) exited with code {process.exitcode}, restarting.")
+                    time.sleep(RESTART_DELAY)
+                    processes[worker] = start(worker)
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--credentials', default='credentials.json')
+    parser.add_argument('--workers', type=int, help="worker processes to spread the shards across (default 1)")
+    parser.add_argument('--shards', type=int, help="total shard count (default: what Discord recommends)")
+    parser.add_argument('--database', help="the SQLite database (default database.sqlite)")
+    parser.add_argument('--api-base', help=argparse.SUPPRESS)  # a fake Discord to talk to; see tools.mock_gateway
+    args = parser.parse_args(argv)
+    StartupTimer.get_instance()
+
+    credentials = load_credentials(args.credentials)
+    settings = {
+        'token': credentials['token'],
+        'metrics_port': credentials.get('metrics_port'),
+        'dust_ledger': credentials.get('dust_ledger', False),
+        'drop_rates': credentials.get('drop_rates'),
+        'database': args.database,
+        'api_base': args.api_base,
+    }
+    if settings['drop_rates']:
+        from utils.drops import validate_rates
+        try:
+            validate_rates(settings['drop_rates'])
+        except ValueError as e:
+            parser.error(f"drop_rates in {args.credentials}: {e}")
+    workers = args.workers or credentials.get('workers', 1)
+    shard_count = args.shards or credentials.get('shard_count')
+
+    prepare(args.database)
+    if workers > 1:
+        launch(settings, workers, shard_count)
+    else:
+        run_worker(settings, shard_count=shard_count)
+
+
+if __name__ == '__main__':
+    main()
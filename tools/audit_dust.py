@@ -0,0 +1,41 @@
+"""
+Lists the dust balances that disagree with the dust ledger.
+
+With "dust_ledger": true in credentials.json the bot records every dust change in DustLedger,
+and folds entries older than a week into DustLedgerSummary. This adds both up for every
+balance, in the main database and in every shard file, and prints the ones that differ. Balances
+that were not zero when the ledger was turned on always differ by what they held then.
+
+    python -m tools.audit_dust
+    python -m tools.audit_dust --database other.sqlite
+"""
+import argparse
+import os
+import sys
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='database.sqlite', help="the main database")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.database):
+        parser.error(f"{args.database} does not exist")
+
+    from database.dust import audit_dust_balances
+    from utils.connection import DatabaseConnection
+
+    DatabaseConnection.configure(args.database)
+    try:
+        mismatches = audit_dust_balances()
+    finally:
+        DatabaseConnection.close()
+
+    for user_id, server_id, balance, ledger in mismatches:
+        print(f"user {user_id} on server {server_id}: balance {balance:,}, ledger {ledger:,}")
+    print(f"{len(mismatches):,} mismatched balances")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,345 @@
+"""
+Load test of the real cogs and views against a large synthetic database.
+
+Builds (or reuses) a database with thousands of guilds and millions of UserCard rows, then
+drives Random.random (one card and a five-card pull), Shop.shop, List.list and Utils.checkdust,
+plus the Claim / Next buttons of the views they return, through fake contexts at several
+concurrency levels.
+Reports throughput and p50/p99 latency per operation, and compares them with a stored
+baseline so a slower data layer is caught before it ships.
+
+    python -m tools.benchmark                                  # build /tmp data, run, compare with the baseline
+    python -m tools.benchmark --guilds 200 --users 20          # smaller data set
+    python -m tools.benchmark --save-baseline                  # record the current numbers as the baseline
+    python -m tools.benchmark --database bench.sqlite --rebuild
+    python -m tools.benchmark --shards 4 --commands random,pull  # the same data split into 4 shard files
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+from database.catalog import RARITY_ORDER
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+
+COLLECTIONS = ('Forsaken', 'Scourge', 'Alliance', 'Night Elves', 'Scarlet Crusade', 'Horde', 'Old Gods', 'Blackrock',
+               'Dragon Flights', "Quel'Thalas")
+CARD_RARITIES = {'legendary': 15, 'epic': 30, 'rare': 60, 'uncommon': 90, 'common': 105}
+
+GUILD_BASE = 100_000_000_000_000_000
+USER_BASE = 300_000_000_000_000_000
+
+# A p50 this much slower than the baseline, or throughput this much lower, fails the run. The tail
+# is noisier, so p99 gets twice the margin, and nothing under NOISE_FLOOR_MS counts at all.
+DEFAULT_TOLERANCE = 0.5
+NOISE_FLOOR_MS = 1.0
+
+
+def guild_id(guild: int) -> int:
+    # Spaced like real snowflakes created at different times, so shard_for() spreads the guilds over every shard.
+    return GUILD_BASE + (guild << 22)
+
+
+def user_id(guild: int, user: int, users_per_guild: int) -> int:
+    return USER_BASE + guild * users_per_guild + user
+
+
+def populate(path: str, guilds: int, users: int, cards_per_user: int, seed: int):
+    """Creates the database at path and fills it with the synthetic catalog, guilds, collections and balances."""
+    from database.init_db import init_db
+    from database.ownership import rebuild_bits
+    from utils.connection import DatabaseConnection
+
+    DatabaseConnection.configure(path)
+    init_db()
+    rng = random.Random(seed)
+    db_connection = DatabaseConnection.get_instance()
+
+    started = time.perf_counter()
+    with db_connection.transaction() as cursor:
+        cursor.executemany("INSERT OR IGNORE INTO Collection (name) VALUES (?)", [(name,) for name in COLLECTIONS])
+        cursor.execute("SELECT id FROM Collection ORDER BY id")
+        collection_ids = [row[0] for row in cursor.fetchall()]
+        cards = []
+        for rarity in RARITY_ORDER:
+            for i in range(CARD_RARITIES[rarity]):
+                cards.append((f"{rarity.title()} card {i}", collection_ids[len(cards) % len(collection_ids)], rarity,
+                              f"Title {len(cards)}", f"Quote number {len(cards)}", f"https://example.com/{len(cards)}.png"))
+        cursor.executemany("INSERT INTO Card (name, collectionID, rarity, title, quote, imageURL) VALUES (?, ?, ?, ?, ?, ?)", cards)
+        cursor.execute("SELECT id FROM Card")
+        card_ids = [row[0] for row in cursor.fetchall()]
+
+    rows = 0
+    for guild in range(guilds):
+        server_id = guild_id(guild)
+        owned, balances = [], []
+        for user in range(users):
+            member = user_id(guild, user, users)
+            count = min(len(card_ids), max(1, int(rng.expovariate(1 / cards_per_user))))
+            owned.extend((member, server_id, card_id) for card_id in rng.sample(card_ids, count))
+            balances.append((member, server_id, rng.randrange(0, 2000)))
+        with db_connection.transaction() as cursor:
+            cursor.execute("INSERT OR IGNORE INTO Server (serverID) VALUES (?)", (server_id,))
+            cursor.executemany("INSERT OR IGNORE INTO UserCard (userID, serverID, cardID) VALUES (?, ?, ?)", owned)
+            cursor.executemany("INSERT INTO DustBalance (userID, serverID, balance) VALUES (?, ?, ?)", balances)
+            rebuild_bits(cursor, [(member, server_id) for member, _, _ in balances])
+        rows += len(owned)
+        if guild % 100 == 99:
+            print(f"  {guild + 1:,}/{guilds:,} guilds, {rows:,} UserCard rows ({time.perf_counter() - started:.0f}s)", flush=True)
+
+    with db_connection.transaction() as cursor:
+        cursor.execute("ANALYZE")
+    print(f"Populated {path}: {guilds:,} guilds, {guilds * users:,} users, {rows:,} UserCard rows "
+          f"in {time.perf_counter() - started:.0f}s")
+    DatabaseConnection.close()
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def best(first: dict, second: dict) -> dict:
+    """The better figures of two runs of the same operation; the best of a few runs is far steadier than any one."""
+    merged = dict(first)
+    merged['count'] = first['count'] + second['count']
+    merged['throughput'] = max(first['throughput'], second['throughput'])
+    for metric in ('p50_ms', 'p99_ms', 'db_ms'):
+        merged[metric] = min(first[metric], second[metric])
+    return merged
+
+
+class Bench:
+    """The cogs under test, plus the latencies recorded per operation."""
+
+    def __init__(self, guilds: int, users: int, seed: int):
+        from cogs.list import List as ListCog
+        from cogs.random import Random
+        from cogs.shop import Shop
+        from cogs.utils import Utils
+        from tools.fakes import FakeBot
+
+        bot = FakeBot()
+        self.random_cog, self.shop_cog, self.list_cog, self.utils_cog = Random(bot), Shop(bot), ListCog(bot), Utils(bot)
+        self.guilds = guilds
+        self.users = users
+        self.rng = random.Random(seed)
+        self.samples: Dict[str, List[float]] = {}
+        self.db_seconds: Dict[str, float] = {}
+
+    def close(self):
+        for cog in (self.random_cog, self.utils_cog):
+            cog.cog_unload()
+
+    def context(self):
+        from tools.fakes import FakeContext, FakeGuild, FakeUser
+        guild = self.rng.randrange(self.guilds)
+        member = user_id(guild, self.rng.randrange(self.users), self.users)
+        return FakeContext(FakeUser(member), FakeGuild(guild_id(guild)))
+
+    async def timed(self, name: str, ctx, call):
+        from utils.metrics import command_timer
+        started = time.perf_counter()
+        with command_timer(name, ctx.guild.id) as timing:
+            await call()
+        self.samples.setdefault(name, []).append(time.perf_counter() - started)
+        self.db_seconds[name] = self.db_seconds.get(name, 0.0) + timing.db_seconds
+
+    async def press(self, name: str, ctx, view, label: str):
+        """Clicks a button the way handle_component() would, and returns the view the message was left with."""
+        from tools.fakes import click, find_item
+        from utils.components import handlers, parse_component_id
+        if find_item(view, label).disabled:
+            return None
+        interaction = click(view, label, ctx.author, ctx.guild)
+        action, fields = parse_component_id(interaction.data['custom_id'])
+        await self.timed(name, ctx, lambda: handlers[action][1](interaction, *fields))
+        return interaction.view
+
+    async def random(self):
+        ctx = self.context()
+        await self.timed('/random', ctx, lambda: self.random_cog.random.callback(self.random_cog, ctx, 1))
+        if ctx.view is not None:
+            await self.press('ClaimView.claim', ctx, ctx.view, 'Claim')
+
+    async def pull(self):
+        ctx = self.context()
+        await self.timed('/random count:5', ctx, lambda: self.random_cog.random.callback(self.random_cog, ctx, 5))
+        if ctx.view is not None:
+            await self.press('PullView.claim_all', ctx, ctx.view, 'Claim all')
+
+    async def shop(self):
+        ctx = self.context()
+        await self.timed('/shop', ctx, lambda: self.shop_cog.shop.callback(self.shop_cog, ctx))
+        if ctx.view is not None:
+            await self.press('ShopView.next', ctx, ctx.view, 'Next')
+
+    async def list(self):
+        ctx = self.context()
+        await self.timed('/list', ctx, lambda: self.list_cog.list.callback(self.list_cog, ctx))
+        view = ctx.view
+        for _ in range(3):
+            if view is None:
+                break
+            view = await self.press('PaginatedView.next', ctx, view, 'Next')
+
+    async def checkdust(self):
+        ctx = self.context()
+        await self.timed('/checkdust', ctx, lambda: self.utils_cog.checkdust.callback(self.utils_cog, ctx))
+
+
+async def run_level(scenario: Callable, concurrency: int, iterations: int) -> float:
+    """Runs the scenario iterations times over concurrency workers and returns the wall time."""
+    remaining = iterations
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            await scenario()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started
+
+
+async def run_benchmark(args) -> Dict[str, dict]:
+    from database.batch import WriteBatcher
+    from database.catalog import CardCatalog
+    from database.shop import load_shop_overrides
+    from database.stats import GuildStats
+    from utils import cache
+    from utils.cache import RateLimiter
+
+    # /random would otherwise refuse every user after five calls and only the refusal would be measured.
+    cache.REQUEST_LIMIT = 10 ** 9
+    CardCatalog.get_instance()
+    load_shop_overrides()
+    RateLimiter.get_instance()
+    GuildStats.get_instance()
+
+    bench = Bench(args.guilds, args.users, args.seed)
+    results = {}
+    try:
+        for concurrency in args.concurrency:
+            for command in args.commands:
+                for _ in range(args.repeat):
+                    bench.samples.clear()
+                    bench.db_seconds.clear()
+                    wall = await run_level(getattr(bench, command), concurrency, args.iterations)
+                    for name, samples in sorted(bench.samples.items()):
+                        result = {
+                            'operation': name,
+                            'concurrency': concurrency,
+                            'count': len(samples),
+                            'throughput': len(samples) / wall,
+                            'p50_ms': percentile(samples, 0.50) * 1000,
+                            'p99_ms': percentile(samples, 0.99) * 1000,
+                            'db_ms': bench.db_seconds.get(name, 0.0) / len(samples) * 1000,
+                        }
+                        key = f"{name}@{concurrency}"
+                        results[key] = best(results[key], result) if key in results else result
+    finally:
+        bench.close()
+        await WriteBatcher.close_all()
+    return results
+
+
+def print_results(results: Dict[str, dict]):
+    print(f"{'operation':<22}{'conc':>5}{'count':>8}{'ops/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'db ms':>8}")
+    for result in results.values():
+        print(f"{result['operation']:<22}{result['concurrency']:>5}{result['count']:>8}{result['throughput']:>10.0f}"
+              f"{result['p50_ms']:>9.2f}{result['p99_ms']:>9.2f}{result['db_ms']:>8.2f}")
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Every operation that regressed by more than tolerance against the baseline."""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric, margin in (('p50_ms', tolerance), ('p99_ms', 2 * tolerance)):
+            if result[metric] > max(base[metric] * (1 + margin), NOISE_FLOOR_MS):
+                regressions.append(f"{key}: {metric} {base[metric]:.2f} -> {result[metric]:.2f}")
+        if result['throughput'] < base['throughput'] / (1 + tolerance):
+            regressions.append(f"{key}: throughput {base['throughput']:.0f} -> {result['throughput']:.0f} ops/s")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default=os.path.join(tempfile.gettempdir(), 'hoardcraft-bench.sqlite'),
+                        help="database to benchmark against; built if missing")
+    parser.add_argument('--rebuild', action='store_true', help="rebuild the database even if it exists")
+    parser.add_argument('--guilds', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=40, help="users per guild")
+    parser.add_argument('--cards-per-user', type=int, default=25, help="mean cards owned per user")
+    parser.add_argument('--concurrency', type=lambda value: [int(level) for level in value.split(',')], default=[1, 8, 32])
+    parser.add_argument('--iterations', type=int, default=500, help="scenario runs per command and concurrency level")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per level; the best of them is reported")
+    parser.add_argument('--commands', type=lambda value: value.split(','), default=['random', 'pull', 'shop', 'list', 'checkdust'])
+    parser.add_argument('--shards', type=int, default=0, help="split the per-guild tables into this many shard files (see tools.reshard)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    from utils.connection import DatabaseConnection
+
+    if args.rebuild or not os.path.exists(args.database):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.database + suffix):
+                os.remove(args.database + suffix)
+        populate(args.database, args.guilds, args.users, args.cards_per_user, args.seed)
+
+    # Benchmark a copy, so the writes of one run do not skew the next.
+    with tempfile.TemporaryDirectory() as directory:
+        DatabaseConnection.configure(args.database)
+        DatabaseConnection.get_instance().connection.execute(f"VACUUM INTO '{os.path.join(directory, 'bench.sqlite')}'")
+        DatabaseConnection.configure(os.path.join(directory, 'bench.sqlite'))
+        if args.shards:
+            from tools.reshard import reshard
+            reshard(os.path.join(directory, 'bench.sqlite'), args.shards, verbose=False)
+            DatabaseConnection.configure(os.path.join(directory, 'bench.sqlite'))
+
+        results = asyncio.run(run_benchmark(args))
+        from utils.executor import DatabaseExecutor
+        DatabaseExecutor.shutdown()
+        DatabaseConnection.close()
+
+    print_results(results)
+    dataset = {'guilds': args.guilds, 'users': args.users, 'cards_per_user': args.cards_per_user, 'iterations': args.iterations,
+               'repeat': args.repeat}
+    if args.shards:
+        dataset['shards'] = args.shards
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump({'dataset': dataset, 'results': results}, file, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}.")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare with; run with --save-baseline to record one.")
+        return 0
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if baseline.get('dataset') != dataset:
+        print(f"Baseline was recorded on a different data set ({baseline.get('dataset')}); not comparing.")
+        return 0
+    regressions = compare(results, baseline['results'], args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print("FAIL" if regressions else "PASS")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
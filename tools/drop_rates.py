@@ -0,0 +1,160 @@
+"""
+Statistical check of the drop engine.
+
+Draws millions of cards from each weighting profile and compares the observed rarity
+rates with the configured ones. Every tier must land within a few standard errors of its
+expected rate, and every card within a tier must be drawn about equally often.
+
+The alias tables are checked as built directly, then as the bot gets them: the cards are
+written to a scratch database, a guild override is stored with DropEngine.set_guild_rates and
+read back, and DropEngine.get_table serves the guild's profile and a collection's.
+
+    python -m tools.drop_rates                  # synthetic catalog, 2,000,000 draws per profile
+    python -m tools.drop_rates --catalog        # the real catalog in database.sqlite
+    python -m tools.drop_rates --draws 10000000 --seed 42
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+from database.catalog import CardRecord, RARITY_ORDER
+from utils.drops import DEFAULT_DROP_RATES, AliasTable, build_alias_table, expected_tier_rates
+
+
+# Bonferroni-style margin: with ~5 tiers per profile a true engine trips this far less than once in a million runs.
+Z_LIMIT = 5.0
+
+# A guild override that disables legendaries and flattens the rest.
+GUILD_RATES = {'legendary': 0, 'epic': 1, 'rare': 1, 'uncommon': 1, 'common': 1}
+GUILD_ID = 1
+
+
+def synthetic_catalog(per_tier: Dict[str, int] = None) -> List[CardRecord]:
+    per_tier = per_tier or {'legendary': 12, 'epic': 25, 'rare': 60, 'uncommon': 90, 'common': 200}
+    collections = ('Forsaken', 'Alliance', 'Horde', 'Scourge')
+    cards = []
+    for rarity, count in per_tier.items():
+        for i in range(count):
+            card_id = len(cards) + 1
+            cards.append(CardRecord(card_id, f"{rarity}-{i}", collections[card_id % len(collections)], rarity, "", "", ""))
+    return cards
+
+
+def check_profile(label: str, cards: Sequence[CardRecord], rates: Dict[str, float], table: Optional[AliasTable],
+                  draws: int, rng: random.Random) -> bool:
+    """Samples a profile's alias table and checks the rates it yields against the cards and rates it was built from."""
+    if table is None:
+        if any(rates.get(card.rarity) for card in cards):
+            print(f"[{label}] no table for a pool of {len(cards)} cards FAIL")
+            return False
+        print(f"[{label}] empty pool, skipped")
+        return True
+
+    counts = Counter()
+    sample = table.sample
+    for _ in range(draws):
+        counts[sample(rng).id] += 1
+
+    expected = expected_tier_rates(cards, rates)
+    tier_counts = Counter()
+    tier_cards = {}
+    for card in cards:
+        tier_counts[card.rarity] += counts[card.id]
+        tier_cards.setdefault(card.rarity, []).append(card)
+
+    ok = True
+    print(f"[{label}] {draws:,} draws over {len(cards)} cards")
+    for rarity in RARITY_ORDER:
+        if rarity not in expected:
+            continue
+        p = expected[rarity]
+        observed = tier_counts[rarity] / draws
+        stderr = math.sqrt(p * (1 - p) / draws) or 1e-12
+        z = (observed - p) / stderr
+        # Chi-square of the within-tier spread; mean is dof, sd is sqrt(2 * dof).
+        members = tier_cards[rarity]
+        dof = len(members) - 1
+        spread_ok = True
+        if dof > 0 and tier_counts[rarity] > 0:
+            mean = tier_counts[rarity] / len(members)
+            chi2 = sum((counts[card.id] - mean) ** 2 / mean for card in members)
+            spread_ok = chi2 <= dof + Z_LIMIT * math.sqrt(2 * dof)
+        tier_ok = abs(z) <= Z_LIMIT and spread_ok
+        ok &= tier_ok
+        print(f"  {rarity:<10} expected {p:8.5f}  observed {observed:8.5f}  z={z:+6.2f}  "
+              f"{'uniform' if spread_ok else 'NOT uniform'}  {'ok' if tier_ok else 'FAIL'}")
+    return ok
+
+
+def engine_profiles(cards: Sequence[CardRecord], directory: str) -> list:
+    """
+    The guild and per-collection profiles as DropEngine serves them, from a scratch database holding cards.
+
+    Returns:
+        list: (label, pool, rates, table) for the guild override and for each collection.
+    """
+    from database.catalog import CardCatalog
+    from database.init_db import init_db
+    from utils.connection import DatabaseConnection
+    from utils.drops import DropEngine
+
+    DatabaseConnection.configure(os.path.join(directory, 'drops.sqlite'))
+    init_db()
+    with DatabaseConnection.get_instance().transaction() as cursor:
+        collections = sorted({card.collection for card in cards})
+        cursor.executemany("INSERT INTO Collection (id, name) VALUES (?, ?)", list(enumerate(collections, start=1)))
+        collection_ids = {name: collection_id for collection_id, name in enumerate(collections, start=1)}
+        cursor.executemany("INSERT INTO Card (id, name, collectionID, rarity, title, quote, imageURL) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           [(card.id, card.name, collection_ids[card.collection], card.rarity, card.title, card.quote, card.image_url)
+                            for card in cards])
+    catalog = CardCatalog.get_instance()
+    catalog.load()
+
+    engine = DropEngine.get_instance()
+    engine.set_guild_rates(GUILD_ID, GUILD_RATES)
+    engine.load_guild_rates()  # read back from GuildDropRate, as a restarted bot would
+    pool = list(catalog.cards)
+    profiles = [("engine guild override", pool, GUILD_RATES, engine.get_table(GUILD_ID))]
+    for collection in catalog.collections:
+        members = [card for card in pool if card.collection == collection]
+        profiles.append((f"engine collection {collection}", members, DEFAULT_DROP_RATES, engine.get_table(None, collection)))
+    DatabaseConnection.close()
+    return profiles
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--draws', type=int, default=2_000_000)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--catalog', action='store_true', help="use the real catalog instead of a synthetic one")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    if args.catalog:
+        from database.catalog import CardCatalog
+        cards = list(CardCatalog.get_instance().cards)
+    else:
+        cards = synthetic_catalog()
+
+    profiles = [("global", cards, DEFAULT_DROP_RATES)]
+    for collection in sorted({card.collection for card in cards}):
+        profiles.append((f"collection {collection}", [card for card in cards if card.collection == collection], DEFAULT_DROP_RATES))
+    profiles.append(("guild override", cards, GUILD_RATES))
+    profiles = [(label, pool, rates, build_alias_table(pool, rates)) for label, pool, rates in profiles]
+
+    with tempfile.TemporaryDirectory() as directory:
+        profiles += engine_profiles(cards, directory)
+
+    ok = True
+    for label, pool, rates, table in profiles:
+        ok &= check_profile(label, pool, rates, table, args.draws, rng)
+    print("PASS" if ok else "FAIL")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+Stand-ins for the discord objects the cogs and views touch, so their real code can be driven
+without a gateway connection. Every reply is recorded instead of sent.
+"""
+from typing import List, Optional
+
+
+class FakeUser:
+    def __init__(self, user_id: int, name: Optional[str] = None):
+        self.id = user_id
+        self.name = name or f"user{user_id}"
+        self.display_name = self.name
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, name: Optional[str] = None):
+        self.id = guild_id
+        self.name = name or f"guild{guild_id}"
+
+
+class Reply:
+    """One recorded response: what was sent, and the view attached to it if any."""
+
+    def __init__(self, content=None, embed=None, view=None, ephemeral=False):
+        self.content = content
+        self.embed = embed
+        self.view = view
+        self.ephemeral = ephemeral
+
+
+class FakeResponse:
+    def __init__(self, replies: List[Reply]):
+        self.replies = replies
+        self.done = False
+
+    def is_done(self) -> bool:
+        return self.done
+
+    async def send_message(self, content=None, *, embed=None, view=None, ephemeral=False, **kwargs):
+        self.done = True
+        self.replies.append(Reply(content, embed, view, ephemeral))
+
+    async def edit_message(self, *, content=None, embed=None, view=None, **kwargs):
+        self.done = True
+        self.replies.append(Reply(content, embed, view))
+
+    async def defer(self, *args, **kwargs):
+        self.done = True
+
+
+class FakeFollowup:
+    def __init__(self, replies: List[Reply]):
+        self.replies = replies
+
+    async def send(self, content=None, *, embed=None, view=None, ephemeral=False, **kwargs):
+        self.replies.append(Reply(content, embed, view, ephemeral))
+
+
+class FakeInteraction:
+    """What view callbacks receive when a user clicks a button or picks an option."""
+
+    def __init__(self, user: FakeUser, guild: FakeGuild, data: Optional[dict] = None):
+        self.user = user
+        self.guild = guild
+        self.guild_id = guild.id
+        self.data = data or {}
+        self.replies: List[Reply] = []
+        self.response = FakeResponse(self.replies)
+        self.followup = FakeFollowup(self.replies)
+
+    @property
+    def view(self):
+        """The view attached to the latest reply that had one."""
+        for reply in reversed(self.replies):
+            if reply.view is not None:
+                return reply.view
+        return None
+
+
+class FakeContext:
+    """What slash command callbacks receive as ctx."""
+
+    def __init__(self, user: FakeUser, guild: FakeGuild):
+        self.author = user
+        self.user = user
+        self.guild = guild
+        self.guild_id = guild.id
+        self.interaction = FakeInteraction(user, guild)
+        self.replies = self.interaction.replies
+
+    async def respond(self, content=None, *, embed=None, view=None, ephemeral=False, **kwargs):
+        if self.interaction.response.is_done():
+            await self.interaction.followup.send(content, embed=embed, view=view, ephemeral=ephemeral)
+        else:
+            await self.interaction.response.send_message(content, embed=embed, view=view, ephemeral=ephemeral)
+
+    @property
+    def view(self):
+        """The view attached to the latest reply that had one."""
+        for reply in reversed(self.replies):
+            if reply.view is not None:
+                return reply.view
+        return None
+
+
+class FakeBot:
+    """Enough of the bot for the cogs' constructors and their background loops."""
+
+    def __init__(self, owner_id: Optional[int] = None):
+        self.owner_id = owner_id
+
+    async def wait_until_ready(self):
+        pass
+
+    async def is_owner(self, user) -> bool:
+        return user.id == self.owner_id
+
+    def get_guild(self, guild_id):
+        return None
+
+
+def find_item(view, label: str):
+    """The button (or other item) of a view with the given label."""
+    for item in view.children:
+        if getattr(item, 'label', None) == label:
+            return item
+    raise LookupError(f"{type(view).__name__} has no item labelled {label!r}")
+
+
+def click(view, label: str, user: FakeUser, guild: FakeGuild, values=None) -> FakeInteraction:
+    """The interaction Discord sends when user clicks the item of view with the given label (or picks values in it)."""
+    item = find_item(view, label)
+    data = {'custom_id': item.custom_id, 'component_type': item.type.value}
+    if values is not None:
+        data['values'] = list(values)
+    return FakeInteraction(user, guild, data)
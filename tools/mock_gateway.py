@@ -0,0 +1,385 @@
+"""
+A fake Discord, REST API and gateway, to run the sharded bot and its worker processes locally.
+
+    python -m tools.mock_gateway                                  # 4 shards on 2 workers, 200 guilds
+    python -m tools.mock_gateway --shards 8 --workers 3 --guilds 1000
+    python -m tools.mock_gateway --storage-shards 4               # the per-guild tables in 4 shard files (see tools.reshard)
+    python -m tools.mock_gateway --serve --port 8765              # only the fake Discord, for a bot started by hand
+
+Starts the fake Discord, runs main.py against it on a scratch database, and once every guild has
+been registered sends each guild a /random and a /checkdust from one of its members. It then
+stops the launcher and checks that
+
+  * every shard identified exactly once, with the launcher's shard count, and that IDENTIFYs in
+    the same rate-limit bucket were at least the identify interval apart;
+  * every guild was registered in the database, by the worker serving its shard;
+  * every command was answered, and not with an error;
+  * the workers' metrics timed the reply of every command (the 'respond' phase);
+  * every worker saved the rate-limit windows of its own guilds and none of another's.
+
+Guild events go out on shard (guild_id >> 22) % shard_count like Discord's, so a worker that
+served the wrong guilds, or processes that lost each other's writes, fail the run.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+from aiohttp import WSMsgType, web
+from utils.sharding import IDENTIFY_INTERVAL, shard_for
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API = "/api/v10"
+
+BOT_USER = {'id': '1172638884706918470', 'username': 'HoardCraft', 'discriminator': '0000', 'avatar': None, 'bot': True}
+APPLICATION_ID = BOT_USER['id']
+
+# Snowflakes carry their creation time above bit 22, which is what shard_for() looks at.
+SNOWFLAKE_BASE = 1_100_000_000_000
+
+
+def guild_id(index: int) -> int:
+    return (SNOWFLAKE_BASE + index * 7919) << 22 | index & 0xfff
+
+
+def member_id(index: int) -> int:
+    return (SNOWFLAKE_BASE + 500_000 + index) << 22
+
+
+def json_response(data) -> web.Response:
+    # py-cord only parses bodies whose Content-Type is exactly application/json, without a charset.
+    return web.Response(body=json.dumps(data).encode('utf-8'), headers={'Content-Type': 'application/json'})
+
+
+async def request_payload(request) -> dict:
+    """The JSON a request carries, either as its body or as the payload_json field of a form (how py-cord sends messages)."""
+    if not request.can_read_body:
+        return {}
+    if request.content_type in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+        form = await request.post()
+        return json.loads(form.get('payload_json') or "{}")
+    return await request.json()
+
+
+class MockDiscord:
+    """The REST routes and gateway events the bot uses, with every IDENTIFY and interaction recorded."""
+
+    def __init__(self, guild_ids: List[int], shard_count: int, max_concurrency: int):
+        self.guild_ids = guild_ids
+        self.shard_count = shard_count
+        self.max_concurrency = max_concurrency
+        self.url = None
+        self.commands: Dict[str, dict] = {}
+        self.identifies: List[Tuple[float, int, int]] = []  # (time, shard id, shard count)
+        self.shards: Dict[int, web.WebSocketResponse] = {}
+        self.sequences: Dict[int, itertools.count] = {}
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.ids = itertools.count(SNOWFLAKE_BASE << 22)
+
+        self.app = web.Application()
+        self.app.add_routes([
+            web.get(f"{API}/users/@me", self.current_user),
+            web.get(f"{API}/gateway", self.gateway),
+            web.get(f"{API}/gateway/bot", self.gateway),
+            web.get(f"{API}/applications/{{application_id}}/commands", self.get_commands),
+            web.put(f"{API}/applications/{{application_id}}/commands", self.put_commands),
+            web.post(f"{API}/interactions/{{interaction_id}}/{{token}}/callback", self.interaction_callback),
+            web.get(f"{API}/webhooks/{{application_id}}/{{token}}/messages/@original", self.original_message),
+            web.patch(f"{API}/webhooks/{{application_id}}/{{token}}/messages/@original", self.original_message),
+            web.post(f"{API}/webhooks/{{application_id}}/{{token}}", self.original_message),
+            web.get("/gateway", self.websocket),
+        ])
+        self.runner = web.AppRunner(self.app)
+
+    async def start(self, port: int = 0) -> str:
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def close(self):
+        for ws in list(self.shards.values()):
+            await ws.close()
+        await self.runner.cleanup()
+
+    def next_id(self) -> str:
+        return str(next(self.ids))
+
+    # REST
+
+    async def current_user(self, request):
+        return json_response(BOT_USER)
+
+    async def gateway(self, request):
+        return json_response({
+            'url': self.url.replace('http', 'ws', 1) + "/gateway",
+            'shards': self.shard_count,
+            'session_start_limit': {'total': 1000, 'remaining': 1000, 'reset_after': 0, 'max_concurrency': self.max_concurrency},
+        })
+
+    async def get_commands(self, request):
+        return json_response(list(self.commands.values()))
+
+    async def put_commands(self, request):
+        for command in await request_payload(request):
+            registered = self.commands.get(command['name'])
+            command.update(id=registered['id'] if registered else self.next_id(), application_id=APPLICATION_ID, version='1')
+            command.setdefault('type', 1)
+            self.commands[command['name']] = command
+        return json_response(list(self.commands.values()))
+
+    async def interaction_callback(self, request):
+        future = self.pending.get(request.match_info['interaction_id'])
+        if future is not None and not future.done():
+            future.set_result(await request_payload(request))
+        return web.Response(status=204)
+
+    async def original_message(self, request):
+        body = await request_payload(request)
+        return json_response({
+            'id': self.next_id(), 'channel_id': self.next_id(), 'type': 0, 'author': BOT_USER,
+            'content': body.get('content') or "", 'embeds': body.get('embeds') or [], 'components': body.get('components') or [],
+            'attachments': [], 'mentions': [], 'mention_roles': [], 'pinned': False, 'mention_everyone': False, 'tts': False,
+            'timestamp': "2024-01-01T00:00:00+00:00", 'edited_timestamp': None, 'flags': 0,
+        })
+
+    # Gateway
+
+    async def send(self, shard_id: int, event: str, data: dict):
+        await self.shards[shard_id].send_json({'op': 0, 's': next(self.sequences[shard_id]), 't': event, 'd': data})
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_json({'op': 10, 'd': {'heartbeat_interval': 41250}})
+        shard_id = None
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                break
+            payload = json.loads(message.data)
+            if payload['op'] == 1:
+                await ws.send_json({'op': 11})
+            elif payload['op'] == 2:
+                shard_id, shard_count = payload['d'].get('shard', [0, 1])
+                self.identifies.append((time.time(), shard_id, shard_count))
+                self.shards[shard_id] = ws
+                self.sequences[shard_id] = itertools.count(1)
+                await self.identified(shard_id, shard_count)
+        if shard_id is not None and self.shards.get(shard_id) is ws:
+            del self.shards[shard_id]
+        return ws
+
+    async def identified(self, shard_id: int, shard_count: int):
+        guilds = [guild for guild in self.guild_ids if shard_for(guild, shard_count) == shard_id]
+        await self.send(shard_id, 'READY', {
+            'v': 10, 'user': BOT_USER, 'session_id': f"session-{shard_id}", 'resume_gateway_url': self.url,
+            'shard': [shard_id, shard_count], 'application': {'id': APPLICATION_ID, 'flags': 0},
+            'guilds': [{'id': str(guild), 'unavailable': True} for guild in guilds],
+        })
+        for guild in guilds:
+            await self.send(shard_id, 'GUILD_CREATE', {
+                'id': str(guild), 'name': f"guild {guild}", 'owner_id': BOT_USER['id'], 'member_count': 2,
+                'channels': [], 'roles': [], 'emojis': [], 'stickers': [], 'members': [], 'threads': [],
+                'features': [], 'large': False, 'unavailable': False,
+            })
+
+    async def interact(self, guild: int, user: int, command: str, options: Optional[list] = None, timeout: float = 30.0) -> Optional[dict]:
+        """Sends a slash command on the guild's shard, as Discord would, and waits for the bot's answer."""
+        shard_id = shard_for(guild, self.shard_count)
+        interaction_id = self.next_id()
+        future = self.pending[interaction_id] = asyncio.get_running_loop().create_future()
+        await self.send(shard_id, 'INTERACTION_CREATE', {
+            'id': interaction_id, 'application_id': APPLICATION_ID, 'type': 2, 'token': f"token-{interaction_id}", 'version': 1,
+            'guild_id': str(guild), 'channel_id': str(guild), 'locale': 'en-US', 'guild_locale': 'en-US',
+            'member': {'user': {'id': str(user), 'username': f"user{user}", 'discriminator': '0000', 'avatar': None},
+                       'roles': [], 'joined_at': "2024-01-01T00:00:00+00:00", 'deaf': False, 'mute': False, 'permissions': '0'},
+            'data': {'id': self.commands[command]['id'], 'name': command, 'type': 1, 'options': options or []},
+        })
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            del self.pending[interaction_id]
+
+
+def guild_files(database: str, storage_shards: int) -> List[str]:
+    """The files holding the per-guild tables: the database itself, or its shard files."""
+    from utils.connection import shard_path
+    return [shard_path(database, shard, storage_shards) for shard in range(storage_shards)] if storage_shards else [database]
+
+
+def registered_guilds(files: List[str]) -> set:
+    guilds = set()
+    for file in files:
+        connection = sqlite3.connect(file)
+        try:
+            guilds |= {row[0] for row in connection.execute("SELECT serverID FROM Server")}
+        except sqlite3.Error:
+            pass
+        finally:
+            connection.close()
+    return guilds
+
+
+def saved_windows(files: List[str]) -> set:
+    windows = set()
+    for file in files:
+        connection = sqlite3.connect(file)
+        try:
+            windows |= {tuple(row) for row in connection.execute("SELECT userID, serverID FROM UserRequests")}
+        finally:
+            connection.close()
+    return windows
+
+
+async def fetch_metrics(port: int) -> str:
+    """The Prometheus text a worker serves on its metrics port (see utils.metrics.serve_metrics)."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    return response.split(b"\r\n\r\n", 1)[-1].decode('utf-8')
+
+
+def responses_timed(metrics: str, command: str) -> int:
+    """How many replies of a command a worker timed."""
+    prefix = f'hoardcraft_command_seconds_count{{command="/{command}",phase="respond"}} '
+    return sum(int(line[len(prefix):]) for line in metrics.splitlines() if line.startswith(prefix))
+
+
+def identify_spacing_errors(identifies: List[Tuple[float, int, int]], max_concurrency: int) -> List[str]:
+    errors = []
+    buckets: Dict[int, List[float]] = {}
+    for moment, shard_id, _ in identifies:
+        buckets.setdefault(shard_id % max_concurrency, []).append(moment)
+    for bucket, moments in buckets.items():
+        moments.sort()
+        for earlier, later in zip(moments, moments[1:]):
+            # A little slack for the clocks of the processes and the network hop.
+            if later - earlier < IDENTIFY_INTERVAL - 0.25:
+                errors.append(f"bucket {bucket}: two IDENTIFYs {later - earlier:.2f}s apart")
+    return errors
+
+
+async def run(args) -> int:
+    from tools.benchmark import populate
+    from tools.reshard import reshard
+
+    guild_ids = [guild_id(i) for i in range(args.guilds)]
+    members = {guild: member_id(i) for i, guild in enumerate(guild_ids)}
+    discord = MockDiscord(guild_ids, args.shards, args.max_concurrency)
+    url = await discord.start(args.port)
+
+    if args.serve:
+        print(f"Fake Discord on {url}; run: python main.py --api-base {url} --shards {args.shards} --workers N")
+        await asyncio.Event().wait()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'bot.sqlite')
+        credentials = os.path.join(directory, 'credentials.json')
+        populate(database, 0, 0, 0, seed=1)  # the catalog only; the bot registers the guilds itself
+        if args.storage_shards:
+            reshard(database, args.storage_shards, verbose=False)
+        files = guild_files(database, args.storage_shards)
+        with open(credentials, 'w') as file:
+            json.dump({'token': 'mock-token', 'metrics_port': args.metrics_port}, file)
+
+        started = time.perf_counter()
+        launcher = subprocess.Popen([sys.executable, 'main.py', '--credentials', credentials, '--database', database,
+                                     '--workers', str(args.workers), '--shards', str(args.shards), '--api-base', url],
+                                    cwd=ROOT, stdout=None if args.verbose else subprocess.DEVNULL)
+        failures = []
+        try:
+            deadline = time.monotonic() + args.timeout
+            while registered_guilds(files) < set(guild_ids) or len(discord.commands) == 0:
+                if launcher.poll() is not None:
+                    failures.append(f"the launcher exited with code {launcher.returncode}")
+                    break
+                if time.monotonic() > deadline:
+                    missing = len(set(guild_ids) - registered_guilds(files))
+                    failures.append(f"{missing} guilds still unregistered after {args.timeout:.0f}s")
+                    break
+                await asyncio.sleep(0.25)
+            ready = time.perf_counter() - started
+            print(f"{len(discord.identifies)} IDENTIFYs, {len(registered_guilds(files) & set(guild_ids))}/{len(guild_ids)} "
+                  f"guilds registered in {ready:.1f}s")
+
+            if not failures:
+                started = time.perf_counter()
+                commands = [(guild, command) for guild in guild_ids for command in ('random', 'checkdust')]
+                answers = await asyncio.gather(*(discord.interact(guild, members[guild], command) for guild, command in commands))
+                unanswered = [(guild, command) for (guild, command), answer in zip(commands, answers) if answer is None]
+                print(f"{len(commands) - len(unanswered)}/{len(commands)} commands answered in {time.perf_counter() - started:.1f}s")
+                if unanswered:
+                    failures.append(f"{len(unanswered)} commands unanswered, e.g. /{unanswered[0][1]} in guild {unanswered[0][0]} "
+                                    f"(shard {shard_for(unanswered[0][0], args.shards)})")
+                errors = [answer['data'].get('content') for answer in answers
+                          if answer and (answer.get('data') or {}).get('content', "").startswith("An error occurred")]
+                if errors:
+                    failures.append(f"{len(errors)} commands failed, e.g. {errors[0]}")
+
+                pages = await asyncio.gather(*(fetch_metrics(args.metrics_port + worker) for worker in range(args.workers)))
+                for command in ('random', 'checkdust'):
+                    timed = sum(responses_timed(page, command) for page in pages)
+                    if timed < len(guild_ids):
+                        failures.append(f"{timed} replies to /{command} timed, expected {len(guild_ids)}")
+            # py-cord fetches the message of every answer that has buttons right after sending it.
+            await asyncio.sleep(1)
+        finally:
+            launcher.send_signal(signal.SIGTERM)
+            try:
+                launcher.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                launcher.kill()
+                failures.append("the launcher did not stop within 60s of SIGTERM")
+            await discord.close()
+
+        shards = sorted(shard_id for _, shard_id, _ in discord.identifies)
+        if shards != list(range(args.shards)):
+            failures.append(f"shards identified: {shards}, expected each of 0-{args.shards - 1} once")
+        if any(count != args.shards for _, _, count in discord.identifies):
+            failures.append("a shard identified with the wrong shard count")
+        failures += identify_spacing_errors(discord.identifies, args.max_concurrency)
+        if not failures:
+            expected = {(members[guild], guild) for guild in guild_ids}
+            saved = saved_windows(files)
+            if saved != expected:
+                failures.append(f"{len(expected - saved)} rate-limit windows lost and {len(saved - expected)} unexpected after shutdown")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print("PASS" if not failures else f"{len(failures)} checks failed.")
+    return 1 if failures else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--guilds', type=int, default=200)
+    parser.add_argument('--storage-shards', type=int, default=0, help="shard files for the per-guild tables (default: none)")
+    parser.add_argument('--max-concurrency', type=int, default=2, help="shards Discord lets identify at once")
+    parser.add_argument('--timeout', type=float, default=120.0, help="seconds to wait for every guild to be registered")
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--metrics-port', type=int, default=19100, help="metrics port of the first worker; the others follow it")
+    parser.add_argument('--serve', action='store_true', help="only run the fake Discord")
+    parser.add_argument('--verbose', action='store_true', help="show the bot's output")
+    args = parser.parse_args(argv)
+    return asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
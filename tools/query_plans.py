@@ -0,0 +1,202 @@
+"""
+Query-plan check of every SQL statement in the data layer.
+
+Collects the statements in database/*.py (string literals passed to execute() and the
+module-level SQL_* constants), runs EXPLAIN QUERY PLAN on each against the real schema
+filled with the benchmark's synthetic data, and compares the plans with the curated ones
+in tools/query_plans.json. It fails when
+
+  * a hot statement scans one of the large tables or sorts through a temp B-tree,
+  * a plan differs from the expected one, or
+  * a statement has no expected plan yet.
+
+    python -m tools.query_plans                     # check
+    python -m tools.query_plans --verbose           # also print every plan
+    python -m tools.query_plans --update            # record the current plans as the expected ones
+"""
+import argparse
+import ast
+import importlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+DATABASE_PACKAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'database')
+EXPECTED_PATH = os.path.join(os.path.dirname(__file__), 'query_plans.json')
+
+# Schema and migrations are DDL run once at startup, not queries.
+SKIPPED_MODULES = ('migrations.py', 'init_db.py')
+
+SQL_KEYWORDS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+
+# Tables that grow with the number of guilds and users. Card and Collection hold the catalog only.
+LARGE_TABLES = ('Server', 'User', 'UserRequests', 'UserCard', 'UserCardBits', 'DustBalance', 'Shop', 'GuildDropRate',
+                'DustLedger', 'DustLedgerSummary')
+
+TABLE_ALIAS = re.compile(r"\b(?:FROM|JOIN|INTO|UPDATE)\s+(\w+)(?:\s+(?:AS\s+)?(?!ON\b|WHERE\b|JOIN\b|ORDER\b|GROUP\b|LIMIT\b|SET\b|VALUES\b|LEFT\b|INNER\b|USING\b|\()(\w+))?",
+                         re.IGNORECASE)
+SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+TEMP_BTREE = re.compile(r"^USE TEMP B-TREE")
+
+
+def normalize(sql: str) -> str:
+    """One line, no trailing semicolon: the form statements are keyed by in the expected plans."""
+    return re.sub(r"\s+", " ", sql).strip().rstrip(';').strip()
+
+
+def is_sql(value) -> bool:
+    return isinstance(value, str) and value.lstrip().upper().startswith(SQL_KEYWORDS) and '{' not in value
+
+
+def collect_statements() -> Dict[str, List[str]]:
+    """
+    Every statement in the data layer, mapped to where it is used ("module.function" or "module.CONSTANT").
+
+    Statements passed to execute() through a variable are found through the SQL_* constant they come from.
+    """
+    statements: Dict[str, List[str]] = {}
+
+    def add(sql: str, where: str):
+        places = statements.setdefault(normalize(sql), [])
+        if where not in places:
+            places.append(where)
+
+    for filename in sorted(os.listdir(DATABASE_PACKAGE)):
+        if not filename.endswith('.py') or filename in SKIPPED_MODULES:
+            continue
+        module_name = f"database.{filename[:-3]}"
+        with open(os.path.join(DATABASE_PACKAGE, filename)) as file:
+            tree = ast.parse(file.read(), filename)
+
+        for function in ast.walk(tree):
+            if not isinstance(function, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                continue
+            for node in ast.walk(function):
+                if isinstance(node, ast.Call) and getattr(node.func, 'attr', None) in ('execute', 'executemany') and node.args:
+                    if isinstance(node.args[0], ast.Constant) and is_sql(node.args[0].value):
+                        add(node.args[0].value, f"{module_name}.{function.name}")
+
+        # Constants, including the ones built with str.format(), are read from the imported module.
+        module = importlib.import_module(module_name)
+        for name, value in vars(module).items():
+            if name.startswith('SQL_') and is_sql(value):
+                add(value, f"{module_name}.{name}")
+    return statements
+
+
+def placeholders(sql: str) -> int:
+    """The number of ? parameters, not counting any inside string literals."""
+    return re.sub(r"'[^']*'", "''", sql).count('?')
+
+
+def explain(cursor, sql: str) -> List[str]:
+    cursor.execute(f"EXPLAIN QUERY PLAN {sql}", (None,) * placeholders(sql))
+    return [row[3] for row in cursor.fetchall()]
+
+
+def problems(sql: str, plan: List[str], allowed: List[str]) -> List[str]:
+    """The steps of a hot statement's plan that do not scale: full scans of large tables and temp B-tree sorts."""
+    aliases = {}
+    for table, alias in TABLE_ALIAS.findall(sql):
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    found = []
+    for step in plan:
+        if step in allowed:
+            continue
+        scan = SCAN.match(step)
+        if scan and aliases.get(scan.group(1), scan.group(1)) in LARGE_TABLES:
+            found.append(step)
+        elif TEMP_BTREE.match(step):
+            found.append(step)
+    return found
+
+
+def build_database(path: str, guilds: int, users: int, cards_per_user: int):
+    """Fills a database with the benchmark's synthetic data, so the planner sees realistic ANALYZE statistics."""
+    from tools.benchmark import populate
+    populate(path, guilds, users, cards_per_user, seed=1)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', help="plan against this database instead of a freshly built synthetic one")
+    parser.add_argument('--guilds', type=int, default=200)
+    parser.add_argument('--users', type=int, default=40, help="users per guild")
+    parser.add_argument('--cards-per-user', type=int, default=25, help="mean cards owned per user")
+    parser.add_argument('--expected', default=EXPECTED_PATH)
+    parser.add_argument('--update', action='store_true', help="write the current plans to the expected file")
+    parser.add_argument('--verbose', action='store_true', help="print every statement's plan")
+    args = parser.parse_args(argv)
+
+    from utils.connection import DatabaseConnection
+
+    statements = collect_statements()
+    expected: Dict[str, dict] = {}
+    if os.path.exists(args.expected):
+        with open(args.expected) as file:
+            expected = {entry['sql']: entry for entry in json.load(file)}
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.database
+        if path is None:
+            path = os.path.join(directory, 'plans.sqlite')
+            build_database(path, args.guilds, args.users, args.cards_per_user)
+        DatabaseConnection.configure(path)
+        plans: Dict[str, Tuple[Optional[List[str]], Optional[str]]] = {}
+        with DatabaseConnection.get_instance().reader() as cursor:
+            for sql in statements:
+                try:
+                    plans[sql] = (explain(cursor, sql), None)
+                except sqlite3.Error as e:
+                    plans[sql] = (None, str(e))
+        DatabaseConnection.close()
+
+    if args.update:
+        entries = []
+        for sql, places in statements.items():
+            plan, error = plans[sql]
+            # Keep the curated parts of an existing entry: whether it is hot, why not, and the steps allowed anyway.
+            entry = dict(expected.get(sql, {'hot': True}), sql=sql, used_in=places)
+            entry['plan'] = plan if plan is not None else [f"ERROR {error}"]
+            entries.append(entry)
+        with open(args.expected, 'w') as file:
+            json.dump(entries, file, indent=2)
+            file.write("\n")
+        print(f"Wrote {len(entries)} expected plans to {args.expected}.")
+        return 0
+
+    failures = 0
+    for sql, places in statements.items():
+        plan, error = plans[sql]
+        entry = expected.get(sql)
+        messages = []
+        if error is not None:
+            messages.append(f"cannot be planned: {error}")
+        elif entry is None:
+            messages.append("has no expected plan; review it and run --update")
+        else:
+            if entry['hot']:
+                messages += [f"does not scale: {step}" for step in problems(sql, plan, entry.get('allow', []))]
+            if plan != entry['plan']:
+                messages.append("plan changed from\n      " + "\n      ".join(entry['plan']))
+        if messages or args.verbose:
+            print(f"{'FAIL' if messages else 'ok'}   {', '.join(places)}\n  {sql}\n    " + "\n    ".join(plan or ["(no plan)"]))
+            for message in messages:
+                print(f"  -> {message}")
+        failures += bool(messages)
+
+    for sql in expected.keys() - statements.keys():
+        print(f"note: expected plan for a statement no longer in the code: {sql[:100]}")
+
+    print(f"{len(statements)} statements checked, {failures} failed.")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
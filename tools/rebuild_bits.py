@@ -0,0 +1,41 @@
+"""
+Rebuilds the ownership bitmaps (UserCardBits) from UserCard.
+
+The bot writes both tables together (see database.ownership.set_owned). Rows added to or
+removed from UserCard any other way, by hand in the sqlite3 shell or by restoring an old
+backup, leave the bitmaps behind; this recomputes every one of them, in the main database and
+in every shard file. Run it with the bot stopped, or restart the bot afterwards so it drops the
+bitmaps it has cached.
+
+    python -m tools.rebuild_bits
+    python -m tools.rebuild_bits --database other.sqlite
+"""
+import argparse
+import os
+import sys
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='database.sqlite', help="the main database")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.database):
+        parser.error(f"{args.database} does not exist")
+
+    from database.ownership import rebuild_bits
+    from utils.connection import DatabaseConnection
+
+    DatabaseConnection.configure(args.database)
+    try:
+        for db_connection in DatabaseConnection.guild_connections():
+            with db_connection.transaction() as cursor:
+                rebuilt = rebuild_bits(cursor)
+            print(f"{os.path.basename(db_connection.path)}: {rebuilt:,} bitmaps rebuilt")
+    finally:
+        DatabaseConnection.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
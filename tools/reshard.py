@@ -0,0 +1,290 @@
+"""
+Moves the per-guild tables between the main database and shard files.
+
+In sharded storage each guild's users, cards, dust, shop and cooldown rows live in shard file
+shard_for(guild_id, N) next to the main database, which keeps the catalog (see
+utils.connection). This tool sets N: it splits the main database into shards, spreads existing
+shards over a different number of files, or merges them back. Run it with the bot stopped.
+
+    python -m tools.reshard --shards 4              # database.sqlite -> database.shard{0..3}-of-4.sqlite
+    python -m tools.reshard --shards 8              # 4 shards -> 8
+    python -m tools.reshard --shards 0              # everything back into database.sqlite
+    python -m tools.reshard --status                # guilds, cards and size of every file
+
+Every new file is filled in one transaction and its row counts checked against the old layout
+before StorageLayout in the main database is switched over; that switch is the only point of
+no return. Interrupted before it, the old layout is still the live one and the next run starts
+over; after it, the next run finishes removing the old copies.
+"""
+import argparse
+import glob
+import os
+import re
+import sqlite3
+import sys
+import time
+from typing import Dict, List, Tuple
+
+CHUNK_SIZE = 10_000
+
+# Ledger ids are only unique within a file, so merged ledgers are renumbered in time order; every other table is copied as is.
+LEDGER_TABLE = 'DustLedger'
+LEDGER_COLUMNS = ('userID', 'serverID', 'delta', 'reason', 'createdAt')
+
+
+def remove_database(path: str):
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def shard_files(path: str) -> Dict[int, List[str]]:
+    """Every shard file next to the main database, by the shard count it was written for."""
+    stem, extension = os.path.splitext(path)
+    pattern = re.compile(re.escape(stem) + r"\.shard\d+-of-(\d+)" + re.escape(extension) + "$")
+    found = {}
+    for file in glob.glob(glob.escape(stem) + ".shard*-of-*" + extension):
+        match = pattern.match(file)
+        if match:
+            found.setdefault(int(match.group(1)), []).append(file)
+    return found
+
+
+def count_rows(connection: sqlite3.Connection, tables) -> Dict[str, int]:
+    return {table: connection.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0] for table in tables}
+
+
+def guild_triggers(connection: sqlite3.Connection) -> List[Tuple[str, str]]:
+    """The (name, CREATE statement) of every trigger on a per-guild table."""
+    from utils.connection import GUILD_TABLES
+
+    return connection.execute(f"""
+        SELECT name, sql FROM main.sqlite_master
+        WHERE type = 'trigger' AND tbl_name IN ({', '.join('?' * len(GUILD_TABLES))})
+        """, GUILD_TABLES).fetchall()
+
+
+class Target:
+    """A file of the new layout, filled inside one transaction."""
+
+    def __init__(self, path: str, connection: sqlite3.Connection, triggers: List[Tuple[str, str]]):
+        self.path = path
+        self.connection = connection
+        # Recreated once the rows are in, so they do not fire for every copied row.
+        self.triggers = triggers
+
+
+def open_target(path: str, shard_count: int, schema: List[Tuple[str, str, str]]) -> Target:
+    """Starts filling a shard file, or the main database itself when merging every shard back."""
+    if shard_count:
+        remove_database(path)
+    connection = sqlite3.connect(path, isolation_level=None)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("BEGIN IMMEDIATE")
+    if shard_count:
+        for kind, _, sql in schema:
+            if kind != 'trigger':
+                connection.execute(sql)
+        triggers = [(name, sql) for kind, name, sql in schema if kind == 'trigger']
+    else:
+        triggers = guild_triggers(connection)
+    for name, _ in triggers:
+        connection.execute(f"DROP TRIGGER IF EXISTS main.{name}")
+    connection.execute(f"CREATE TEMP TABLE ledger_merge AS SELECT {', '.join(LEDGER_COLUMNS)} FROM main.{LEDGER_TABLE} WHERE 0")
+    return Target(path, connection, triggers)
+
+
+def copy_source(source_path: str, targets: List[Target], shard_count: int) -> int:
+    """Streams every per-guild row of one file of the old layout to the target its guild belongs in."""
+    from utils.connection import GUILD_TABLES
+    from utils.sharding import shard_for
+
+    source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+    rows_copied = 0
+    try:
+        for table in GUILD_TABLES:
+            if table == LEDGER_TABLE:
+                names = LEDGER_COLUMNS
+                select = f"SELECT {', '.join(names)} FROM {table} ORDER BY id"
+                insert = f"INSERT INTO temp.ledger_merge VALUES ({', '.join('?' * len(names))})"
+            else:
+                names = [row[1] for row in source.execute(f"PRAGMA table_info({table})")]
+                select = f"SELECT {', '.join(names)} FROM {table}"
+                insert = f"INSERT INTO main.{table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+            server_column = list(names).index('serverID')
+            cursor = source.execute(select)
+            while True:
+                rows = cursor.fetchmany(CHUNK_SIZE)
+                if not rows:
+                    break
+                routed = {}
+                for row in rows:
+                    routed.setdefault(shard_for(row[server_column], shard_count) if shard_count else 0, []).append(row)
+                for index, batch in routed.items():
+                    targets[index].connection.executemany(insert, batch)
+                rows_copied += len(rows)
+    finally:
+        source.close()
+    return rows_copied
+
+
+def finish_target(target: Target) -> Dict[str, int]:
+    """Writes the merged ledger, puts the triggers back and returns the target's row counts; still uncommitted."""
+    from utils.connection import GUILD_TABLES
+
+    connection = target.connection
+    connection.execute(f"""
+    INSERT INTO main.{LEDGER_TABLE} ({', '.join(LEDGER_COLUMNS)})
+    SELECT {', '.join(LEDGER_COLUMNS)} FROM temp.ledger_merge ORDER BY createdAt, rowid
+    """)
+    connection.execute("DROP TABLE temp.ledger_merge")
+    for _, sql in target.triggers:
+        connection.execute(sql)
+    return count_rows(connection, GUILD_TABLES)
+
+
+def reshard(path: str, shard_count: int, verbose: bool = True) -> bool:
+    """
+    Moves the per-guild rows of the database at path into shard_count shard files, or into the main database for 0.
+
+    Returns:
+        bool: True once the new layout is live, False if the copy did not check out and nothing changed.
+    """
+    from database.migrations import guild_schema, run_migrations
+    from utils.connection import GUILD_TABLES, DatabaseConnection, shard_path
+
+    def say(message):
+        if verbose:
+            print(message, flush=True)
+
+    DatabaseConnection.configure(path)
+    run_migrations()
+    old_count = DatabaseConnection.shard_count()
+    schema = guild_schema(DatabaseConnection.get_instance())
+    DatabaseConnection.close()
+
+    finish(path, old_count, say)
+    if old_count == shard_count:
+        say(f"{path} already has {shard_count or 'no'} shards.")
+        return True
+
+    started = time.perf_counter()
+    sources = [shard_path(path, shard, old_count) for shard in range(old_count)] if old_count else [path]
+    expected = dict.fromkeys(GUILD_TABLES, 0)
+    for source_path in sources:
+        source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+        for table, rows in count_rows(source, GUILD_TABLES).items():
+            expected[table] += rows
+        source.close()
+
+    target_paths = [shard_path(path, shard, shard_count) for shard in range(shard_count)] if shard_count else [path]
+    targets = []
+    try:
+        for target_path in target_paths:
+            targets.append(open_target(target_path, shard_count, schema))
+        for source_path in sources:
+            rows = copy_source(source_path, targets, shard_count)
+            say(f"  copied {rows:,} rows from {os.path.basename(source_path)}")
+
+        copied = dict.fromkeys(GUILD_TABLES, 0)
+        for target in targets:
+            for table, rows in finish_target(target).items():
+                copied[table] += rows
+        mismatches = {table: (expected[table], copied[table]) for table in GUILD_TABLES if expected[table] != copied[table]}
+        if mismatches:
+            raise sqlite3.DatabaseError(f"row counts do not match (expected, copied): {mismatches}")
+
+        if not shard_count:
+            # Merging back: the rows and the switch to the new layout commit together.
+            targets[0].connection.execute("UPDATE StorageLayout SET shardCount = 0")
+        for target in targets:
+            target.connection.execute("COMMIT")
+    except sqlite3.Error as e:
+        print(f"An error occurred: {e}; the {old_count or 'unsharded'} layout stays live.")
+        for target in targets:
+            if target.connection.in_transaction:
+                target.connection.execute("ROLLBACK")
+            target.connection.close()
+        if shard_count:
+            for target_path in target_paths:
+                remove_database(target_path)
+        return False
+
+    for target in targets:
+        target.connection.execute("ANALYZE main")
+        target.connection.close()
+    if shard_count:
+        with sqlite3.connect(path) as main:
+            main.execute("UPDATE StorageLayout SET shardCount = ?", (shard_count,))
+        main.close()
+
+    say(f"{path} now has {shard_count or 'no'} shards ({time.perf_counter() - started:.1f}s).")
+    finish(path, shard_count, say)
+    return True
+
+
+def finish(path: str, shard_count: int, say):
+    """Removes what layouts other than the live one left behind: their shard files and, once sharded, the main database's copy of the rows."""
+    from utils.connection import GUILD_TABLES
+
+    for count, files in shard_files(path).items():
+        if count != shard_count:
+            for file in files:
+                remove_database(file)
+            say(f"Removed the {len(files)} files of the {count}-shard layout.")
+
+    if not shard_count:
+        return
+    main = sqlite3.connect(path, isolation_level=None)
+    try:
+        if any(count_rows(main, GUILD_TABLES).values()):
+            main.execute("BEGIN IMMEDIATE")
+            # Triggers on the per-guild tables would fire for every deleted row.
+            triggers = guild_triggers(main)
+            for name, _ in triggers:
+                main.execute(f"DROP TRIGGER {name}")
+            for table in GUILD_TABLES:
+                main.execute(f"DELETE FROM {table}")
+            for _, sql in triggers:
+                main.execute(sql)
+            main.execute("COMMIT")
+            main.execute("VACUUM")
+            say(f"Removed the per-guild rows from {path}.")
+    finally:
+        main.close()
+
+
+def status(path: str):
+    from utils.connection import DatabaseConnection
+
+    DatabaseConnection.configure(path)
+    print(f"{path}: {DatabaseConnection.shard_count() or 'no'} shards")
+    print(f"{'file':<40}{'guilds':>9}{'UserCard':>12}{'MB':>8}")
+    for db_connection in DatabaseConnection.guild_connections():
+        with db_connection.reader() as cursor:
+            guilds = cursor.execute("SELECT COUNT(*) FROM main.Server").fetchone()[0]
+            cards = cursor.execute("SELECT COUNT(*) FROM main.UserCard").fetchone()[0]
+        size = sum(os.path.getsize(db_connection.path + suffix) for suffix in ('', '-wal') if os.path.exists(db_connection.path + suffix))
+        print(f"{os.path.basename(db_connection.path):<40}{guilds:>9,}{cards:>12,}{size / 2 ** 20:>8.1f}")
+    DatabaseConnection.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='database.sqlite', help="the main database")
+    parser.add_argument('--shards', type=int, help="the new shard count; 0 keeps everything in the main database")
+    parser.add_argument('--status', action='store_true', help="only show how the rows are spread")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.database):
+        parser.error(f"{args.database} does not exist")
+    if args.status or args.shards is None:
+        status(args.database)
+        return 0
+    if args.shards < 0:
+        parser.error("--shards must be 0 or more")
+    return 0 if reshard(args.database, args.shards) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
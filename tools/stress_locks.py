@@ -0,0 +1,239 @@
+"""
+Stress test of the per-user locks (utils.locks): thousands of clicks on the same buttons at once.
+
+Builds a small database, then fires every click below at the same moment, for every test user,
+through the real component router and view handlers (see tools.fakes):
+
+  * --clicks presses of Claim on one ClaimView,
+  * --clicks presses of Claim all on one three-card PullView,
+  * --clicks presses of Craft on the first card of the shop, with dust for exactly one craft,
+  * --clicks presses of Confirm on the un-claim prompt of a card the user owns.
+
+Afterwards it checks that each action succeeded exactly once, that every user's cards and dust
+in the database are what one run of each action gives, that the ownership and balance caches
+and the guild statistics agree with the database, and that no lock is left behind.
+
+    python -m tools.stress_locks                        # 10 users, 250 clicks per button
+    python -m tools.stress_locks --users 20 --clicks 1000
+"""
+import argparse
+import asyncio
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+
+class Target:
+    """One test user, the cards their buttons act on and what the database should hold afterwards."""
+
+    def __init__(self, user_id: int, server_id: int):
+        self.user_id = user_id
+        self.server_id = server_id
+        self.claim_card = None
+        self.pull_cards: List[int] = []
+        self.craft_card = None
+        self.craft_cost = 0
+        self.removed_card = None
+        self.balance = 0
+        self.owned = set()
+        self.interactions: Dict[str, list] = {}
+
+
+def prepare(targets: List[Target], seed: int):
+    """Picks each user's cards and sets their ownership and balance up in the database, before any state is loaded."""
+    from database.catalog import CardCatalog
+    from database.ownership import rebuild_bits
+    from database.shop import craft_cost, get_shop_inventory
+    from utils.connection import DatabaseConnection
+
+    rng = random.Random(seed)
+    card_ids = [card.id for card in CardCatalog.get_instance().cards]
+    for target in targets:
+        db_connection = DatabaseConnection.for_guild(target.server_id)
+        shop_card = get_shop_inventory(target.server_id)[0]
+        target.craft_card, target.craft_cost = shop_card.id, craft_cost(shop_card.rarity)
+        others = rng.sample([card_id for card_id in card_ids if card_id != target.craft_card], 5)
+        target.claim_card, target.pull_cards, target.removed_card = others[0], others[1:4], others[4]
+        # Enough for one craft, not two.
+        target.balance = target.craft_cost + target.craft_cost // 2
+
+        with db_connection.transaction() as cursor:
+            cursor.executemany("DELETE FROM UserCard WHERE userID = ? AND serverID = ? AND cardID = ?",
+                               [(target.user_id, target.server_id, card_id) for card_id in [target.craft_card] + others[:4]])
+            cursor.execute("INSERT OR IGNORE INTO UserCard (userID, serverID, cardID) VALUES (?, ?, ?)",
+                           (target.user_id, target.server_id, target.removed_card))
+            cursor.execute("""
+            INSERT INTO DustBalance (userID, serverID, balance) VALUES (?, ?, ?)
+            ON CONFLICT(userID, serverID) DO UPDATE SET balance = excluded.balance
+            """, (target.user_id, target.server_id, target.balance))
+            rebuild_bits(cursor, [(target.user_id, target.server_id)])
+            cursor.execute("SELECT cardID FROM UserCard WHERE userID = ? AND serverID = ?", (target.user_id, target.server_id))
+            owned = {row[0] for row in cursor.fetchall()}
+
+        # What one successful run of every action leaves.
+        target.owned = (owned - {target.removed_card}) | {target.claim_card, target.craft_card, *target.pull_cards}
+        target.balance -= target.craft_cost
+
+
+def custom_ids(target: Target) -> Dict[str, str]:
+    from utils.components import component_id
+    from utils.views import ClaimView, PullView
+
+    pull = PullView(target.pull_cards, 'nnn', target.user_id)
+    return {
+        'claim': ClaimView(target.claim_card, target.user_id).children[0].custom_id,
+        'claim_all': next(item.custom_id for item in pull.children if item.label == 'Claim all'),
+        'craft': component_id('shop.craft', target.user_id, 0, target.craft_card),
+        'unclaim': component_id('list.unclaim', target.user_id, 0, len(target.owned), target.removed_card, 0),
+    }
+
+
+async def click_all(targets: List[Target], clicks: int, seed: int) -> float:
+    """Presses every button clicks times, all clicks of all users concurrently, and returns the wall time."""
+    from tools.fakes import FakeGuild, FakeInteraction, FakeUser
+    from utils.components import handle_component
+
+    presses = []
+    for target in targets:
+        user, guild = FakeUser(target.user_id), FakeGuild(target.server_id)
+        for action, custom_id in custom_ids(target).items():
+            interactions = target.interactions[action] = []
+            for _ in range(clicks):
+                interaction = FakeInteraction(user, guild, {'custom_id': custom_id, 'component_type': 2})
+                interactions.append(interaction)
+                presses.append(interaction)
+    random.Random(seed).shuffle(presses)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handle_component(interaction) for interaction in presses))
+    return time.perf_counter() - started
+
+
+def replies(interactions) -> List[str]:
+    return [reply.content or "" for interaction in interactions for reply in interaction.replies]
+
+
+def check(targets: List[Target]) -> List[str]:
+    """Every way the database, the caches, the statistics or the replies differ from one run of each action."""
+    from database.catalog import CardCatalog
+    from database.dust import cached_dust_balance
+    from database.ownership import OwnershipStore, load_bits
+    from database.stats import GuildStats
+    from utils.connection import DatabaseConnection
+    from utils.locks import user_locks
+
+    catalog = CardCatalog.get_instance()
+    stats = GuildStats.get_instance()
+    errors = []
+    for target in targets:
+        who = f"user {target.user_id}"
+        with DatabaseConnection.for_guild(target.server_id).reader() as cursor:
+            cursor.execute("SELECT cardID FROM UserCard WHERE userID = ? AND serverID = ?", (target.user_id, target.server_id))
+            owned = {row[0] for row in cursor.fetchall()}
+            cursor.execute("SELECT balance FROM DustBalance WHERE userID = ? AND serverID = ?", (target.user_id, target.server_id))
+            balance = cursor.fetchone()[0]
+        bits = catalog.bits_of(owned)
+
+        if owned != target.owned:
+            errors.append(f"{who} owns {sorted(owned ^ target.owned)} unexpectedly (or lacks them)")
+        if balance != target.balance:
+            errors.append(f"{who} has {balance} dust, expected {target.balance}")
+        if load_bits(target.user_id, target.server_id) != bits:
+            errors.append(f"{who}: UserCardBits does not match UserCard")
+        cached = OwnershipStore.get_instance().cached_bits(target.user_id, target.server_id)
+        if cached is not None and cached != bits:
+            errors.append(f"{who}: the cached ownership bitmap does not match the database")
+        cached = cached_dust_balance(target.user_id, target.server_id)
+        if cached is not None and cached != balance:
+            errors.append(f"{who}: the cached balance {cached} does not match the database ({balance})")
+        scores = {int(user): score for user, score in stats.leaderboard(target.server_id, 'cards')}
+        if scores.get(target.user_id) != len(owned):
+            errors.append(f"{who}: the cards leaderboard counts {scores.get(target.user_id)}, the database {len(owned)}")
+        scores = {int(user): score for user, score in stats.leaderboard(target.server_id, 'dust')}
+        if scores.get(target.user_id, 0) != balance:
+            errors.append(f"{who}: the dust leaderboard counts {scores.get(target.user_id, 0)}, the database {balance}")
+
+        successes = {
+            'claim': sum(text == "Card claimed!" for text in replies(target.interactions['claim'])),
+            'craft': sum(text.startswith("You have crafted") for text in replies(target.interactions['craft'])),
+            'unclaim': sum("un-claimed successfully" in text for text in replies(target.interactions['unclaim'])),
+        }
+        for action, count in successes.items():
+            if count != 1:
+                errors.append(f"{who}: {action} succeeded {count} times")
+        names = [name for text in replies(target.interactions['claim_all']) if text.startswith("Claimed ")
+                 for name in text[len("Claimed "):-1].split(", ")]
+        if sorted(names) != sorted(catalog.get(card_id).name for card_id in target.pull_cards):
+            errors.append(f"{who}: Claim all reported {names}")
+
+    gc.collect()
+    if len(user_locks):
+        errors.append(f"{len(user_locks)} locks left after every click was answered")
+    return errors
+
+
+async def run(args) -> int:
+    from database.batch import WriteBatcher
+    from database.catalog import CardCatalog
+    from database.shop import load_shop_overrides
+    from database.stats import GuildStats
+    from tools.benchmark import guild_id, user_id
+    from utils.cache import RateLimiter
+
+    guilds = -(-args.users // args.users_per_guild)
+    targets = [Target(user_id(index % guilds, index // guilds, args.users_per_guild), guild_id(index % guilds))
+               for index in range(args.users)]
+    CardCatalog.get_instance()
+    prepare(targets, args.seed)
+    load_shop_overrides()
+    RateLimiter.get_instance()
+    GuildStats.get_instance()
+
+    try:
+        wall = await click_all(targets, args.clicks, args.seed)
+    finally:
+        await WriteBatcher.close_all()
+    total = args.users * 4 * args.clicks
+    print(f"{total:,} clicks by {args.users} users answered in {wall:.1f}s ({total / wall:,.0f}/s)")
+
+    errors = check(targets)
+    for error in errors:
+        print(f"INCONSISTENT {error}")
+    print("FAIL" if errors else "PASS")
+    return 1 if errors else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10, help="users clicking at once")
+    parser.add_argument('--users-per-guild', type=int, default=5, help="at most 10, so every user shows on the leaderboards")
+    parser.add_argument('--clicks', type=int, default=250, help="presses of each button by each user")
+    parser.add_argument('--shards', type=int, default=0, help="split the per-guild tables into this many shard files (see tools.reshard)")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    from tools.benchmark import populate
+    from utils.connection import DatabaseConnection
+    from utils.executor import DatabaseExecutor
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'stress.sqlite')
+        guilds = -(-args.users // args.users_per_guild)
+        populate(path, guilds, args.users_per_guild, 20, args.seed)
+        if args.shards:
+            from tools.reshard import reshard
+            reshard(path, args.shards, verbose=False)
+        DatabaseConnection.configure(path)
+        try:
+            return asyncio.run(run(args))
+        finally:
+            DatabaseExecutor.shutdown()
+            DatabaseConnection.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
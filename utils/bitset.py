@@ -0,0 +1,33 @@
+"""
+Card ownership as bitmaps.
+
+Bit n of a bitmap is set when the card with ordinal n is owned. Ordinals are dense, numbered
+from 0 in the order cards were added to the catalog (Card.ordinal, see CardCatalog), so a
+bitmap stays as short as the catalog however the card ids grow. Bitmaps are Python ints in
+memory and little-endian BLOBs in the UserCardBits table; with a few hundred cards a user's
+whole collection fits in a few dozen bytes.
+"""
+from typing import Iterable, Iterator, Optional
+
+
+def from_blob(blob: Optional[bytes]) -> int:
+    return int.from_bytes(blob, 'little') if blob else 0
+
+
+def to_blob(bits: int) -> bytes:
+    return bits.to_bytes((bits.bit_length() + 7) // 8 or 1, 'little')
+
+
+def from_ordinals(ordinals: Iterable[int]) -> int:
+    bits = 0
+    for ordinal in ordinals:
+        bits |= 1 << ordinal
+    return bits
+
+
+def iter_ordinals(bits: int) -> Iterator[int]:
+    """The ordinals set in a bitmap, in ascending order."""
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
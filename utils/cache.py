@@ -1,12 +1,129 @@
 import datetime
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Hashable, Optional, Tuple
+from utils.connection import DatabaseConnection
+from utils.sharding import ShardAssignment
 
-class CooldownCache:
+REQUEST_LIMIT = 5
+REQUEST_WINDOW = 3600  # seconds
+
+# Every LRUCache by name, for utils.metrics and /debugstats.
+CACHES: Dict[str, 'LRUCache'] = {}
+
+
+class LRUCache:
+    """
+    A map bounded to max_size entries, least recently used evicted first, each entry expiring
+    ttl seconds after it was stored.
+
+    Values are kept current by the writers, not by the TTL: a data-layer write that changes a
+    cached value calls put() or invalidate() from an on_commit callback. The TTL only bounds how
+    long a change made outside this process (another tool, a manual fix) can go unnoticed.
+
+    A value read from the database may already be stale by the time it is stored, if a write to
+    it committed in between. Callers read generation before going to the database and pass it
+    to fill(), which drops the value if its key was written through the cache since. The last
+    write of up to max_size keys is remembered; a fill older than the writes forgotten to stay
+    within that bound is dropped as well, which only costs a later read.
+
+    hits counts the lookups answered from memory and misses the values that had to be read from
+    the database, i.e. the calls of fill(); a lookup that misses and is retried on a reader
+    thread is only counted once.
+    """
+
+    def __init__(self, name: str, max_size: int, ttl: Optional[float] = None):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, expiry time or None)
+        self.lock = threading.Lock()
+        self.generation = 0  # counts the writes; callers pass the value they read to fill()
+        self.written = OrderedDict()  # key -> generation of its last write, oldest first
+        self.forgotten = 0  # the generation of the newest write dropped from written
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        CACHES[name] = self
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Hashable, now: Optional[float] = None):
+        """The cached value, or None on a miss."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > (time.monotonic() if now is None else now):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+            return None
+
+    def _store(self, key: Hashable, value):
+        self.entries[key] = (value, time.monotonic() + self.ttl if self.ttl is not None else None)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def _written(self, key: Hashable):
+        self.generation += 1
+        self.written[key] = self.generation
+        self.written.move_to_end(key)
+        while len(self.written) > self.max_size:
+            self.forgotten = self.written.popitem(last=False)[1]
+
+    def fill(self, key: Hashable, value, generation: int) -> bool:
+        """Stores a value read from the database, unless a write to its key went through the cache since generation was read."""
+        with self.lock:
+            self.misses += 1
+            if generation < self.forgotten or self.written.get(key, 0) > generation:
+                return False
+            self._store(key, value)
+            return True
+
+    def put(self, key: Hashable, value):
+        """Stores a value as just committed."""
+        with self.lock:
+            self._written(key)
+            self._store(key, value)
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """Drops one entry, or every entry when called without a key."""
+        with self.lock:
+            if key is None:
+                self.generation += 1
+                self.written.clear()
+                self.forgotten = self.generation
+                self.entries.clear()
+            else:
+                self._written(key)
+                self.entries.pop(key, None)
+
+
+class RateLimiter:
+    """
+    Sliding window of REQUEST_LIMIT requests per REQUEST_WINDOW for each (user, server).
+
+    Windows live in memory, ordered by last request, so anyone idle for a full window is
+    evicted from the front and the structure stays bounded by the users active in the last
+    hour. The UserRequests table is only touched by load() at startup and persist(), which runs
+    periodically and on shutdown.
+    """
     _instance = None
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
-            cls._instance.cooldowns = {}
+            cls._instance.windows = OrderedDict()
+            cls._instance.dirty = set()
+            cls._instance.lock = threading.Lock()
+            cls._instance.load()
         return cls._instance
 
     @classmethod
@@ -15,14 +132,129 @@ class CooldownCache:
             cls._instance = cls()
         return cls._instance
 
-    def set_cooldown(self, user_id, server_id, cooldown_end_time):
-        """Set a user's cooldown end time."""
-        self.cooldowns[(user_id, server_id)] = cooldown_end_time
-
-    def check_cooldown(self, user_id, server_id):
-        """Check if a user is on cooldown."""
-        current_time = datetime.datetime.now()
-        cooldown_end_time = self.cooldowns.get((user_id, server_id))
-        if cooldown_end_time and current_time < cooldown_end_time:
-            return True, cooldown_end_time  # User is on cooldown
-        return False, None  # User is not on cooldown or no cooldown set
+    @staticmethod
+    def _key(user_id, server_id) -> Tuple[int, int]:
+        return int(user_id), int(server_id)
+
+    def _evict_expired(self, now: float):
+        windows = self.windows
+        while windows:
+            key, window = next(iter(windows.items()))
+            if window and window[-1] + REQUEST_WINDOW > now:
+                break
+            del windows[key]
+            self.dirty.add(key)
+
+    def acquire(self, user_id, server_id, count: int = 1, now: Optional[float] = None) -> Tuple[bool, Optional[datetime.datetime]]:
+        """
+        Takes count request slots for a user if the window has room for all of them.
+
+        Returns:
+            Tuple[bool, Optional[datetime.datetime]]: Whether the request is allowed, and if not,
+            when enough slots will have freed up.
+        """
+        now = time.time() if now is None else now
+        key = self._key(user_id, server_id)
+
+        with self.lock:
+            self._evict_expired(now)
+            window = self.windows.get(key)
+            if window is None:
+                window = self.windows[key] = deque()
+            while window and window[0] + REQUEST_WINDOW <= now:
+                window.popleft()
+
+            if len(window) + count > REQUEST_LIMIT:
+                if count > REQUEST_LIMIT:
+                    return False, None
+                # The request fits once the oldest len + count - limit timestamps have expired.
+                frees_at = window[len(window) + count - REQUEST_LIMIT - 1] + REQUEST_WINDOW
+                return False, datetime.datetime.fromtimestamp(frees_at)
+
+            window.extend([now] * count)
+            self.windows.move_to_end(key)
+            self.dirty.add(key)
+            return True, None
+
+    def remaining(self, user_id, server_id, now: Optional[float] = None) -> int:
+        """The number of requests the user can still make right now."""
+        now = time.time() if now is None else now
+        with self.lock:
+            window = self.windows.get(self._key(user_id, server_id), ())
+            return REQUEST_LIMIT - sum(1 for stamp in window if stamp + REQUEST_WINDOW > now)
+
+    def reset(self, user_id, server_id):
+        key = self._key(user_id, server_id)
+        with self.lock:
+            self.windows.pop(key, None)
+            self.dirty.add(key)
+
+    def load(self):
+        """
+        Rebuilds the windows of the guilds this process serves from UserRequests. The windows of
+        other guilds belong to other worker processes, which persist() them.
+
+        The table only keeps the oldest request time and a count, so every restored request is
+        placed at the oldest time. That can only free slots early, never lock a user out longer.
+        """
+        now = time.time()
+        rows = []
+
+        try:
+            for db_connection in DatabaseConnection.guild_connections():
+                with db_connection.reader() as cursor:
+                    cursor.execute("SELECT userID, serverID, firstRequestTime, requestCount FROM UserRequests")
+                    rows += cursor.fetchall()
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            return
+
+        shards = ShardAssignment.get_instance()
+        windows = []
+        for user_id, server_id, first_request_time, request_count in rows:
+            if not shards.owns(server_id):
+                continue
+            try:
+                stamp = datetime.datetime.fromisoformat(first_request_time).timestamp()
+            except (TypeError, ValueError):
+                continue
+            if stamp + REQUEST_WINDOW > now and request_count:
+                windows.append((stamp, self._key(user_id, server_id), min(request_count, REQUEST_LIMIT)))
+
+        with self.lock:
+            self.windows.clear()
+            for stamp, key, request_count in sorted(windows):
+                self.windows[key] = deque([stamp] * request_count)
+
+    def persist(self):
+        """Writes every window that changed since the last call back to UserRequests."""
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            snapshot = {key: tuple(self.windows.get(key, ())) for key in dirty}
+
+        # Grouped by the database file holding each guild's rows: one transaction per file.
+        changes = {}
+        for (user_id, server_id), window in snapshot.items():
+            upserts, deletes = changes.setdefault(DatabaseConnection.shard_of(server_id), ([], []))
+            if window:
+                upserts.append((user_id, server_id, datetime.datetime.fromtimestamp(window[0]).isoformat(), len(window)))
+            else:
+                deletes.append((user_id, server_id))
+
+        failed = set()
+        for shard, (upserts, deletes) in changes.items():
+            try:
+                with DatabaseConnection.for_shard(shard).transaction() as cursor:
+                    cursor.executemany("""
+                    INSERT INTO UserRequests (userID, serverID, firstRequestTime, requestCount) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(userID, serverID) DO UPDATE SET
+                        firstRequestTime = excluded.firstRequestTime,
+                        requestCount = excluded.requestCount
+                    """, upserts)
+                    cursor.executemany("DELETE FROM UserRequests WHERE userID = ? AND serverID = ?", deletes)
+            except sqlite3.Error as e:
+                print(f"An error occurred: {e}")
+                failed |= {(row[0], row[1]) for row in upserts} | set(deletes)
+        if failed:
+            with self.lock:
+                self.dirty |= failed
@@ -0,0 +1,88 @@
+"""
+Stateless buttons and selects.
+
+The state a component needs (card id, owner id, page cursor, ...) is encoded in its custom_id
+as "hc:<action>:<field>:<field>...", and handle_component() routes every click on such a
+component to the handler registered for its action. Nothing about a sent message is kept in
+memory, so any number of messages can stay open and their buttons keep working after a restart.
+"""
+import discord
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from utils.instrumentation import note_response
+from utils.metrics import command_timer
+
+PREFIX = 'hc'
+CUSTOM_ID_LIMIT = 100  # characters Discord accepts in a custom_id
+
+Handler = Callable[..., Awaitable[None]]
+
+# action -> (name the handler is timed under, handler)
+handlers: Dict[str, Tuple[str, Handler]] = {}
+
+
+def component_id(action: str, *fields) -> str:
+    """Encodes an action and its state as a custom_id."""
+    custom_id = ":".join((PREFIX, action, *map(str, fields)))
+    if len(custom_id) > CUSTOM_ID_LIMIT:
+        raise ValueError(f"custom_id is longer than {CUSTOM_ID_LIMIT} characters: {custom_id}")
+    return custom_id
+
+
+def parse_component_id(custom_id: str) -> Optional[Tuple[str, Tuple[str, ...]]]:
+    """The action and fields of one of our custom_ids, or None for anything else."""
+    prefix, *parts = custom_id.split(":")
+    if prefix != PREFIX or not parts:
+        return None
+    return parts[0], tuple(parts[1:])
+
+
+def handles(action: str):
+    """Registers the decorated coroutine as the handler of action. It is called with the interaction and the fields, as strings."""
+    def register(handler: Handler) -> Handler:
+        if action in handlers:
+            raise ValueError(f"Two handlers for the component action {action!r}")
+        handlers[action] = (handler.__qualname__, handler)
+        return handler
+    return register
+
+
+async def handle_component(interaction: discord.Interaction) -> bool:
+    """
+    Routes a component interaction to its handler.
+
+    Returns:
+        bool: Whether the interaction was one of ours.
+    """
+    parsed = parse_component_id((interaction.data or {}).get('custom_id', ''))
+    if parsed is None or parsed[0] not in handlers:
+        return False
+
+    action, fields = parsed
+    name, handler = handlers[action]
+    with command_timer(name, interaction.guild_id) as timing:
+        try:
+            await handler(interaction, *fields)
+        except Exception as e:
+            print(f"An error occurred in {name}: {e}")
+            if not interaction.response.is_done():
+                await interaction.response.send_message(f"An error occurred: {e}", ephemeral=True)
+        note_response(interaction, timing)
+    return True
+
+
+class RoutedView(discord.ui.View):
+    """
+    Carries components for handle_component() to a message.
+
+    The view is stopped from the start, so py-cord does not keep it in its view store: the
+    message itself holds all the state, and clicks reach handle_component() instead.
+    """
+
+    def __init__(self, *items: discord.ui.Item):
+        super().__init__(*items, timeout=None)
+        self.stop()
+
+    def button(self, label: str, custom_id: str, style=discord.ButtonStyle.grey, disabled: bool = False, emoji=None) -> discord.ui.Button:
+        button = discord.ui.Button(label=label, custom_id=custom_id, style=style, disabled=disabled, emoji=emoji)
+        self.add_item(button)
+        return button
@@ -1,28 +1,282 @@
+import os
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+from utils.metrics import TimedConnection
+from utils.sharding import shard_for
+
+DATABASE_PATH = "database.sqlite"
+READ_POOL_SIZE = 4
+
+# The tables keyed on a guild. In sharded storage they live in the shard files (see DatabaseConnection.for_guild).
+GUILD_TABLES = ('Server', 'User', 'UserRequests', 'UserCard', 'UserCardBits', 'DustBalance', 'Shop',
+                'GuildDropRate', 'DustLedger', 'DustLedgerSummary')
+STATEMENT_CACHE_SIZE = 256
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",        # readers never block the writer and vice versa
+    "PRAGMA synchronous = FULL",        # every commit is durable; database.batch amortises the fsync over many writes
+    "PRAGMA cache_size = -16000",       # 16 MB page cache per connection
+    "PRAGMA mmap_size = 268435456",     # 256 MB of the file memory-mapped
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+)
+
+
+class Rollback(Exception):
+    """Raise inside a transaction() block to roll it back quietly, without reporting an error."""
+
+
+def connect(path: str, read_only: bool = False, catalog: Optional[str] = None) -> sqlite3.Connection:
+    """
+    Opens a tuned SQLite connection.
+
+    Statements are cached per connection (keyed on their SQL text), so the data layer keeps
+    its SQL as constant strings and passes values as parameters. Every statement is timed
+    (see utils.metrics).
+
+    A shard file is opened with the main database attached read-only as `catalog`, so the
+    per-guild tables resolve in the shard and Card, Collection and CardFTS in the main file,
+    and the same SQL runs unchanged in both storage modes. Being read-only, the attached file
+    takes no part in the shard's write transactions.
+    """
+    if read_only:
+        connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False,
+                                     cached_statements=STATEMENT_CACHE_SIZE, factory=TimedConnection)
+    elif catalog:
+        # URI filenames have to be enabled on the connection for ATTACH to open the catalog read-only.
+        connection = sqlite3.connect(f"file:{path}", uri=True, check_same_thread=False,
+                                     cached_statements=STATEMENT_CACHE_SIZE, factory=TimedConnection)
+    else:
+        connection = sqlite3.connect(path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE,
+                                     factory=TimedConnection)
+    for pragma in PRAGMAS:
+        if read_only and 'journal_mode' in pragma:
+            continue
+        connection.execute(pragma)
+    if catalog:
+        # After the pragmas: an unqualified journal_mode would apply to the attached file too.
+        connection.execute("ATTACH DATABASE ? AS catalog", (f"file:{catalog}?mode=ro",))
+    return connection
+
+
+def shard_path(path: str, shard: int, shard_count: int) -> str:
+    """The file of one shard, next to the main database: database.shard2-of-4.sqlite."""
+    stem, extension = os.path.splitext(path)
+    return f"{stem}.shard{shard}-of-{shard_count}{extension}"
+
 
 class DatabaseConnection:
+    """
+    The single writer connection plus a small pool of read-only connections.
+
+    Writes go through transaction(), which serialises writers on a lock and commits or rolls back
+    as a unit. Reads go through reader(), which borrows a read-only connection so they never
+    queue behind a write.
+
+    get_instance() is the main database, which holds the catalog. The per-guild tables
+    (GUILD_TABLES) are reached through for_guild(): by default that is the main database as
+    well, but once tools.reshard has split them into N shard files each guild's rows live in
+    shard_for(guild_id, N), with a writer and readers of its own. Writes to different shards
+    then never wait for each other's lock or fsync. Every write to a guild's rows, and every
+    on_commit() hook mirroring one, has to go through the guild's connection.
+    """
     _instance = None
+    _shards = None
+    _shard_count = None
+    _shard_lock = threading.Lock()
+    path = DATABASE_PATH
 
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._instance.connection = sqlite3.connect("database.sqlite", check_same_thread=False)
+            cls._instance = cls._open(cls.path)
         return cls._instance
 
+    @classmethod
+    def _open(cls, path: str, shard: Optional[int] = None, catalog: Optional[str] = None) -> 'DatabaseConnection':
+        instance = super().__new__(cls)
+        instance.path = path
+        instance.shard = shard
+        instance.catalog = catalog
+        instance.connection = connect(path, catalog=catalog)
+        instance.write_lock = threading.RLock()
+        instance.savepoint_depth = 0
+        instance.commit_callbacks = []
+        instance.readers = queue.LifoQueue()
+        instance.reader_count = 0
+        instance.reader_lock = threading.Lock()
+        return instance
+
     @classmethod
     def get_instance(cls):
         if cls._instance is None:
             cls._instance = cls()
         return cls._instance
 
+    @classmethod
+    def configure(cls, path: str):
+        """Point the data layer at another database file, closing any open connections."""
+        cls.close()
+        cls.path = path
+
+    @classmethod
+    def shard_count(cls) -> int:
+        """How many shard files hold the per-guild tables; 0 when they are in the main database."""
+        if cls._shard_count is None:
+            try:
+                with cls.get_instance().reader() as cursor:
+                    cursor.execute("SELECT shardCount FROM StorageLayout")
+                    row = cursor.fetchone()
+                cls._shard_count = row[0] if row else 0
+            except sqlite3.OperationalError:
+                # A database older than the StorageLayout table is never sharded.
+                cls._shard_count = 0
+        return cls._shard_count
+
+    @classmethod
+    def shard_of(cls, server_id: int) -> Optional[int]:
+        """The shard holding a guild's rows, or None when they are in the main database."""
+        shard_count = cls.shard_count()
+        return shard_for(server_id, shard_count) if shard_count else None
+
+    @classmethod
+    def for_shard(cls, shard: Optional[int]) -> 'DatabaseConnection':
+        """The connection of one shard file, or of the main database for None."""
+        if shard is None:
+            return cls.get_instance()
+        shards = cls._shards
+        if shards is None or shards[shard] is None:
+            with cls._shard_lock:
+                if cls._shards is None:
+                    cls._shards = [None] * cls.shard_count()
+                if cls._shards[shard] is None:
+                    cls._shards[shard] = cls._open(shard_path(cls.path, shard, cls.shard_count()), shard, cls.path)
+                shards = cls._shards
+        return shards[shard]
+
+    @classmethod
+    def for_guild(cls, server_id: int) -> 'DatabaseConnection':
+        """The connection holding a guild's rows of the per-guild tables."""
+        return cls.for_shard(cls.shard_of(server_id))
+
+    @classmethod
+    def guild_connections(cls) -> List['DatabaseConnection']:
+        """Every connection holding per-guild rows, for loaders and jobs that go over all guilds."""
+        shard_count = cls.shard_count()
+        if not shard_count:
+            return [cls.get_instance()]
+        return [cls.for_shard(shard) for shard in range(shard_count)]
+
     def get_cursor(self):
         return self.connection.cursor()
 
     def commit(self):
         self.connection.commit()
 
+    @contextmanager
+    def transaction(self):
+        """
+        Runs a block of writes as one transaction on the writer connection.
+
+        When already inside a transaction, the block runs in a savepoint of the outer one instead.
+
+        Usage:
+            with db_connection.transaction() as cursor:
+                cursor.execute(...)
+        """
+        with self.write_lock:
+            cursor = self.connection.cursor()
+            if not self.connection.in_transaction:
+                cursor.execute("BEGIN IMMEDIATE")
+                try:
+                    yield cursor
+                except Rollback:
+                    self._rollback()
+                except BaseException:
+                    self._rollback()
+                    raise
+                else:
+                    self.connection.commit()
+                    self._run_commit_callbacks()
+                return
+
+            # Nested inside an outer transaction (e.g. a group-commit batch): isolate this block
+            # in a savepoint so a failure only undoes its own writes.
+            self.savepoint_depth += 1
+            savepoint = f"sp{self.savepoint_depth}"
+            pending_callbacks = len(self.commit_callbacks)
+            self.connection.execute(f"SAVEPOINT {savepoint}")
+            try:
+                yield cursor
+            except BaseException as e:
+                self.connection.execute(f"ROLLBACK TO {savepoint}")
+                self.connection.execute(f"RELEASE {savepoint}")
+                del self.commit_callbacks[pending_callbacks:]
+                if not isinstance(e, Rollback):
+                    raise
+            else:
+                self.connection.execute(f"RELEASE {savepoint}")
+            finally:
+                self.savepoint_depth -= 1
+
+    def on_commit(self, callback: Callable[[], None]):
+        """
+        Runs callback once the current transaction has committed, or right away outside one.
+
+        In-memory state that mirrors the database (caches, counters) is updated this way, so it
+        never reflects a write that was rolled back, even when the write's own savepoint was
+        released inside a group-commit batch that later failed.
+        """
+        with self.write_lock:
+            if self.connection.in_transaction:
+                self.commit_callbacks.append(callback)
+                return
+        callback()
+
+    def _rollback(self):
+        self.connection.rollback()
+        self.commit_callbacks.clear()
+
+    def _run_commit_callbacks(self):
+        callbacks, self.commit_callbacks = self.commit_callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"An error occurred: {e}")
+
+    @contextmanager
+    def reader(self):
+        """Borrows a read-only connection from the pool and yields a cursor on it."""
+        try:
+            connection = self.readers.get_nowait()
+        except queue.Empty:
+            with self.reader_lock:
+                can_open = self.reader_count < READ_POOL_SIZE
+                if can_open:
+                    self.reader_count += 1
+            connection = connect(self.path, read_only=True, catalog=self.catalog) if can_open else self.readers.get()
+        try:
+            yield connection.cursor()
+        finally:
+            if connection.in_transaction:
+                connection.rollback()
+            self.readers.put(connection)
+
     @classmethod
     def close(cls):
-        if cls._instance is not None:
-            cls._instance.connection.close()
-            cls._instance = None
+        instances = [cls._instance] + (cls._shards or [])
+        cls._instance = None
+        cls._shards = None
+        cls._shard_count = None
+        for instance in instances:
+            if instance is None:
+                continue
+            instance.connection.close()
+            while True:
+                try:
+                    instance.readers.get_nowait().close()
+                except queue.Empty:
+                    break
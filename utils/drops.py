@@ -0,0 +1,271 @@
+import random
+import sqlite3
+import threading
+from typing import Optional, Dict, List, Sequence
+from database.catalog import CardCatalog, CardRecord, RARITY_ORDER
+from utils.connection import DatabaseConnection
+from utils.sharding import ShardAssignment
+
+
+# Redraws allowed per card of a multi-pull before giving up on finding one not drawn yet.
+DISTINCT_DRAW_ATTEMPTS = 50
+
+# Probability of each rarity tier being dropped; cards within a tier are equally likely.
+DEFAULT_DROP_RATES = {
+    'legendary': 0.01,
+    'epic': 0.04,
+    'rare': 0.10,
+    'uncommon': 0.25,
+    'common': 0.60,
+}
+
+
+class AliasTable:
+    """
+    Walker/Vose alias table: O(n) to build, O(1) per draw whatever the number of items.
+    """
+
+    __slots__ = ('items', 'prob', 'alias')
+
+    def __init__(self, items: Sequence, weights: Sequence[float]):
+        n = len(items)
+        total = float(sum(weights))
+        if n == 0 or total <= 0:
+            raise ValueError("An alias table needs at least one item with a positive weight.")
+
+        self.items = tuple(items)
+        self.prob = [0.0] * n
+        self.alias = [0] * n
+
+        scaled = [weight * n / total for weight in weights]
+        small = [i for i, weight in enumerate(scaled) if weight < 1.0]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1.0]
+
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] = (scaled[more] + scaled[less]) - 1.0
+            (small if scaled[more] < 1.0 else large).append(more)
+
+        # Whatever is left is 1.0 up to floating point error.
+        for i in large + small:
+            self.prob[i] = 1.0
+            self.alias[i] = i
+
+    def __len__(self):
+        return len(self.items)
+
+    def sample(self, rng: random.Random = random):
+        column = int(rng.random() * len(self.items))
+        if rng.random() < self.prob[column]:
+            return self.items[column]
+        return self.items[self.alias[column]]
+
+
+def card_weights(cards: Sequence[CardRecord], rates: Dict[str, float]) -> List[float]:
+    """
+    Spreads each tier's drop rate evenly over the cards of that tier.
+
+    Tiers that have no card in the pool simply drop out, and the remaining rates are
+    renormalised by the alias table.
+    """
+    tier_sizes = {}
+    for card in cards:
+        tier_sizes[card.rarity] = tier_sizes.get(card.rarity, 0) + 1
+    return [rates.get(card.rarity, 0.0) / tier_sizes[card.rarity] for card in cards]
+
+
+def expected_tier_rates(cards: Sequence[CardRecord], rates: Dict[str, float]) -> Dict[str, float]:
+    """The per-tier probabilities a profile actually yields once missing tiers are dropped."""
+    present = {card.rarity for card in cards}
+    total = sum(weight for rarity, weight in rates.items() if rarity in present)
+    return {rarity: rates.get(rarity, 0.0) / total for rarity in RARITY_ORDER if rarity in present and total > 0}
+
+
+def validate_rates(rates: Dict[str, float]) -> Dict[str, float]:
+    """
+    Checks a drop-rate profile: known rarity tiers only, no negative weight, and at least one positive one.
+
+    Returns:
+        Dict[str, float]: The rates as floats.
+
+    Raises:
+        ValueError: If the profile is not usable.
+    """
+    unknown = set(rates) - set(RARITY_ORDER)
+    if unknown:
+        raise ValueError(f"Unknown rarity tiers: {', '.join(sorted(unknown))}.")
+    rates = {rarity: float(weight) for rarity, weight in rates.items()}
+    if any(weight < 0 for weight in rates.values()):
+        raise ValueError("Drop rates cannot be negative.")
+    if not any(rates.values()):
+        raise ValueError("At least one rarity tier needs a positive drop rate.")
+    return rates
+
+
+def build_alias_table(cards: Sequence[CardRecord], rates: Dict[str, float]) -> Optional[AliasTable]:
+    weights = card_weights(cards, rates)
+    if not cards or sum(weights) <= 0:
+        return None
+    return AliasTable(cards, weights)
+
+
+class DropEngine:
+    """
+    Rarity-weighted card drops.
+
+    A weighting profile is either the global rates or a guild override, optionally restricted
+    to one collection. Each profile gets its own alias table, built on first use and kept until
+    the catalog version or the profile's rates change.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.rates = dict(DEFAULT_DROP_RATES)
+            cls._instance.guild_rates = {}
+            cls._instance.tables = {}
+            cls._instance.catalog_version = None
+            cls._instance.lock = threading.Lock()
+            cls._instance.load_guild_rates()
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def load_guild_rates(self):
+        """Load the per-guild overrides stored in GuildDropRate, for the guilds this process serves."""
+        rows = []
+
+        try:
+            for db_connection in DatabaseConnection.guild_connections():
+                with db_connection.reader() as cursor:
+                    cursor.execute("SELECT serverID, rarity, weight FROM GuildDropRate")
+                    rows += cursor.fetchall()
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            return
+
+        shards = ShardAssignment.get_instance()
+        guild_rates = {}
+        for server_id, rarity, weight in rows:
+            if not shards.owns(server_id):
+                continue
+            guild_rates.setdefault(int(server_id), {})[rarity] = weight
+        with self.lock:
+            self.guild_rates = guild_rates
+            self.tables = {}
+
+    def configure(self, rates: Dict[str, float]):
+        """Replace the global drop rates; see validate_rates() for what is accepted."""
+        rates = validate_rates(rates)
+        with self.lock:
+            self.rates = rates
+            self.tables = {}
+
+    def set_guild_rates(self, server_id: int, rates: Optional[Dict[str, float]]):
+        """
+        Store (or, with None, remove) a guild's drop-rate override.
+
+        Args:
+            server_id (int): The Discord server's ID.
+            rates (Optional[Dict[str, float]]): Weight per rarity tier, or None to fall back to the global rates.
+
+        Raises:
+            ValueError: If rates is not a usable profile (see validate_rates()).
+        """
+        server_id = int(server_id)
+        if rates:
+            rates = validate_rates(rates)
+        db_connection = DatabaseConnection.for_guild(server_id)
+
+        try:
+            with db_connection.transaction() as cursor:
+                cursor.execute("DELETE FROM GuildDropRate WHERE serverID = ?", (server_id,))
+                if rates:
+                    cursor.executemany("INSERT INTO GuildDropRate (serverID, rarity, weight) VALUES (?, ?, ?)",
+                                       [(server_id, rarity, weight) for rarity, weight in rates.items()])
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+            return
+
+        with self.lock:
+            if rates:
+                self.guild_rates[server_id] = dict(rates)
+            else:
+                self.guild_rates.pop(server_id, None)
+            self.tables = {key: table for key, table in self.tables.items() if key[0] != server_id}
+
+    def profile_rates(self, server_id: Optional[int] = None) -> Dict[str, float]:
+        if server_id is not None:
+            return self.guild_rates.get(int(server_id), self.rates)
+        return self.rates
+
+    def get_table(self, server_id: Optional[int] = None, collection: Optional[str] = None) -> Optional[AliasTable]:
+        catalog = CardCatalog.get_instance().state
+        if server_id is not None and int(server_id) not in self.guild_rates:
+            server_id = None
+        key = (int(server_id) if server_id is not None else None, collection.lower() if collection else None)
+
+        with self.lock:
+            if self.catalog_version != catalog.version:
+                self.tables = {}
+                self.catalog_version = catalog.version
+
+            if key not in self.tables:
+                cards = catalog.cards
+                if collection:
+                    cards = [card for card in cards if card.collection.lower() == key[1]]
+                self.tables[key] = build_alias_table(cards, self.profile_rates(server_id))
+            return self.tables[key]
+
+    def draw(self, server_id: Optional[int] = None, collection: Optional[str] = None) -> Optional[CardRecord]:
+        """
+        Draw one card according to the guild's (or global) drop rates.
+
+        Args:
+            server_id (Optional[int]): The Discord server's ID, to apply its override if it has one.
+            collection (Optional[str]): Restrict the draw to a single collection.
+
+        Returns:
+            Optional[CardRecord]: The drawn card, or None if the pool is empty.
+        """
+        table = self.get_table(server_id, collection)
+        return table.sample() if table is not None else None
+
+    def draw_many(self, count: int, server_id: Optional[int] = None, collection: Optional[str] = None) -> List[CardRecord]:
+        """
+        Draw up to count distinct cards, each according to the same drop rates as draw().
+
+        A card drawn a second time is redrawn, so the result can be shorter than count when the
+        pool has fewer cards than that.
+
+        Args:
+            count (int): The number of cards wanted.
+            server_id (Optional[int]): The Discord server's ID, to apply its override if it has one.
+            collection (Optional[str]): Restrict the draw to a single collection.
+
+        Returns:
+            List[CardRecord]: The drawn cards, in the order they were drawn.
+        """
+        table = self.get_table(server_id, collection)
+        if table is None:
+            return []
+        drawn = {}
+        for _ in range(count * DISTINCT_DRAW_ATTEMPTS):
+            if len(drawn) == count:
+                break
+            card = table.sample()
+            drawn.setdefault(card.id, card)
+        return list(drawn.values())
+
+    def expected_rates(self, server_id: Optional[int] = None, collection: Optional[str] = None) -> Dict[str, float]:
+        cards = CardCatalog.get_instance().cards
+        if collection:
+            cards = [card for card in cards if card.collection.lower() == collection.lower()]
+        return expected_tier_rates(cards, self.profile_rates(server_id))
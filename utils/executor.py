@@ -0,0 +1,60 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from utils.connection import READ_POOL_SIZE, DatabaseConnection
+
+
+class DatabaseExecutor:
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            # A single worker owns the writer connection, so writes never contend with each other.
+            cls._instance.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hoardcraft-db")
+            # In sharded storage every shard file gets a writer thread of its own, created on first use.
+            cls._instance.shard_executors = {}
+            # Reads run on their own threads against the read-only pools and never queue behind writes.
+            readers = READ_POOL_SIZE * max(1, DatabaseConnection.shard_count())
+            cls._instance.read_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="hoardcraft-db-read")
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking data-layer function on the database thread and await its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def run_on_shard(self, shard: Optional[int], func, *args, **kwargs):
+        """Run a blocking data-layer function on the writer thread of a shard (the main database thread for None)."""
+        if shard is None:
+            return await self.run(func, *args, **kwargs)
+        executor = self.shard_executors.get(shard)
+        if executor is None:
+            executor = self.shard_executors[shard] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"hoardcraft-db-shard{shard}")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+    async def run_for_guild(self, server_id: int, func, *args, **kwargs):
+        """Run a blocking write to a guild's rows on the writer thread of the database file holding them."""
+        return await self.run_on_shard(DatabaseConnection.shard_of(server_id), func, *args, **kwargs)
+
+    async def run_read(self, func, *args, **kwargs):
+        """Run a read-only data-layer function on one of the reader threads and await its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.read_executor, functools.partial(func, *args, **kwargs))
+
+    @classmethod
+    def shutdown(cls):
+        if cls._instance is not None:
+            cls._instance.executor.shutdown(wait=True)
+            for executor in cls._instance.shard_executors.values():
+                executor.shutdown(wait=True)
+            cls._instance.read_executor.shutdown(wait=True)
+            cls._instance = None
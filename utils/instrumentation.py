@@ -0,0 +1,45 @@
+"""
+Hooks that feed utils.metrics from discord: MyBot times every slash command, and
+utils.components every button and select handler.
+"""
+import functools
+import discord
+from utils.metrics import Timing, current_timing
+
+# The InteractionResponse methods that send an interaction's first reply.
+RESPONSE_METHODS = ('defer', 'send_message', 'edit_message', 'send_modal')
+
+
+def _noting_response(method):
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            timing = current_timing.get()
+            if timing is not None:
+                timing.responded()
+
+    wrapper.notes_response = True
+    return wrapper
+
+
+def install_response_timing():
+    """
+    Wraps the public reply methods of discord.InteractionResponse so the first reply is noted on
+    the Timing of the command or view callback it was sent from (see utils.metrics.command_timer).
+    Safe to call more than once.
+    """
+    for name in RESPONSE_METHODS:
+        method = getattr(discord.InteractionResponse, name)
+        if not getattr(method, 'notes_response', False):
+            setattr(discord.InteractionResponse, name, _noting_response(method))
+
+
+def note_response(interaction, timing: Timing):
+    """
+    Called once a handler returns: a reply sent by a path the wrappers do not see is still
+    counted, at the latest when the handler finished.
+    """
+    if interaction.response.is_done():
+        timing.responded()
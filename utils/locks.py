@@ -0,0 +1,51 @@
+"""
+Per-user locks for the actions that change a user's cards or dust.
+
+The data layer keeps every single write consistent on its own, but an action is a check and a
+write: a double-clicked Claim or Craft runs both of them twice, interleaved at every await. The
+cogs and views hold user_locks for the user and guild they act for around the whole check and
+write, so a user's actions run one after the other while other users never wait on them.
+
+Locks are only held on the event loop of one process, which is enough: every guild, and so every
+(user, guild), is served by exactly one worker (see utils.sharding).
+"""
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+from typing import Hashable
+
+
+class KeyedLock:
+    """
+    One asyncio.Lock per key, created on first use.
+
+    The locks are only weakly referenced here; whoever holds or waits for one keeps it alive, so
+    a lock disappears as soon as its last user is done and the table stays as small as the
+    number of actions in flight.
+    """
+
+    def __init__(self):
+        self.locks = weakref.WeakValueDictionary()
+
+    def __len__(self) -> int:
+        return len(self.locks)
+
+    def locked(self, *key: Hashable) -> bool:
+        lock = self.locks.get(key)
+        return lock is not None and lock.locked()
+
+    @asynccontextmanager
+    async def hold(self, *key: Hashable):
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+        async with lock:
+            yield
+
+
+user_locks = KeyedLock()
+
+
+def user_lock(user_id: int, server_id: int):
+    """Serialises the actions of one user in one guild: async with user_lock(user_id, server_id): ..."""
+    return user_locks.hold(int(user_id), int(server_id))
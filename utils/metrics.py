@@ -0,0 +1,401 @@
+"""
+In-process latency metrics.
+
+Every slash command and view callback is timed as a whole, for the part spent awaiting the
+data layer, and until its first response to Discord (see utils.instrumentation). Every SQL
+statement is timed by the cursors connect() hands out, and statements slower than
+SLOW_QUERY_SECONDS are logged along with their query plan.
+
+Everything is kept in memory and rendered in the Prometheus text format, either by
+serve_metrics() on a local port or by the /debugstats command.
+"""
+import asyncio
+import bisect
+import contextvars
+import functools
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+SLOW_QUERY_SECONDS = 0.05
+SLOW_QUERY_LOG_SIZE = 100
+
+
+class Histogram:
+    """Cumulative-bucket histogram, in the shape Prometheus expects."""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class QueryStats:
+    __slots__ = ('count', 'seconds', 'max_seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+
+class Timing:
+    """The measurements of one command or view callback while it runs."""
+
+    __slots__ = ('name', 'guild_id', 'started', 'db_seconds', 'respond_seconds')
+
+    def __init__(self, name: str, guild_id: Optional[int]):
+        self.name = name
+        self.guild_id = guild_id
+        self.started = time.perf_counter()
+        self.db_seconds = 0.0
+        self.respond_seconds = None
+
+    def responded(self):
+        if self.respond_seconds is None:
+            self.respond_seconds = time.perf_counter() - self.started
+
+
+current_timing: contextvars.ContextVar[Optional[Timing]] = contextvars.ContextVar('current_timing', default=None)
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_label(sql: str) -> str:
+    """
+    Collapses a statement's whitespace so every call of it is counted under the same label.
+
+    Memoized: the statements are module constants, so the same few strings come back on every execute.
+    """
+    return re.sub(r"\s+", " ", sql).strip()[:120]
+
+
+class Metrics:
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.lock = threading.Lock()
+            cls._instance.commands = {}  # (command, phase) -> Histogram
+            cls._instance.guilds = {}  # guild id -> [invocations, seconds]
+            cls._instance.queries = {}  # statement label -> QueryStats
+            cls._instance.query_latency = Histogram()
+            cls._instance.slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+            cls._instance.explained = {}  # statement label -> query plan, captured once per statement
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def record_command(self, timing: Timing):
+        total = time.perf_counter() - timing.started
+        phases = {'total': total, 'db': timing.db_seconds, 'respond': timing.respond_seconds}
+        with self.lock:
+            for phase, seconds in phases.items():
+                if seconds is None:
+                    continue
+                histogram = self.commands.get((timing.name, phase))
+                if histogram is None:
+                    histogram = self.commands[timing.name, phase] = Histogram()
+                histogram.observe(seconds)
+            if timing.guild_id is not None:
+                guild = self.guilds.setdefault(timing.guild_id, [0, 0.0])
+                guild[0] += 1
+                guild[1] += total
+
+    def record_query(self, sql: str, seconds: float, connection: Optional[sqlite3.Connection] = None, params=()):
+        label = statement_label(sql)
+        with self.lock:
+            stats = self.queries.get(label)
+            if stats is None:
+                stats = self.queries[label] = QueryStats()
+            stats.count += 1
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            self.query_latency.observe(seconds)
+            if seconds < SLOW_QUERY_SECONDS:
+                return
+            # Claimed under the lock, so only the first slow run of a statement explains it.
+            explain = connection is not None and label not in self.explained
+            if explain:
+                self.explained[label] = None
+            plan = self.explained.get(label)
+
+        if explain:
+            plan = explain_query(connection, sql, params)
+            with self.lock:
+                self.explained[label] = plan
+        self.slow_queries.append((time.time(), label, seconds, plan))
+        print(f"Slow query ({seconds * 1000:.0f} ms): {label}" + (f"\n  plan: {plan}" if plan else ""))
+
+    def record_fetch(self, sql: str, seconds: float):
+        """Adds the time spent fetching a statement's rows to its total, without counting another call."""
+        label = statement_label(sql)
+        with self.lock:
+            stats = self.queries.get(label)
+            if stats is None:
+                stats = self.queries[label] = QueryStats()
+            stats.seconds += seconds
+
+    def top_commands(self, limit: int = 10) -> List[Tuple[str, Histogram, Optional[Histogram], Optional[Histogram]]]:
+        """The commands that used the most time in total, with their total, db and respond histograms."""
+        with self.lock:
+            names = {name for name, _ in self.commands}
+            rows = [(name, self.commands[name, 'total'], self.commands.get((name, 'db')), self.commands.get((name, 'respond')))
+                    for name in names if (name, 'total') in self.commands]
+        return sorted(rows, key=lambda row: row[1].sum, reverse=True)[:limit]
+
+    def top_guilds(self, limit: int = 10) -> List[Tuple[int, int, float]]:
+        """The guilds whose commands used the most time: (guild id, invocations, seconds)."""
+        with self.lock:
+            rows = [(guild_id, count, seconds) for guild_id, (count, seconds) in self.guilds.items()]
+        return sorted(rows, key=lambda row: row[2], reverse=True)[:limit]
+
+    def top_queries(self, limit: int = 10) -> List[Tuple[str, QueryStats]]:
+        """The statements that used the most time in total."""
+        with self.lock:
+            rows = list(self.queries.items())
+        return sorted(rows, key=lambda row: row[1].seconds, reverse=True)[:limit]
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format."""
+        lines = []
+
+        def histogram_lines(name: str, labels: str, histogram: Histogram):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {cumulative}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{name}_sum{suffix} {histogram.sum}")
+            lines.append(f"{name}_count{suffix} {histogram.count}")
+
+        with self.lock:
+            lines.append("# HELP hoardcraft_command_seconds Latency of slash commands and view callbacks, by phase.")
+            lines.append("# TYPE hoardcraft_command_seconds histogram")
+            for (name, phase), histogram in sorted(self.commands.items()):
+                histogram_lines("hoardcraft_command_seconds", f'command="{escape(name)}",phase="{phase}"', histogram)
+
+            lines.append("# HELP hoardcraft_guild_command_seconds_total Time spent in commands, by guild.")
+            lines.append("# TYPE hoardcraft_guild_command_seconds_total counter")
+            for guild_id, (_, seconds) in sorted(self.guilds.items()):
+                lines.append(f'hoardcraft_guild_command_seconds_total{{guild="{guild_id}"}} {seconds}')
+            lines.append("# HELP hoardcraft_guild_commands_total Commands run, by guild.")
+            lines.append("# TYPE hoardcraft_guild_commands_total counter")
+            for guild_id, (count, _) in sorted(self.guilds.items()):
+                lines.append(f'hoardcraft_guild_commands_total{{guild="{guild_id}"}} {count}')
+
+            lines.append("# HELP hoardcraft_query_seconds Latency of SQL statements.")
+            lines.append("# TYPE hoardcraft_query_seconds histogram")
+            histogram_lines("hoardcraft_query_seconds", "", self.query_latency)
+
+            lines.append("# HELP hoardcraft_statement_seconds_total Time spent in each SQL statement.")
+            lines.append("# TYPE hoardcraft_statement_seconds_total counter")
+            for label, stats in sorted(self.queries.items()):
+                lines.append(f'hoardcraft_statement_seconds_total{{statement="{escape(label)}"}} {stats.seconds}')
+            lines.append("# HELP hoardcraft_statement_calls_total Calls of each SQL statement.")
+            lines.append("# TYPE hoardcraft_statement_calls_total counter")
+            for label, stats in sorted(self.queries.items()):
+                lines.append(f'hoardcraft_statement_calls_total{{statement="{escape(label)}"}} {stats.count}')
+
+        # Imported here: utils.cache reaches this module through utils.connection.
+        from utils.cache import CACHES
+
+        caches = sorted(CACHES.items())
+        for metric, kind, help_text, value in (
+                ('hoardcraft_cache_hits_total', 'counter', "Lookups answered from memory, by cache.", lambda cache: cache.hits),
+                ('hoardcraft_cache_misses_total', 'counter', "Values read from the database into a cache.", lambda cache: cache.misses),
+                ('hoardcraft_cache_evictions_total', 'counter', "Entries evicted to stay within the size bound.", lambda cache: cache.evictions),
+                ('hoardcraft_cache_entries', 'gauge', "Entries held, by cache.", len)):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for name, cache in caches:
+                lines.append(f'{metric}{{cache="{name}"}} {value(cache)}')
+        return "\n".join(lines) + "\n"
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def explain_query(connection: sqlite3.Connection, sql: str, params=()) -> Optional[str]:
+    """The statement's EXPLAIN QUERY PLAN, on one line, or None if it has no plan (BEGIN, PRAGMA, ...)."""
+    try:
+        cursor = sqlite3.Cursor(connection)
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        plan = " | ".join(row[3] for row in cursor.fetchall())
+        return plan or None
+    except sqlite3.Error:
+        return None
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    A cursor that reports the time each execute() and executemany() takes, and the time spent
+    fetching the rows of the last statement executed, charged to that statement.
+
+    Rows fetched by iterating are timed one by one and reported together, when the rows run out,
+    the next statement is executed or the cursor is closed.
+    """
+
+    sql = None  # the last statement executed
+    fetch_seconds = 0.0  # time spent iterating over its rows, not yet reported
+
+    def _flush(self):
+        if self.fetch_seconds and self.sql is not None:
+            Metrics.get_instance().record_fetch(self.sql, self.fetch_seconds)
+        self.fetch_seconds = 0.0
+
+    def _fetched(self, started: float):
+        if self.sql is not None:
+            Metrics.get_instance().record_fetch(self.sql, time.perf_counter() - started)
+
+    def execute(self, sql, parameters=()):
+        self._flush()
+        self.sql = sql
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            Metrics.get_instance().record_query(sql, time.perf_counter() - started, self.connection, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._flush()
+        self.sql = sql
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            Metrics.get_instance().record_query(sql, time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._fetched(started)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            self._fetched(started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._fetched(started)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self.fetch_seconds += time.perf_counter() - started
+            self._flush()
+            raise
+        self.fetch_seconds += time.perf_counter() - started
+        return row
+
+    def close(self):
+        self._flush()
+        return super().close()
+
+
+class TimedConnection(sqlite3.Connection):
+    """Hands out TimedCursors, including for the connection's own execute() shortcut, and times commits."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            Metrics.get_instance().record_query("COMMIT", time.perf_counter() - started)
+
+
+@contextmanager
+def command_timer(name: str, guild_id: Optional[int] = None):
+    """Times a command or view callback, and makes it the one the data layer's time is charged to."""
+    timing = Timing(name, guild_id)
+    token = current_timing.set(timing)
+    try:
+        yield timing
+    finally:
+        current_timing.reset(token)
+        Metrics.get_instance().record_command(timing)
+
+
+@contextmanager
+def db_timer():
+    """Charges the time spent in the block to the running command, if any."""
+    timing = current_timing.get()
+    if timing is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.db_seconds += time.perf_counter() - started
+
+
+async def serve_metrics(port: int, host: str = '127.0.0.1') -> asyncio.AbstractServer:
+    """Serves render() over plain HTTP on a local port, for a Prometheus scraper or curl."""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = Metrics.get_instance().render().encode('utf-8')
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('ascii') + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,124 @@
+"""
+Card embeds.
+
+A card looks the same wherever it is shown: title, colour, author, thumbnail and image only
+depend on the card, and the footer is the one part that changes from render to render. The
+static part of every card's embed is serialised once per catalog load, so rendering a card is
+a lookup, a copy of a few references and a footer, not an Embed built field by field.
+"""
+import threading
+import discord
+from typing import Optional, Tuple
+from database.catalog import CardCatalog, CardRecord
+
+
+RARITY_COLORS = {
+    'legendary': discord.Colour.orange(),
+    'epic': discord.Colour.purple(),
+    'rare': discord.Colour.blue(),
+    'uncommon': discord.Colour.green(),
+    'common': discord.Colour.greyple(),
+}
+
+COLLECTION_ICONS = {
+    'forsaken': "https://static.wikia.nocookie.net/wowpedia/images/7/72/Forsaken_Crest.png/revision/latest?cb=20151113054325",
+    'scourge': "https://static.wikia.nocookie.net/wowpedia/images/3/37/Warcraft_III_Reforged_-_Undead_Icon.png/revision/latest?cb=20210227012440",
+    'alliance': "https://static.wikia.nocookie.net/wowpedia/images/d/da/Alliance_Crest.png/revision/latest?cb=20180710141058",
+    'night elves': "https://static.wikia.nocookie.net/wowpedia/images/b/bc/Warcraft_III_Reforged_-_Night_Elves_Icon.png/revision/latest?cb=20210227012747",
+    'scarlet crusade': "https://static.wikia.nocookie.net/wowpedia/images/7/72/Scarlet_Crusade_logo.png/revision/latest?cb=20080730021543",
+    'horde': "https://static.wikia.nocookie.net/wowpedia/images/0/08/Horde_Crest.png/revision/latest?cb=20151113053903",
+    "quel'thalas": "https://static.wikia.nocookie.net/wowpedia/images/d/d9/Icon_of_Blood.png/revision/latest?cb=20151113053547",
+    'dragon flights': "https://static.wikia.nocookie.net/wowpedia/images/a/a4/Dracthyr_Crest.png/revision/latest?cb=20221115173914",
+    'blackrock': "https://static.wikia.nocookie.net/wowpedia/images/1/1d/Blackrock_Crest.png/revision/latest?cb=20141010174912",
+    'old gods': "https://static.wikia.nocookie.net/wowpedia/images/7/7a/Void_Elf_Crest_%28early%29.png/revision/latest?cb=20171104172306"
+}
+
+
+def card_base(card: CardRecord) -> discord.Embed:
+    """The footer-less embed of a card as shown when drawn, listed or looked up."""
+    embed = discord.Embed(title=card.name, description=card.title, color=RARITY_COLORS.get(card.rarity, discord.Colour.default()))
+    embed.set_thumbnail(url=COLLECTION_ICONS.get(card.collection.lower(), ""))
+    embed.set_author(name=card.collection)
+    embed.set_image(url=card.image_url)
+    return embed
+
+
+def shop_base(card: CardRecord) -> discord.Embed:
+    """The footer-less embed of a card on sale in the shop, which shows the card art as the thumbnail."""
+    embed = discord.Embed(title=card.name, description=card.title, color=RARITY_COLORS.get(card.rarity, discord.Colour.default()))
+    embed.set_thumbnail(url=card.image_url)
+    embed.set_author(name=card.collection)
+    return embed
+
+
+BUILDERS = {'card': card_base, 'shop': shop_base}
+
+# The fields a render sets itself rather than copying from the base.
+RENDERED_SLOTS = ('_footer', '_fields')
+
+
+def serialize(embed: discord.Embed) -> Tuple[Tuple[str, object], ...]:
+    """The attributes an embed has set, as (slot, value) pairs; an embed is rebuilt from them without any parsing."""
+    return tuple((slot, getattr(embed, slot)) for slot in discord.Embed.__slots__
+                 if slot not in RENDERED_SLOTS and hasattr(embed, slot))
+
+
+class CardEmbeds:
+    """
+    The serialised static part of every card's embeds, rebuilt whenever the catalog is reloaded.
+
+    A render copies the serialised attributes into a bare Embed, which is cheaper than both
+    building one and Embed.from_dict(). The nested dicts (thumbnail, author, image) are shared
+    by every embed made from them and must not be modified; set_footer() and the other setters
+    replace them rather than edit them.
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.variants = {variant: {} for variant in BUILDERS}
+            cls._instance.catalog_version = None
+            cls._instance.lock = threading.Lock()
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def refresh(self):
+        """Serialises every card of the catalog again if it was reloaded since the last time."""
+        catalog = CardCatalog.get_instance().state
+        with self.lock:
+            if self.catalog_version != catalog.version:
+                self.variants = {variant: {card.id: serialize(build(card)) for card in catalog.cards}
+                                 for variant, build in BUILDERS.items()}
+                self.catalog_version = catalog.version
+
+    def render(self, card: CardRecord, variant: str, footer: Optional[str]) -> discord.Embed:
+        if self.catalog_version != CardCatalog.get_instance().version:
+            self.refresh()
+        base = self.variants[variant].get(card.id)
+        if base is None:
+            # A card the loaded catalog does not know (yet); build it rather than fail.
+            base = serialize(BUILDERS[variant](card))
+        embed = discord.Embed.__new__(discord.Embed)
+        for slot, value in base:
+            setattr(embed, slot, value)
+        embed._fields = []
+        if footer is not None:
+            embed._footer = {'text': footer}
+        return embed
+
+
+def card_embed(card: CardRecord, footer: Optional[str] = None) -> discord.Embed:
+    """A card's embed, with the given footer, or the card's quote if there is none."""
+    return CardEmbeds.get_instance().render(card, 'card', card.quote if footer is None else footer)
+
+
+def shop_embed(card: CardRecord, footer: str) -> discord.Embed:
+    """A card's embed as an item of the shop."""
+    return CardEmbeds.get_instance().render(card, 'shop', footer)
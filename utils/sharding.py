@@ -0,0 +1,131 @@
+"""
+Gateway shards and the worker processes that run them.
+
+Discord routes every event of a guild to shard (guild_id >> 22) % shard_count. The launcher in
+main.py splits the shards into contiguous ranges, one per worker process, so each guild is
+served by exactly one process. That is what keeps the in-memory state consistent across
+processes: rate-limit windows, guild statistics, shop overrides and drop rates are keyed by
+guild, and every worker only loads and changes the state of the guilds it serves. The
+database itself is shared; SQLite's WAL and busy timeout serialise the writers of all workers,
+unless tools.reshard has split the per-guild tables into shard files. Those are routed with
+shard_for() as well, so with as many storage shards as gateway shards no two workers ever
+write to the same file.
+"""
+import asyncio
+import time
+from typing import List, Optional, Sequence, Tuple
+
+# Discord accepts one IDENTIFY per rate-limit bucket every 5 seconds, across every connection of the bot.
+IDENTIFY_INTERVAL = 5.0
+
+
+def shard_for(guild_id: int, shard_count: int) -> int:
+    """The shard Discord sends a guild's events to."""
+    return (int(guild_id) >> 22) % shard_count
+
+
+def split_shards(shard_count: int, workers: int) -> List[List[int]]:
+    """Splits the shard ids into contiguous ranges of (nearly) equal size, one per worker."""
+    workers = max(1, min(workers, shard_count))
+    size, extra = divmod(shard_count, workers)
+    ranges, start = [], 0
+    for worker in range(workers):
+        end = start + size + (worker < extra)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+class ShardAssignment:
+    """
+    The shards this process serves.
+
+    Unconfigured, as in the tools and a single-process bot, the process serves every guild.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.shard_ids = None
+            cls._instance.shard_count = None
+            cls._instance.worker = 0
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def configure(self, shard_ids: Optional[Sequence[int]], shard_count: Optional[int], worker: int = 0):
+        self.shard_ids = frozenset(shard_ids) if shard_ids is not None else None
+        self.shard_count = shard_count
+        self.worker = worker
+
+    @property
+    def primary(self) -> bool:
+        """Whether this process runs the jobs that concern the whole database rather than its own guilds."""
+        return self.worker == 0
+
+    def owns(self, guild_id: int) -> bool:
+        """Whether this process serves the guild, and so holds its in-memory state."""
+        if self.shard_ids is None or not self.shard_count:
+            return True
+        return shard_for(guild_id, self.shard_count) in self.shard_ids
+
+
+class IdentifyGate:
+    """
+    Spaces out the IDENTIFYs of every worker process: one per IDENTIFY_INTERVAL in each of
+    Discord's max_concurrency buckets.
+
+    py-cord only spaces out the shards of one client, and lets the first one through at once,
+    so workers started together would all identify in the same instant. The gate is created by
+    the launcher and handed to every worker; the next free slot of each bucket lives in shared
+    memory.
+    """
+
+    def __init__(self, context, max_concurrency: int = 1, interval: float = IDENTIFY_INTERVAL):
+        self.lock = context.Lock()
+        self.next_slot = context.Array('d', max(1, max_concurrency), lock=False)
+        self.interval = interval
+
+    def reserve(self, shard_id: int) -> float:
+        """Books the next IDENTIFY slot of the shard's bucket and returns when it is."""
+        bucket = shard_id % len(self.next_slot)
+        with self.lock:
+            slot = max(time.time(), self.next_slot[bucket])
+            self.next_slot[bucket] = slot + self.interval
+        return slot
+
+    async def wait(self, shard_id: int):
+        delay = self.reserve(shard_id) - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def fetch_gateway(token: str) -> Tuple[int, int]:
+    """
+    Asks Discord how many shards the bot should run.
+
+    Returns:
+        Tuple[int, int]: The recommended shard count and the number of shards allowed to identify concurrently.
+    """
+    from discord.http import HTTPClient, Route
+
+    http = HTTPClient()
+    try:
+        await http.static_login(token)
+        data = await http.request(Route('GET', '/gateway/bot'))
+    finally:
+        await http.close()
+    return data['shards'], data.get('session_start_limit', {}).get('max_concurrency', 1)
+
+
+def use_api_base(api_base: str):
+    """Sends every REST request, and so the gateway lookup, to api_base instead of discord.com. Used with tools.mock_gateway."""
+    from discord import http
+
+    base = api_base.rstrip('/') + f"/api/v{http.API_VERSION}"
+    http.Route.base = property(lambda route: base)
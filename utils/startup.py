@@ -0,0 +1,58 @@
+"""
+Where the time of a (re)start goes.
+
+A worker is only fully up once the in-memory state is loaded and every guild it serves is
+registered. Each step is timed as it finishes and the whole breakdown is printed once, when the
+bot is first ready:
+
+    Started in 2.41s: migrations 0.01s, catalog 0.01s*, embeds 0.01s*, drops 0.00s*, shop 0.00s*, cooldowns 0.00s*, stats 1.59s*, gateway 2.20s, guilds 0.05s
+    (* loaded while logging in)
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Tuple
+
+
+class StartupTimer:
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.started = time.perf_counter()
+            cls._instance.steps: List[Tuple[str, float, bool]] = []
+            cls._instance.reported = False
+            cls._instance.lock = threading.Lock()
+        return cls._instance
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def record(self, step: str, seconds: float, background: bool = False):
+        """Notes how long a step took; background steps ran alongside the gateway login."""
+        with self.lock:
+            self.steps.append((step, seconds, background))
+
+    @contextmanager
+    def step(self, step: str, background: bool = False):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(step, time.perf_counter() - started, background)
+
+    def report(self):
+        """Prints the breakdown, the first time only: on_ready fires again after every reconnect."""
+        with self.lock:
+            if self.reported:
+                return
+            self.reported = True
+            steps = list(self.steps)
+        parts = [f"{step} {seconds:.2f}s{'*' if background else ''}" for step, seconds, background in steps]
+        print(f"Started in {time.perf_counter() - self.started:.2f}s: {', '.join(parts)}")
+        if any(background for _, _, background in steps):
+            print("(* loaded while logging in)")
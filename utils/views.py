@@ -1,190 +1,218 @@
 import discord
 import datetime
-from database.claim import de_claim_card, claim_card
-from database.dust import get_dust_balance
-from database.cards import get_collections, fetch_cards_by_collection
-from database.utils import check_card_ownership, get_next_reset_time
-from database.shop import craft_card
-
-rarity_colors = {
-    'legendary': discord.Colour.orange(),
-    'epic': discord.Colour.purple(),
-    'rare': discord.Colour.blue(),
-    'uncommon': discord.Colour.green(),
-    'common': discord.Colour.greyple(),  
-}
-
-collection_icons= {
-    'forsaken': "https://static.wikia.nocookie.net/wowpedia/images/7/72/Forsaken_Crest.png/revision/latest?cb=20151113054325",
-    'scourge': "https://static.wikia.nocookie.net/wowpedia/images/3/37/Warcraft_III_Reforged_-_Undead_Icon.png/revision/latest?cb=20210227012440",
-    'alliance': "https://static.wikia.nocookie.net/wowpedia/images/d/da/Alliance_Crest.png/revision/latest?cb=20180710141058",
-    'night elves': "https://static.wikia.nocookie.net/wowpedia/images/b/bc/Warcraft_III_Reforged_-_Night_Elves_Icon.png/revision/latest?cb=20210227012747",
-    'scarlet crusade': "https://static.wikia.nocookie.net/wowpedia/images/7/72/Scarlet_Crusade_logo.png/revision/latest?cb=20080730021543",
-    'horde': "https://static.wikia.nocookie.net/wowpedia/images/0/08/Horde_Crest.png/revision/latest?cb=20151113053903",
-    "quel'thalas": "https://static.wikia.nocookie.net/wowpedia/images/d/d9/Icon_of_Blood.png/revision/latest?cb=20151113053547",
-    'dragon flights': "https://static.wikia.nocookie.net/wowpedia/images/a/a4/Dracthyr_Crest.png/revision/latest?cb=20221115173914",
-    'blackrock' : "https://static.wikia.nocookie.net/wowpedia/images/1/1d/Blackrock_Crest.png/revision/latest?cb=20141010174912",
-    'old gods': "https://static.wikia.nocookie.net/wowpedia/images/7/7a/Void_Elf_Crest_%28early%29.png/revision/latest?cb=20171104172306"
-}
-
-class ConfirmView(discord.ui.View):
-    def __init__(self):
+from database.aio import (
+    de_claim_card, claim_card, claim_cards, get_dust_balance, get_collections, count_owned, step_owned,
+    check_card_ownership, get_shop_inventory, craft_card
+)
+from database.catalog import CardCatalog
+from database.dust import calculate_dust_earned
+from database.shop import craft_cost, next_reset_time
+from utils.components import RoutedView, component_id, handles
+from utils.locks import user_lock
+from utils.render import card_embed, shop_embed
+
+
+NO_PERMISSION = "You do not have permission to do this."
+CARD_GONE = "That card no longer exists."
+COLLECTION_CHANGED = "Your collection has changed since this was shown."
+
+
+def collection_by_id(collection_id):
+    """The collection's name, or None for 0, which stands for every collection in custom_ids."""
+    catalog = CardCatalog.get_instance().state
+    return next((name for name in catalog.collections if catalog.collection_ids.get(name.lower()) == collection_id), None)
+
+
+class PaginatedView(RoutedView):
+    """
+    Browses a user's collection one card at a time.
+
+    The buttons carry the owner, the position, the total and the card shown. Each click finds
+    the neighbouring card in the user's ownership bitmap, in the (rarity rank, name) order, so
+    nothing is held between clicks and a cached bitmap answers without touching the database.
+    """
+    def __init__(self, user_name, user_id, server_id, collection=None):
         super().__init__()
-        self.value = None
-
-    @discord.ui.button(label="Confirm", style=discord.ButtonStyle.green)
-    async def confirm(self, button: discord.ui.Button, interaction: discord.Interaction):
-        self.value = True
-        self.stop()
-
-    @discord.ui.button(label="Cancel", style=discord.ButtonStyle.grey)
-    async def cancel(self, button: discord.ui.Button, interaction: discord.Interaction):
-        self.value = False
-        self.stop()
-
-class PaginatedView(discord.ui.View):
-    def __init__(self, cards, user_name, user_id, initial_index=0):
-        super().__init__()
-        self.original_cards = cards[:]  
-        self.cards = cards
         self.user_name = user_name
-        self.user_id = user_id 
-        self.current_index = initial_index
-        self.update_buttons()  
-
-
-    def update_buttons(self):
-        
-        if len(self.children) >= 2:
-            
-            if self.current_index > 0:
-                self.children[0].disabled = False  
-            else:
-                self.children[0].disabled = True   
+        self.user_id = user_id
+        self.server_id = server_id
+        self.collection = collection
+        self.card_id = None
+        self.position = 0
+        self.total = 0
+
+    @classmethod
+    def from_fields(cls, interaction, user_id, position, total, card_id, collection_id):
+        view = cls(interaction.user.name, int(user_id), interaction.guild.id, collection_by_id(int(collection_id)))
+        view.position, view.total, view.card_id = int(position), int(total), int(card_id)
+        return view
+
+    @property
+    def state(self):
+        collection_id = CardCatalog.get_instance().collection_ids.get(self.collection.lower(), 0) if self.collection else 0
+        return self.user_id, self.position, self.total, self.card_id, collection_id
+
+    async def load(self, after=None, position=0):
+        """Shows the first card after the given card id, or the very first one. Returns False if there is none."""
+        self.total = await count_owned(self.user_id, self.server_id, self.collection)
+        card_id = await step_owned(self.user_id, self.server_id, after, 1, self.collection)
+        if card_id is None:
+            return False
+        self.card_id = card_id
+        self.position = min(position, self.total - 1)
+        self.update_buttons()
+        return True
 
-            
-            if self.current_index < len(self.cards) - 1:
-                self.children[1].disabled = False  
-            else:
-                self.children[1].disabled = True   
+    async def restart(self, interaction, content):
+        """Shows the collection again from its first card, for a click on buttons that no longer match it."""
+        if await self.load():
+            await interaction.response.edit_message(content=content, embed=self.create_embed(), view=self)
         else:
-            
-            print("Warning: The children list does not contain enough elements.")
+            await interaction.response.edit_message(content=f"{content} No cards left.", embed=None, view=None)
 
-            
+    async def move(self, step):
+        card_id = await step_owned(self.user_id, self.server_id, self.card_id, step, self.collection)
+        if card_id is None:
+            return False
+        self.card_id = card_id
+        self.position = max(0, min(self.position + step, self.total - 1))
+        self.update_buttons()
+        return True
 
-    @discord.ui.button(label="Previous", style=discord.ButtonStyle.grey)
-    async def show_previous(self, button: discord.ui.Button, interaction: discord.Interaction):
-        if interaction.user.id == self.user_id and self.current_index > 0:
-            self.current_index -= 1
-            self.update_buttons()
-            await interaction.response.edit_message(embed=self.create_embed(), view=self)
+    def update_buttons(self):
+        self.clear_items()
+        state = self.state
+        self.button("Previous", component_id('list.previous', *state), disabled=self.position <= 0)
+        self.button("Next", component_id('list.next', *state), disabled=self.position >= self.total - 1)
+        self.button("Remove", component_id('list.remove', *state), style=discord.ButtonStyle.danger)
+        self.button("Filter", component_id('list.filter', *state), style=discord.ButtonStyle.blurple)
+
+    def confirm_removal(self):
+        self.clear_items()
+        self.button("Confirm", component_id('list.unclaim', *self.state), style=discord.ButtonStyle.green)
+        self.button("Cancel", component_id('list.cancel', *self.state))
+
+    @staticmethod
+    @handles('list.previous')
+    async def show_previous(interaction, *fields):
+        view = PaginatedView.from_fields(interaction, *fields)
+        if interaction.user.id != view.user_id:
+            await interaction.response.send_message(NO_PERMISSION, ephemeral=True)
+        elif view.position > 0 and await view.move(-1):
+            await interaction.response.edit_message(embed=view.create_embed(), view=view)
         else:
-            await interaction.response.send_message("You do not have permission to do this.", ephemeral=True)
-
-    @discord.ui.button(label="Next", style=discord.ButtonStyle.grey)
-    async def show_next(self, button: discord.ui.Button, interaction: discord.Interaction):
-        if interaction.user.id == self.user_id and self.current_index < len(self.cards) - 1:
-            self.current_index += 1
-            self.update_buttons()
-            await interaction.response.edit_message(embed=self.create_embed(), view=self)
+            await view.restart(interaction, COLLECTION_CHANGED)
+
+    @staticmethod
+    @handles('list.next')
+    async def show_next(interaction, *fields):
+        view = PaginatedView.from_fields(interaction, *fields)
+        if interaction.user.id != view.user_id:
+            await interaction.response.send_message(NO_PERMISSION, ephemeral=True)
+        elif view.position < view.total - 1 and await view.move(1):
+            await interaction.response.edit_message(embed=view.create_embed(), view=view)
         else:
-            await interaction.response.send_message("You do not have permission to do this.", ephemeral=True)
-
-    @discord.ui.button(label="Remove", style=discord.ButtonStyle.danger, custom_id="remove")
-    async def remove_card(self, button: discord.ui.Button, interaction: discord.Interaction):
-        if interaction.user.id == self.user_id:
-            card = self.cards[self.current_index]
-            card_name = card[0]  
-
-            
-            confirm_view = ConfirmView()
-            await interaction.response.send_message(f"Are you sure you want to un-claim {card_name}?", view=confirm_view, ephemeral=True)
-            await confirm_view.wait()
-
-            if confirm_view.value:
-                
-                if de_claim_card(interaction.user.id, card_name, interaction.guild.id):
-                    await interaction.followup.send(f"{card_name} has been un-claimed successfully.", ephemeral=True)
-                else:
-                    await interaction.followup.send(f"Failed to un-claim {card_name}.", ephemeral=True)
-            else:
-                
-                await interaction.followup.send(f"un-claiming of {card_name} cancelled.", ephemeral=True)
-
-            
-            await interaction.edit_original_response(view=None)
+            await view.restart(interaction, COLLECTION_CHANGED)
+
+    @staticmethod
+    @handles('list.remove')
+    async def remove_card(interaction, *fields):
+        view = PaginatedView.from_fields(interaction, *fields)
+        if interaction.user.id == view.user_id:
+            card = CardCatalog.get_instance().get(view.card_id)
+            if card is None:
+                await view.restart(interaction, CARD_GONE)
+                return
+            view.confirm_removal()
+            await interaction.response.edit_message(content=f"Are you sure you want to un-claim {card.name}?", embed=view.create_embed(), view=view)
         else:
-            await interaction.response.send_message("You do not have permission to do this.", ephemeral=True)
+            await interaction.response.send_message(NO_PERMISSION, ephemeral=True)
+
+    @staticmethod
+    @handles('list.unclaim')
+    async def confirm_remove(interaction, *fields):
+        view = PaginatedView.from_fields(interaction, *fields)
+        if interaction.user.id != view.user_id:
+            await interaction.response.send_message(NO_PERMISSION, ephemeral=True)
+            return
+
+        card = CardCatalog.get_instance().get(view.card_id)
+        if card is None:
+            await view.restart(interaction, CARD_GONE)
+            return
+        async with user_lock(interaction.user.id, interaction.guild.id):
+            removed = await de_claim_card(interaction.user.id, card.id, interaction.guild.id)
+        if not removed:
+            view.update_buttons()
+            await interaction.response.edit_message(content=f"Failed to un-claim {card.name}.", embed=view.create_embed(), view=view)
+            return
 
-    @discord.ui.button(label="Filter", style=discord.ButtonStyle.blurple)
-    async def filter_collection(self, button: discord.ui.Button, interaction: discord.Interaction):
-        if interaction.user.id == self.user_id:
-            collections = get_collections()  
-            select_menu = discord.ui.Select(
+        # Show the card that followed the removed one, or failing that the one before.
+        if await view.load(after=card.id, position=view.position) or (
+                view.total and await view.move(-1)):
+            await interaction.response.edit_message(content=f"{card.name} has been un-claimed successfully.", embed=view.create_embed(), view=view)
+        else:
+            await interaction.response.edit_message(content=f"{card.name} has been un-claimed successfully. No cards left.", embed=None, view=None)
+
+    @staticmethod
+    @handles('list.cancel')
+    async def cancel_remove(interaction, *fields):
+        view = PaginatedView.from_fields(interaction, *fields)
+        if interaction.user.id == view.user_id:
+            card = CardCatalog.get_instance().get(view.card_id)
+            if card is None:
+                await view.restart(interaction, CARD_GONE)
+                return
+            view.update_buttons()
+            await interaction.response.edit_message(content=f"un-claiming of {card.name} cancelled.", embed=view.create_embed(), view=view)
+        else:
+            await interaction.response.send_message(NO_PERMISSION, ephemeral=True)
+
+    @staticmethod
+    @handles('list.filter')
+    async def filter_collection(interaction, *fields):
+        view = PaginatedView.from_fields(interaction, *fields)
+        if interaction.user.id == view.user_id:
+            collections = await get_collections()
+            view.update_buttons()
+            view.add_item(discord.ui.Select(
+                custom_id=component_id('list.collection', view.user_id),
                 placeholder="Choose a collection",
                 options=[discord.SelectOption(label=collection) for collection in collections]
-            )
-            select_menu.callback = self.on_collection_select
-            self.add_item(select_menu)
-            self.update_buttons()
-            await interaction.response.edit_message(embed=self.create_embed(), view=self)
+            ))
+            await interaction.response.edit_message(embed=view.create_embed(), view=view)
         else:
-            await interaction.response.send_message("You do not have permission to do this.", ephemeral=True)
-
+            await interaction.response.send_message(NO_PERMISSION, ephemeral=True)
 
-    def filter_cards_by_collection(self, collection_name, interaction):
-        self.cards = fetch_cards_by_collection(self.user_id, collection_name)
-        if not self.cards:
-            
-            return False
-        self.current_index = 0
-        return True
-
-    async def on_collection_select(self, interaction: discord.Interaction):
+    @staticmethod
+    @handles('list.collection')
+    async def on_collection_select(interaction, user_id):
+        if interaction.user.id != int(user_id):
+            await interaction.response.send_message(NO_PERMISSION, ephemeral=True)
+            return
         select = interaction.data['values'][0]
-        if not self.filter_cards_by_collection(select, interaction):
-            
+        view = PaginatedView(interaction.user.name, interaction.user.id, interaction.guild.id, select)
+        if not await view.load():
             await interaction.response.send_message(f"No cards found in the collection '{select}'.", ephemeral=True)
             return
-        self.remove_select_menu()
-        self.update_buttons()
-        await interaction.response.edit_message(embed=self.create_embed(), view=self)
-        
-    def remove_select_menu(self):
-        self.children = [child for child in self.children if not isinstance(child, discord.ui.Select)]
-        
-        
+        await interaction.response.edit_message(embed=view.create_embed(), view=view)
+
     def create_embed(self):
-        card = self.cards[self.current_index]
-        name, collection_name, title, quote, image_url, rarity = card
-        color = rarity_colors.get(rarity.lower(), discord.Colour.default())  
-        icon_url = collection_icons.get(collection_name.lower(), "")  
-
-        embed = discord.Embed(
-            title=name,  
-            description=title,  
-            color=color  
-        )
-        embed.set_thumbnail(url=icon_url)  
-        embed.set_author(name=collection_name)  
-        embed.set_image(url=image_url)  
-        embed.set_footer(text=quote)  
-
-        
-        embed.set_footer(text=f"{embed.footer.text} | Card {self.current_index + 1} of {len(self.cards)} | {self.user_name}'s collection")
-        return embed
-
-class ClaimView(discord.ui.View):  
+        card = CardCatalog.get_instance().get(self.card_id)
+        return card_embed(card, f"{card.quote} | Card {self.position + 1} of {self.total} | {self.user_name}'s collection")
+
+class ClaimView(RoutedView):  
     def __init__(self, card_id, user_id):
         super().__init__()
-        self.card_id = card_id
-        self.user_id = user_id  
-
-    @discord.ui.button(label="Claim", style=discord.ButtonStyle.success, emoji="🏆")
-    async def claim_callback(self, button, interaction):
-        if str(interaction.user.id) == self.user_id:
-            if claim_card(interaction.user.id, self.card_id, interaction.guild.id):
+        self.button("Claim", component_id('claim', card_id, user_id), style=discord.ButtonStyle.success, emoji="🏆")
+
+    @staticmethod
+    @handles('claim')
+    async def claim_callback(interaction, card_id, user_id):
+        if interaction.user.id == int(user_id):
+            async with user_lock(interaction.user.id, interaction.guild.id):
+                claimed = await claim_card(interaction.user.id, int(card_id), interaction.guild.id)
+            if claimed:
                 await interaction.response.send_message("Card claimed!", ephemeral=True)
             else:
                 await interaction.response.send_message("Card not available.", ephemeral=True)
@@ -192,76 +220,175 @@ class ClaimView(discord.ui.View):
             await interaction.response.send_message("You cannot claim this card as it was not requested by you.", ephemeral=True)
 
 
-class ShopView(discord.ui.View):
-    def __init__(self, shop_inventory, user_id, server_id, initial_index=0):
+class PullView(RoutedView):
+    """
+    One page per card of a multi-pull; the new cards can be claimed one at a time or all at once.
+
+    The buttons carry the pulled card ids and one letter per card: n(ew), c(laimed) or d(uplicate).
+    """
+    def __init__(self, card_ids, flags, user_id, current_index=0):
         super().__init__()
-        self.shop_inventory = shop_inventory
+        self.card_ids = list(card_ids)
+        self.flags = flags
         self.user_id = user_id
-        self.server_id = server_id
-        self.current_index = initial_index
+        self.current_index = current_index
         self.update_buttons()
 
-    def update_buttons(self):
-        
-        self.children[0].disabled = self.current_index <= 0
+    @classmethod
+    def from_pull(cls, cards, new_card_ids, user_id):
+        new_card_ids = set(new_card_ids)
+        return cls([card.id for card in cards], "".join('n' if card.id in new_card_ids else 'd' for card in cards), user_id)
+
+    @classmethod
+    def from_fields(cls, user_id, current_index, card_ids, flags):
+        return cls([int(card_id) for card_id in card_ids.split('.')], flags, int(user_id), int(current_index))
 
-        
-        self.children[1].disabled = self.current_index >= len(self.shop_inventory) - 1
+    @property
+    def claimable(self):
+        return [card_id for card_id, flag in zip(self.card_ids, self.flags) if flag == 'n']
 
-        card_id, cost = self.shop_inventory[self.current_index][0], self.shop_inventory[self.current_index][-1]
-        
-        server_id_int = int(self.server_id)
+    def update_buttons(self):
+        self.clear_items()
+        state = (self.user_id, self.current_index, ".".join(map(str, self.card_ids)), self.flags)
+        self.button("Previous", component_id('pull.previous', *state), disabled=self.current_index <= 0)
+        self.button("Next", component_id('pull.next', *state), disabled=self.current_index >= len(self.card_ids) - 1)
+        self.button("Claim", component_id('pull.claim', *state), style=discord.ButtonStyle.success, emoji="🏆",
+                    disabled=self.flags[self.current_index] != 'n')
+        self.button("Claim all", component_id('pull.claim_all', *state), style=discord.ButtonStyle.success,
+                    disabled=not self.claimable)
+
+    async def show(self, interaction, index):
+        self.current_index = index
+        self.update_buttons()
+        await interaction.response.edit_message(embed=self.create_embed(), view=self)
+
+    async def claim(self, interaction, card_ids):
+        async with user_lock(interaction.user.id, interaction.guild.id):
+            claimed = await claim_cards(interaction.user.id, card_ids, interaction.guild.id)
+        # Only the cards actually claimed: one that failed keeps its button, so it can be tried again.
+        self.flags = "".join('c' if card_id in claimed else flag for card_id, flag in zip(self.card_ids, self.flags))
+        self.update_buttons()
+        await interaction.response.edit_message(embed=self.create_embed(), view=self)
+        if claimed:
+            names = ", ".join(CardCatalog.get_instance().get(card_id).name for card_id in claimed)
+            await interaction.followup.send(f"Claimed {names}!", ephemeral=True)
+        else:
+            await interaction.followup.send("Card not available.", ephemeral=True)
+
+    @staticmethod
+    @handles('pull.previous')
+    async def show_previous(interaction, *fields):
+        view = PullView.from_fields(*fields)
+        if interaction.user.id == view.user_id and view.current_index > 0:
+            await view.show(interaction, view.current_index - 1)
+        else:
+            await interaction.response.send_message(NO_PERMISSION, ephemeral=True)
+
+    @staticmethod
+    @handles('pull.next')
+    async def show_next(interaction, *fields):
+        view = PullView.from_fields(*fields)
+        if interaction.user.id == view.user_id and view.current_index < len(view.card_ids) - 1:
+            await view.show(interaction, view.current_index + 1)
+        else:
+            await interaction.response.send_message(NO_PERMISSION, ephemeral=True)
+
+    @staticmethod
+    @handles('pull.claim')
+    async def claim_callback(interaction, *fields):
+        view = PullView.from_fields(*fields)
+        if interaction.user.id == view.user_id:
+            await view.claim(interaction, [view.card_ids[view.current_index]])
+        else:
+            await interaction.response.send_message("You cannot claim this card as it was not requested by you.", ephemeral=True)
 
-        owns_card = check_card_ownership(self.user_id, card_id, server_id_int)
-        has_enough_dust = get_dust_balance(self.user_id, server_id_int) >= cost
+    @staticmethod
+    @handles('pull.claim_all')
+    async def claim_all_callback(interaction, *fields):
+        view = PullView.from_fields(*fields)
+        if interaction.user.id == view.user_id:
+            await view.claim(interaction, view.claimable)
+        else:
+            await interaction.response.send_message("You cannot claim these cards as they were not requested by you.", ephemeral=True)
 
-        self.children[2].disabled = owns_card or not has_enough_dust
+    def create_embed(self):
+        card = CardCatalog.get_instance().get(self.card_ids[self.current_index])
+        status = {
+            'n': "New!",
+            'c': "Claimed",
+            'd': f"Duplicate, +{calculate_dust_earned(card.rarity)} dust",
+        }[self.flags[self.current_index]]
+        return card_embed(card, f"{card.quote} | Card {self.current_index + 1} of {len(self.card_ids)} | {status}")
 
 
-    @discord.ui.button(label="Previous", style=discord.ButtonStyle.grey)
-    async def show_previous(self, button, interaction):
-        if self.current_index > 0:
-            self.current_index -= 1
-            self.update_buttons()
-            await interaction.response.edit_message(embed=self.create_embed(), view=self)
+class ShopView(RoutedView):
+    def __init__(self, shop_inventory, user_id, server_id, initial_index=0):
+        super().__init__()
+        self.shop_inventory = shop_inventory
+        self.user_id = user_id
+        self.server_id = server_id
+        self.current_index = initial_index
 
-    @discord.ui.button(label="Next", style=discord.ButtonStyle.grey)
-    async def show_next(self, button, interaction):
-        if self.current_index < len(self.shop_inventory) - 1:
-            self.current_index += 1
-            self.update_buttons()
-            await interaction.response.edit_message(embed=self.create_embed(), view=self)
+    @classmethod
+    async def from_fields(cls, interaction, user_id, current_index):
+        server_id = interaction.guild.id
+        return cls(await get_shop_inventory(server_id), int(user_id), server_id, int(current_index))
 
-    @discord.ui.button(label="Craft", style=discord.ButtonStyle.green)
-    async def craft_card(self, button, interaction):
+    async def update_buttons(self):
         card = self.shop_inventory[self.current_index]
-        card_id, card_cost = card[0], card[-1]  
-        if craft_card(interaction.user.id, card_id, interaction.guild.id, card_cost):
-            await interaction.response.send_message(f"You have crafted {card[1]}!", ephemeral=True)
+        card_id, cost = card.id, craft_cost(card.rarity)
+
+        owns_card = await check_card_ownership(self.user_id, card_id, self.server_id)
+        has_enough_dust = await get_dust_balance(self.user_id, self.server_id) >= cost
+
+        self.clear_items()
+        self.button("Previous", component_id('shop.previous', self.user_id, self.current_index), disabled=self.current_index <= 0)
+        self.button("Next", component_id('shop.next', self.user_id, self.current_index),
+                    disabled=self.current_index >= len(self.shop_inventory) - 1)
+        self.button("Craft", component_id('shop.craft', self.user_id, self.current_index, card_id), style=discord.ButtonStyle.green,
+                    disabled=owns_card or not has_enough_dust)
+
+    @staticmethod
+    @handles('shop.previous')
+    async def show_previous(interaction, *fields):
+        view = await ShopView.from_fields(interaction, *fields)
+        if view.current_index > 0:
+            view.current_index -= 1
+            await view.update_buttons()
+            await interaction.response.edit_message(embed=view.create_embed(), view=view)
+
+    @staticmethod
+    @handles('shop.next')
+    async def show_next(interaction, *fields):
+        view = await ShopView.from_fields(interaction, *fields)
+        if view.current_index < len(view.shop_inventory) - 1:
+            view.current_index += 1
+            await view.update_buttons()
+            await interaction.response.edit_message(embed=view.create_embed(), view=view)
+
+    @staticmethod
+    @handles('shop.craft')
+    async def craft_card(interaction, user_id, current_index, card_id):
+        view = await ShopView.from_fields(interaction, user_id, current_index)
+        card = view.shop_inventory[view.current_index] if view.current_index < len(view.shop_inventory) else None
+        if card is None or card.id != int(card_id):
+            await interaction.response.send_message("The shop has changed since this message was sent; use /shop again.", ephemeral=True)
+            return
+        card_cost = craft_cost(card.rarity)
+        async with user_lock(interaction.user.id, interaction.guild.id):
+            crafted = await craft_card(interaction.user.id, card.id, interaction.guild.id, card_cost)
+        if crafted:
+            await interaction.response.send_message(f"You have crafted {card.name}!", ephemeral=True)
         else:
             await interaction.response.send_message("Not enough dust or an error occurred.", ephemeral=True)
-        self.update_buttons()
 
     def create_embed(self):
-            card = self.shop_inventory[self.current_index]
-            card_id, name, collection_name, title, quote, image_url, rarity, cost = card
-
-            color = rarity_colors.get(rarity.lower(), discord.Colour.default())
-
-            embed = discord.Embed(
-                title=name,
-                description=title,
-                color=color
-            )
-            embed.set_thumbnail(url=image_url)
-            embed.set_author(name=collection_name)
-
-            
-            reset_time = get_next_reset_time(self.server_id)
-            time_remaining = reset_time - datetime.datetime.now()
-            hours, remainder = divmod(int(time_remaining.total_seconds()), 3600)
-            minutes, seconds = divmod(remainder, 60)
+        card = self.shop_inventory[self.current_index]
+        cost = craft_cost(card.rarity)
 
-            embed.set_footer(text=f"Cost: {cost} dust | Card {self.current_index + 1} of {len(self.shop_inventory)} | Shop resets in {hours}h {minutes}m {seconds}s")
+        # Every shop rotates on the hour, so the reset time is computed, not looked up.
+        time_remaining = next_reset_time() - datetime.datetime.now()
+        hours, remainder = divmod(int(time_remaining.total_seconds()), 3600)
+        minutes, seconds = divmod(remainder, 60)
 
-            return embed
+        return shop_embed(card, f"Cost: {cost} dust | Card {self.current_index + 1} of {len(self.shop_inventory)} | Shop resets in {hours}h {minutes}m {seconds}s")